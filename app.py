@@ -1,75 +1,108 @@
-import os
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
 from database import db
-from model import Question, User, QuizResult
-import random
-from itertools import groupby
-
-# home.html からコピーした章のリスト
-# 順序を維持するためにリスト・オブ・タプルを使用
-CHAPTERS = [
-    (1, "1. やる気を高めよう"),
-    (2, "2. Python インタプリタを使う"),
-    (3, "3. 形式ばらない Python の紹介"),
-    (4, "4. その他の制御フローツール"),
-    (5, "5. データ構造"),
-    (6, "6. モジュール"),
-    (7, "7. 入力と出力"),
-    (8, "8. エラーと例外"),
-    (9, "9. クラス"),
-    (10, "10. 標準ライブラリミニツアー"),
-    (11, "11. 標準ライブラリミニツアー --- その 2"),
-    (12, "12. 仮想環境とパッケージ"),
-    (14, "14. 対話入力編集と履歴置換"),
-]
-
-app = Flask(__name__)
-app.secret_key = "test123"
-
-# DB設定を追加
-basedir = os.path.abspath(os.path.dirname(__file__))
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, "instance", "quiz.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
+from model import Question, User
+from question_bank import question_bank
+import migrations
+from chapters import CHAPTERS
+from mastery import mastered_question_ids
+import spaced_repetition
+from grading import answered_question_ids, grade_and_record, check_items, MISSING_DATA, QUESTION_NOT_FOUND
+from result_writer import result_writer
+from fragment_cache import fragment_cache
+from http_cache import not_modified, with_cache_headers
+import compression
+import identity
+from identity import current_user, is_admin, login_user, logout_user, forget_user, ADMIN_ROLE, DELETED_ROLE
+from password_pool import password_pool, PoolBusy
+from rate_limit import rate_limiter
+from metrics import metrics
+import rollups
+from bulk_questions import apply_operations
+from import_questions import iter_records
+import question_search
+import history
+import results_export
+import roster
+from user_deletion import user_deleter, mark_deleted
+from settings import DEV_SECRET_KEY, create_base_app
+
+main = Blueprint("main", __name__)
+
+
+def create_app(config=None):
+    """Web アプリを作る。設定は settings.py（環境変数 MYQUEST_* と config の辞書）から読む。"""
+    app = create_base_app(config)
+    if app.config["SECRET_KEY"] == DEV_SECRET_KEY:
+        app.logger.warning("MYQUEST_SECRET_KEY が未設定のため開発用の鍵でセッションに署名します")
+    metrics.init_app(app)
+    migrations.init_app(app)
+    question_bank.init_app(app)
+    result_writer.init_app(app)
+    fragment_cache.init_app(app)
+    compression.init_app(app)
+    identity.init_app(app)
+    password_pool.init_app(app)
+    rate_limiter.init_app(app)
+    user_deleter.init_app(app)
+    app.register_blueprint(main)
+    return app
+
 
 # ログイン
-@app.route("/")
+@main.route("/")
 def login():
     return render_template("login.html")
 
-@app.route("/try_login", methods=["post"])
+@main.route("/try_login", methods=["post"])
 def try_login():
     email = request.form.get("email")
     pw = request.form.get("password")
 
+    # パスワードの照合の前に、IP アドレスごとと入力されたメールアドレスごとの回数を数える
+    retry_after = rate_limiter.hit("login", user=email.strip().lower() if email else None)
+    if retry_after is not None:
+        return render_template("login.html", error=f"ログインの試行が多すぎます。{retry_after} 秒後にもう一度お試しください"), 429, {"Retry-After": str(retry_after)}
+
     user = User.query.filter_by(email=email).first()
 
-    if user and user.check_password(pw):
-        session["user"] = user.email
-        session["nickname"] = user.nickname # ニックネームがなければそのままNoneまたは空文字列
-        return redirect(url_for("home"))
+    # パスワードの照合はプロセスプールで行う。混み合っているときはすぐに再試行を促す
+    try:
+        ok = bool(user and pw and user.role != DELETED_ROLE and password_pool.check(user.password_hash, pw))
+    except PoolBusy:
+        return render_template("login.html", error="ただいま混み合っています。少し待ってからもう一度お試しください"), 503, {"Retry-After": "1"}
+
+    if ok:
+        # 古い方式のハッシュは、パスワードが分かっているこの時点で作り直す
+        if password_pool.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = password_pool.generate(pw)
+                db.session.commit()
+            except PoolBusy:
+                pass # 次回のログインで作り直す
+        # ユーザーIDとロールもセッションに保存する
+        login_user(user)
+        return redirect(url_for("main.home"))
     else:
         return render_template("login.html", error="ログインに失敗しました")
     
 
-@app.route("/logout")
+@main.route("/logout")
 def logout():
-    session.pop("user", None)
-    session.pop("nickname", None)
+    logout_user()
     return redirect("/")
 
-@app.route("/change_user_info", methods=["GET", "POST"])
+@main.route("/change_user_info", methods=["GET", "POST"])
 def change_user_info():
     if "user" not in session:
         flash("ログインしてください。", "warning")
         return redirect("/")
 
-    current_user_email = session["user"]
-    user = User.query.filter_by(email=current_user_email).first()
+    me = current_user()
+    user = db.session.get(User, me.id) if me else None
 
     if not user:
-        session.pop("user", None)
-        session.pop("nickname", None)
+        logout_user()
         flash("ユーザーが見つかりません。", "danger")
         return redirect("/")
 
@@ -93,26 +126,32 @@ def change_user_info():
             if new_password != confirm_password:
                 flash("新しいパスワードが一致しません。", "danger")
                 return render_template("change_password.html", email=user.email, nickname=user.nickname)
-            user.set_password(new_password)
+            try:
+                user.password_hash = password_pool.generate(new_password)
+            except PoolBusy:
+                db.session.rollback()
+                flash("ただいま混み合っています。少し待ってからもう一度お試しください。", "warning")
+                return redirect(url_for("main.change_user_info"))
             flash("パスワードを更新しました。", "success")
         
         db.session.commit()
+        forget_user(user.id)
         flash("ユーザー情報を更新しました。", "success")
-        return redirect(url_for("change_user_info"))
+        return redirect(url_for("main.change_user_info"))
 
     # GET request
     return render_template("change_password.html", email=user.email, nickname=user.nickname)
 
 
 # ホーム
-@app.route("/home")
+@main.route("/home")
 def home():
     if "user" not in session:
         return redirect("/")
     nickname = session.get("nickname", "Guest")
-    return render_template("home.html", nickname=nickname, email=session["user"])
+    return render_template("home.html", nickname=nickname, email=session["user"], is_admin=is_admin())
 
-@app.route("/home_action", methods=["POST"])
+@main.route("/home_action", methods=["POST"])
 def home_action():
     if "user" not in session:
         return redirect("/")
@@ -122,17 +161,17 @@ def home_action():
         return redirect(selected_option)
     else:
         # Handle case where no option was selected, though a default is set in HTML
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
 # 教材
-@app.route("/material")
+@main.route("/material")
 def material():
     if "user" not in session:
         return redirect("/")
     return render_template("material.html")
 
 # 章末テスト
-@app.route("/section_test/<category>")
+@main.route("/section_test/<category>")
 def section_test(category):
     if "user" not in session:
         return redirect("/")
@@ -143,17 +182,14 @@ def section_test(category):
     except (ValueError, TypeError):
         num_questions = 10 # 無効な値の場合はデフォルトの10問
 
-    q_list = Question.query.filter_by(category=category).all()
+    # 指定された問題数をランダムに選ぶ（IDだけを抽選してから問題を取り出す）
+    q_list = question_bank.sample(num_questions, category=category)
     if not q_list:
         return f"カテゴリ「{category}」の問題がDBにありません"
     
-    # 指定された問題数をランダムに選ぶ
-    num_to_sample = min(len(q_list), num_questions)
-    q_list = random.sample(q_list, num_to_sample)
-    
     return render_template("section_test.html", questions=q_list, category_name=category)
 
-@app.route("/section_test", methods=["POST"])
+@main.route("/section_test", methods=["POST"])
 def section_test_redirect():
     if "user" not in session:
         return redirect("/")
@@ -162,202 +198,130 @@ def section_test_redirect():
     num_questions = request.form.get("num_questions", 10) # デフォルトは10問
     
     if category:
-        return redirect(url_for("section_test", category=category, num_questions=num_questions))
+        return redirect(url_for("main.section_test", category=category, num_questions=num_questions))
     else:
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
 
-@app.route("/submit_section_test", methods=["POST"])
+@main.route("/submit_section_test", methods=["POST"])
 def submit_section_test():
     if "user" not in session:
         return redirect("/")
 
     answers = request.form
     category_name = answers.get("category_name", "")
-    question_ids = [key.split('_')[1] for key in answers.keys() if key.startswith('answer_')]
+    question_ids = answered_question_ids(answers)
     
     if not question_ids:
         if category_name:
-            return redirect(url_for("section_test", category=category_name))
+            return redirect(url_for("main.section_test", category=category_name))
         else:
-            return redirect(url_for("home"))
+            return redirect(url_for("main.home"))
 
-    results = []
-    questions = Question.query.filter(Question.id.in_(question_ids)).all()
-    question_map = {str(q.id): q for q in questions}
-
-    # 現在のユーザーのIDを取得
-    current_user_email = session["user"]
-    current_user = User.query.filter_by(email=current_user_email).first()
-    if not current_user:
+    # 現在のユーザー（リクエストごとに一度だけ解決される）
+    me = current_user()
+    if not me:
         return redirect("/") # ユーザーが見つからない場合はログインページへ
 
-    score = 0
-    for q_id in question_ids:
-        question = question_map.get(q_id)
-        if question:
-            user_answer_val = answers.get(f'answer_{q_id}')
-            if user_answer_val is None:
-                user_answer_val = -1
-            else:
-                user_answer_val = int(user_answer_val)
-            
-            is_correct = (user_answer_val == question.correct)
-            if is_correct:
-                score += 1
-
-            choices = [question.choice1, question.choice2, question.choice3, question.choice4]
-            
-            user_choice_text = choices[user_answer_val - 1] if 0 < user_answer_val <= 4 else "未回答"
-            correct_choice_text = choices[question.correct - 1] if 0 < question.correct <= 4 else ""
-
-            results.append({
-                "question": question,
-                "user_answer": user_answer_val,
-                "user_choice_text": user_choice_text,
-                "correct_answer": question.correct,
-                "correct_choice_text": correct_choice_text,
-                "is_correct": is_correct
-            })
-
-            # QuizResultを保存
-            from model import QuizResult # Import inside function to avoid circular dependency
-            quiz_result = QuizResult(
-                user_id=current_user.id,
-                question_id=question.id,
-                is_correct=is_correct
-            )
-            db.session.add(quiz_result)
-    
-    db.session.commit() # すべての結果をコミット
-    
-    total = len(questions)
-    percentage = (score / total) * 100 if total > 0 else 0
+    # 採点と保存（quiz_results と習熟状況をまとめて書き込む）
+    graded = grade_and_record(me.id, answers)
+    questions = graded.questions
     
     if not category_name and questions:
         category_name = questions[0].category
 
     return render_template("section_test.html", 
-        results=results, 
+        results=graded.results, 
         category_name=category_name,
-        score=score,
-        total=total,
-        percentage=f"{percentage:.1f}"
+        score=graded.score,
+        total=graded.total,
+        percentage=graded.percentage
     )
 
 
-@app.route("/check_answer", methods=["POST"])
+@main.route("/check_answer", methods=["POST"])
 def check_answer():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("check_answer")
+    if limited is not None:
+        return limited
     
-    data = request.get_json()
-    question_id = data.get("question_id")
-    user_answer = data.get("user_answer")
+    # 1問だけの check_answer_batch として採点する
+    data = request.get_json(silent=True) or {}
+    result = check_items([data]).results[0]
+    if result.get("error") == MISSING_DATA:
+        return jsonify({"error": MISSING_DATA}), 400
+    if result.get("error") == QUESTION_NOT_FOUND:
+        return jsonify({"error": QUESTION_NOT_FOUND}), 404
 
-    if not question_id or not user_answer:
-        return jsonify({"error": "Missing data"}), 400
+    return jsonify({
+        "correct": result["correct"],
+        "correct_answer": result["correct_answer"],
+        "correct_choice_text": result["correct_choice_text"]
+    })
 
-    question = Question.query.get(question_id)
-    if not question:
-        return jsonify({"error": "Question not found"}), 404
+@main.route("/check_answer_batch", methods=["POST"])
+def check_answer_batch():
+    """{"answers": [{question_id, user_answer}, ...], "record": true/false} をまとめて採点する。"""
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
 
-    is_correct = (int(user_answer) == question.correct)
-    
-    # 正解の選択肢のテキストを取得
-    correct_choice_text = ""
-    if question.correct == 1:
-        correct_choice_text = question.choice1
-    elif question.correct == 2:
-        correct_choice_text = question.choice2
-    elif question.correct == 3:
-        correct_choice_text = question.choice3
-    elif question.correct == 4:
-        correct_choice_text = question.choice4
+    data = request.get_json(silent=True)
+    items = data.get("answers") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Missing data"}), 400
+    if len(items) > current_app.config["CHECK_ANSWER_BATCH_MAX"]:
+        return jsonify({"error": f"一度に採点できるのは {current_app.config['CHECK_ANSWER_BATCH_MAX']} 問までです"}), 413
+    # 総当たりで正解を調べられないように、採点する問題の数で数える
+    limited = rate_limiter.limited("check_answer", cost=len(items))
+    if limited is not None:
+        return limited
+
+    checked = check_items(items)
+
+    # record が指定されたときは採点結果を quiz_results と習熟状況に保存する
+    if isinstance(data, dict) and data.get("record"):
+        me = current_user()
+        if not me:
+            return jsonify({"error": "Unauthorized"}), 401
+        result_writer.submit(me.id, checked.outcomes)
 
     return jsonify({
-        "correct": is_correct,
-        "correct_answer": question.correct,
-        "correct_choice_text": correct_choice_text
+        "results": checked.results,
+        "score": checked.score,
+        "total": len(checked.outcomes),
     })
 
-from sqlalchemy import desc
-from itertools import groupby
-
-# ... (他のルートは変更なし) ...
-
 # 過去演習
-@app.route("/practice", methods=["GET", "POST"])
+@main.route("/practice", methods=["GET", "POST"])
 def practice():
     if "user" not in session:
         return redirect("/")
 
-    current_user_email = session.get("user")
-    current_user = User.query.filter_by(email=current_user_email).first()
-    if not current_user:
+    me = current_user()
+    if not me:
         flash("ユーザーが見つかりません。", "danger")
         return redirect("/")
 
     if request.method == "POST":
         # --- 回答処理 ---
         answers = request.form
-        question_ids = [key.split('_')[1] for key in answers.keys() if key.startswith('answer_')]
+        question_ids = answered_question_ids(answers)
         
         if not question_ids:
-            return redirect(url_for("practice", **request.args))
-
-        results = []
-        questions = Question.query.filter(Question.id.in_(question_ids)).all()
-        question_map = {str(q.id): q for q in questions}
-
-        score = 0
-        for q_id in question_ids:
-            question = question_map.get(q_id)
-            if question:
-                user_answer_val = answers.get(f'answer_{q_id}')
-                if user_answer_val is None:
-                    user_answer_val = -1
-                else:
-                    user_answer_val = int(user_answer_val)
-                
-                is_correct = (user_answer_val == question.correct)
-                if is_correct:
-                    score += 1
-
-                choices = [question.choice1, question.choice2, question.choice3, question.choice4]
-                
-                user_choice_text = choices[user_answer_val - 1] if 0 < user_answer_val <= 4 else "未回答"
-                correct_choice_text = choices[question.correct - 1] if 0 < question.correct <= 4 else ""
-
-                results.append({
-                    "question": question,
-                    "user_answer": user_answer_val,
-                    "user_choice_text": user_choice_text,
-                    "correct_answer": question.correct,
-                    "correct_choice_text": correct_choice_text,
-                    "is_correct": is_correct
-                })
-
-                quiz_result = QuizResult(
-                    user_id=current_user.id,
-                    question_id=question.id,
-                    is_correct=is_correct
-                )
-                db.session.add(quiz_result)
-        
-        db.session.commit()
+            return redirect(url_for("main.practice", **request.args))
+
+        graded = grade_and_record(me.id, answers)
 
         num_questions_for_retry = request.form.get('num_questions')
         practice_type_for_retry = request.form.get('type')
 
-        total = len(questions)
-        percentage = (score / total) * 100 if total > 0 else 0
-        
         return render_template("practice.html", 
-            results=results, 
-            score=score,
-            total=total,
-            percentage=f"{percentage:.1f}",
+            results=graded.results, 
+            score=graded.score,
+            total=graded.total,
+            percentage=graded.percentage,
             num_questions=num_questions_for_retry,
             practice_type=practice_type_for_retry,
             title="テスト結果"
@@ -371,78 +335,157 @@ def practice():
     
     practice_type = request.args.get('type', 'all')
     
-    question_pool = []
+    exclude_question_ids = None
     title = ""
     
+    if practice_type == 'spaced':
+        title = "過去問演習（復習の時期が来た問題）"
+        # 期限の来た問題は (user_id, due_at) のインデックスを順に読むだけで選べる
+        q_list = spaced_repetition.pick_questions(me.id, num_questions)
+        if not q_list:
+            next_due = spaced_repetition.next_due_at(me.id)
+            message = "対象の問題がありません。"
+            if next_due is not None:
+                message = f"今は復習する問題がありません。次の復習まであと{spaced_repetition.describe_wait(next_due)}です。"
+            return render_template("practice.html", questions=[], message=message, title=title)
+        return render_template("practice.html", questions=q_list, title=title)
+
     if practice_type == 'exclude_answered':
         title = "過去問演習（2回以上正解した問題を除く）"
-        all_results = db.session.query(QuizResult).filter_by(user_id=current_user.id).order_by(QuizResult.question_id, desc(QuizResult.timestamp)).all()
-        
-        results_by_question = {k: list(v) for k, v in groupby(all_results, key=lambda r: r.question_id)}
-
-        exclude_question_ids = set()
-        for q_id, results in results_by_question.items():
-            if len(results) >= 2 and results[0].is_correct and results[1].is_correct:
-                exclude_question_ids.add(q_id)
-        
-        question_pool = Question.query.filter(Question.id.notin_(exclude_question_ids)).all()
+        # 直近2回連続で正解した問題は user_question_stats から1回の検索で求める
+        exclude_question_ids = mastered_question_ids(me.id)
 
     else: # practice_type == 'all'
         title = "過去問演習（全問題）"
-        question_pool = Question.query.all()
 
-    if not question_pool:
+    q_list = question_bank.sample(num_questions, exclude=exclude_question_ids)
+    if not q_list:
         return render_template("practice.html", questions=[], message="対象の問題がありません。", title=title)
 
-    num_to_sample = min(len(question_pool), num_questions)
-    q_list = random.sample(question_pool, num_to_sample)
-
     return render_template("practice.html", questions=q_list, title=title)
 
 # 結果
-@app.route("/result")
+@main.route("/result")
 def result():
     if "user" not in session:
         return redirect("/")
     ok = request.args.get("ok") == "True"
     return render_template("result.html", ok=ok)
 
+# 解答履歴と章ごとの進み具合
+@main.route("/history")
+def history_page():
+    if "user" not in session:
+        return redirect("/")
+    me = current_user()
+    if not me:
+        return redirect("/")
+    return render_template("history.html", progress=history.chapter_progress(me.id))
+
+@main.route("/api/history")
+def get_history():
+    """ログイン中のユーザーの解答を新しい順に返す。?cursor=<前のページの next_cursor>&per_page="""
+    me = current_user()
+    if not me:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        per_page = int(request.args.get("per_page", 50))
+    except (ValueError, TypeError):
+        per_page = 50
+    try:
+        page = history.attempts_page(me.id, request.args.get("cursor") or None, per_page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"attempts": page.attempts, "next_cursor": page.next_cursor})
+
+@main.route("/api/progress")
+def get_progress():
+    me = current_user()
+    if not me:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(history.chapter_progress(me.id))
+
 # 管理者画面
-@app.route("/admin")
+@main.route("/admin")
 def admin():
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return redirect("/")
     return render_template("admin.html", chapters=CHAPTERS)
 
-@app.route("/api/questions/<category>")
+@main.route("/api/questions/<category>")
 def get_questions_by_category(category):
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
     
-    questions = Question.query.filter_by(category=category).all()
-    
-    # SQLAlchemyオブジェクトを辞書のリストに変換
+    # 問題バンクのカテゴリのバージョンが変わっていなければ 304 を返す
+    snapshot = question_bank.snapshot()
+    etag = f"c{category}-{snapshot.category_versions.get(str(category), 0):x}"
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # 問題バンクの内容を辞書のリストに変換
     q_list = [
         {
             "id": q.id,
             "question": q.question,
         }
-        for q in questions
+        for q in snapshot.by_category.get(str(category), ())
     ]
     
-    return jsonify(q_list)
+    return with_cache_headers(jsonify(q_list), etag)
 
-@app.route("/api/question/<int:question_id>")
+@main.route("/api/questions/search")
+def search_questions():
+    """問題文・選択肢・ヒントの全文検索（question_search.py を参照）。?q=&page=&per_page=&category="""
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    query = request.args.get("q", "").strip()
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 20)), 1), question_search.MAX_PER_PAGE)
+    except (ValueError, TypeError):
+        page, per_page = 1, 20
+    category = request.args.get("category") or None
+
+    found = question_search.search(query, page, per_page, category)
+    return jsonify({
+        "query": query,
+        "page": page,
+        "per_page": per_page,
+        "total": found.total,
+        "total_exact": found.exact,
+        "results": found.results,
+    })
+
+@main.route("/api/question/<int:question_id>")
 def get_question_details(question_id):
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
         
-    question = Question.query.get(question_id)
+    snapshot = question_bank.snapshot()
+    question = snapshot.by_id.get(question_id)
     
     if not question:
         return jsonify({"error": "Question not found"}), 404
+
+    etag = f"q{question_id}-{snapshot.question_versions[question_id]:x}"
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
         
-    # SQLAlchemyオブジェクトを辞書に変換
+    # 問題バンクの内容を辞書に変換
     q_data = {
         "id": question.id,
         "question": question.question,
@@ -456,12 +499,84 @@ def get_question_details(question_id):
         "url": question.url
     }
     
-    return jsonify(q_data)
+    return with_cache_headers(jsonify(q_data), etag)
 
-@app.route("/api/question/update/<int:question_id>", methods=["POST"])
+# 難易度の集計（rollups の表を読むだけなので解答履歴の量に関係なく一定の時間で返る）
+def _stats_days():
+    try:
+        return min(max(int(request.args.get("days", 30)), 1), 365)
+    except (ValueError, TypeError):
+        return 30
+
+@main.route("/api/stats/chapters")
+def get_chapter_stats():
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    stats = rollups.chapter_stats()
+    return jsonify([
+        dict({"category": str(chapter_id), "title": title}, **stats.get(str(chapter_id), rollups.EMPTY_STATS))
+        for chapter_id, title in CHAPTERS
+    ])
+
+@main.route("/api/stats/chapter/<category>")
+def get_chapter_daily_stats(category):
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    return jsonify({
+        "category": category,
+        "total": rollups.chapter_stats().get(str(category), rollups.EMPTY_STATS),
+        "daily": rollups.chapter_daily(category, _stats_days()),
+    })
+
+@main.route("/api/stats/questions/<category>")
+def get_question_stats_by_category(category):
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    # 正答率の低い（難しい）順。まだ解答のない問題は最後
+    questions = question_bank.by_category(category)
+    stats = rollups.question_stats(q.id for q in questions)
+    q_list = [
+        dict({"id": q.id, "question": q.question}, **stats.get(q.id, rollups.EMPTY_STATS))
+        for q in questions
+    ]
+    q_list.sort(key=lambda q: (q["correct_rate"] is None, q["correct_rate"] or 0))
+    return jsonify(q_list)
+
+@main.route("/api/stats/question/<int:question_id>")
+def get_question_stats(question_id):
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    if not question_bank.get(question_id):
+        return jsonify({"error": "Question not found"}), 404
+    return jsonify({
+        "id": question_id,
+        "total": rollups.question_stats([question_id]).get(question_id, rollups.EMPTY_STATS),
+        "daily": rollups.question_daily(question_id, _stats_days()),
+    })
+
+@main.route("/api/question/update/<int:question_id>", methods=["POST"])
 def update_question(question_id):
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
         
     question = Question.query.get(question_id)
     if not question:
@@ -483,27 +598,124 @@ def update_question(question_id):
     except (ValueError, TypeError):
         # 不正な値の場合は更新しない
         pass
+    old_category = question.category
     question.category = data.get("category", question.category)
     question.hint = data.get("hint", question.hint)
     question.url = data.get("url", question.url)
+    question.refresh_content_hash()
+    if question.category != old_category:
+        rollups.rebuild_chapters({old_category, question.category})
     
-    db.session.commit()
+    # 各ワーカーの問題バンクに変更を通知する
+    question_bank.mark_changed()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"success": False, "message": "同じ内容の問題が既に存在します"}), 409
+    question_bank.invalidate()
+    fragment_cache.invalidate(question_id)
     
     return jsonify({"success": True, "message": "Question updated successfully"})
 
+@main.route("/admin/metrics")
+def admin_metrics():
+    token = current_app.config.get("METRICS_TOKEN")
+    if not is_admin() and not (token and request.headers.get("Authorization") == f"Bearer {token}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@main.route("/admin/export/results")
+def export_results():
+    """解答履歴を CSV / NDJSON でダウンロードする（results_export.py を参照）。
+
+    ?format=csv|ndjson&gzip=1&user=<ID かメールアドレス>&category=&since=&until=
+    """
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in results_export.FORMATS:
+        return jsonify({"error": "format は csv か ndjson を指定してください"}), 400
+    try:
+        filters = results_export.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compressed = request.args.get("gzip") in ("1", "true", "on")
+
+    # 行をバッチごとに読みながら送る（compression.py はストリーミングのレスポンスを圧縮しない）
+    chunks = results_export.export(
+        filters, fmt, current_app.config["EXPORT_BATCH_SIZE"],
+        compress_level=current_app.config["COMPRESS_LEVEL"] if compressed else None,
+    )
+    response = Response(
+        stream_with_context(chunks),
+        mimetype="application/gzip" if compressed else results_export.FORMATS[fmt][0],
+    )
+    if not compressed:
+        response.charset = "utf-8"
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{results_export.download_name(fmt, compressed)}"'
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@main.route("/api/questions/bulk", methods=["POST"])
+def bulk_questions():
+    """問題の作成・更新・削除をまとめて1トランザクションで行う（bulk_questions.py を参照）。
+
+    JSON（配列か {"operations": [...]}）、アップロードされたファイル（file）、
+    JSON Lines の本文のいずれかを受け付ける。?partial=1 なら正しい操作だけを適用する。
+    """
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 401
+    limited = rate_limiter.limited("admin_api")
+    if limited is not None:
+        return limited
+
+    partial = request.args.get("partial") in ("1", "true")
+    if request.is_json:
+        data = request.get_json(silent=True)
+        operations = data.get("operations") if isinstance(data, dict) else data
+        if not isinstance(operations, list):
+            return jsonify({"error": "operations は配列である必要があります"}), 400
+        if isinstance(data, dict) and data.get("partial"):
+            partial = True
+        records = [(None, item, None) for item in operations]
+    else:
+        upload = request.files.get("file")
+        stream = upload.stream if upload is not None else request.stream
+        records = list(iter_records(stream))
+
+    limit = current_app.config["BULK_QUESTIONS_MAX"]
+    if len(records) > limit:
+        return jsonify({"error": f"一度に送れる操作は {limit} 件までです"}), 413
+
+    try:
+        report = apply_operations(records, partial=partial)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "同じ内容の問題が既に存在します"}), 409
+
+    status = 422 if report.errors and not report.applied else 200
+    return jsonify(report.to_dict()), status
+
 # ユーザー管理
-@app.route("/user_management")
+@main.route("/user_management")
 def user_management():
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return redirect("/")
     
-    # admin以外のユーザーを取得
-    users = User.query.filter(User.email != "admin@example.com").all()
+    # admin以外のユーザーを取得（削除中のユーザーは除く）
+    users = User.query.filter(User.role.notin_([ADMIN_ROLE, DELETED_ROLE])).all()
     return render_template("user_management.html", users=users)
 
-@app.route("/add_user", methods=["POST"])
+@main.route("/add_user", methods=["POST"])
 def add_user():
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return redirect("/")
         
     email = request.form.get("email")
@@ -512,51 +724,83 @@ def add_user():
 
     if not email or not password:
         flash("メールアドレスとパスワードは必須です。", "danger")
-        return redirect(url_for("user_management"))
+        return redirect(url_for("main.user_management"))
 
     existing_user = User.query.filter_by(email=email).first()
     if existing_user:
         flash("このメールアドレスは既に使用されています。", "warning")
-        return redirect(url_for("user_management"))
+        return redirect(url_for("main.user_management"))
 
-    new_user = User(email=email, nickname=nickname)
-    new_user.set_password(password)
+    try:
+        password_hash = password_pool.generate(password)
+    except PoolBusy:
+        flash("ただいま混み合っています。少し待ってからもう一度お試しください。", "warning")
+        return redirect(url_for("main.user_management"))
+
+    new_user = User(email=email, nickname=nickname, password_hash=password_hash)
     db.session.add(new_user)
     db.session.commit()
 
     flash(f"ユーザー「{email}」を登録しました。", "success")
-    return redirect(url_for("user_management"))
+    return redirect(url_for("main.user_management"))
+
+@main.route("/add_users_csv", methods=["POST"])
+def add_users_csv():
+    """CSV の名簿からユーザーを一括登録する（roster.py を参照）。"""
+    if not is_admin():
+        return redirect("/")
 
-@app.route("/delete_user", methods=["POST"])
+    upload = request.files.get("roster")
+    if upload is None or not upload.filename:
+        flash("CSV ファイルを選択してください。", "warning")
+        return redirect(url_for("main.user_management"))
+
+    report = roster.provision(upload.stream, max_rows=current_app.config["ROSTER_MAX_ROWS"])
+    if report.errors:
+        for line, message in report.errors[:20]:
+            flash(f"{line} 行目: {message}", "danger")
+        if len(report.errors) > 20:
+            flash(f"ほか {len(report.errors) - 20} 件のエラーがあります。", "danger")
+        flash("エラーがあるため、ユーザーは登録されませんでした。", "warning")
+    else:
+        flash(f"{report.created} 人のユーザーを登録しました（{report.seconds:.1f} 秒）。", "success")
+    return redirect(url_for("main.user_management"))
+
+@main.route("/delete_user", methods=["POST"])
 def delete_user():
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return redirect("/")
         
     email = request.form.get("email")
     if not email:
         flash("削除するユーザーを選択してください。", "warning")
-        return redirect(url_for("user_management"))
-
-    if email == "admin@example.com":
-        flash("管理者ユーザーは削除できません。", "danger")
-        return redirect(url_for("user_management"))
+        return redirect(url_for("main.user_management"))
 
     user_to_delete = User.query.filter_by(email=email).first()
-    if user_to_delete:
-        # 関連するQuizResultも削除する必要がある場合
-        QuizResult.query.filter_by(user_id=user_to_delete.id).delete()
-        
-        db.session.delete(user_to_delete)
+    if user_to_delete and user_to_delete.role == ADMIN_ROLE:
+        flash("管理者ユーザーは削除できません。", "danger")
+        return redirect(url_for("main.user_management"))
+
+    if user_to_delete and user_to_delete.role == DELETED_ROLE:
+        # 止まった削除はここからも再開できる（他のワーカーが進めていれば何もしない）
+        user_deleter.submit(user_to_delete.id)
+        flash(f"ユーザー「{email}」は削除中です。", "info")
+    elif user_to_delete:
+        # すぐにログインできなくし、解答履歴は user_deleter が少しずつ削除する
+        deleted_user_id = user_to_delete.id
+        mark_deleted(deleted_user_id)
         db.session.commit()
-        flash(f"ユーザー「{email}」を削除しました。", "success")
+        forget_user(deleted_user_id)
+        user_deleter.submit(deleted_user_id)
+        flash(f"ユーザー「{email}」を削除しました。解答履歴はバックグラウンドで削除されます。", "success")
     else:
         flash("指定されたユーザーが見つかりません。", "danger")
         
-    return redirect(url_for("user_management"))
+    return redirect(url_for("main.user_management"))
 
-@app.route("/admin_change_password", methods=["POST"])
+@main.route("/admin_change_password", methods=["POST"])
 def admin_change_password():
-    if "user" not in session or session["user"] != "admin@example.com":
+    if not is_admin():
         return redirect("/")
         
     email = request.form.get("email")
@@ -564,19 +808,28 @@ def admin_change_password():
 
     if not email or not new_password:
         flash("対象ユーザーと新しいパスワードを入力してください。", "warning")
-        return redirect(url_for("user_management"))
+        return redirect(url_for("main.user_management"))
 
     user_to_change = User.query.filter_by(email=email).first()
     if user_to_change:
-        user_to_change.set_password(new_password)
+        try:
+            user_to_change.password_hash = password_pool.generate(new_password)
+        except PoolBusy:
+            flash("ただいま混み合っています。少し待ってからもう一度お試しください。", "warning")
+            return redirect(url_for("main.user_management"))
         db.session.commit()
         flash(f"ユーザー「{email}」のパスワードを変更しました。", "success")
     else:
         flash("指定されたユーザーが見つかりません。", "danger")
         
-    return redirect(url_for("user_management"))
+    return redirect(url_for("main.user_management"))
 
 
-#
+# 開発用のサーバー（本番は serve.py）
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    # 起動時に問題バンクを読み込んでおく
+    with app.app_context():
+        migrations.upgrade(echo=print)
+        question_bank.snapshot()
+    app.run(debug=True)
@@ -0,0 +1 @@
+"""MyQuest のベンチマーク。リポジトリのルートから python -m benchmarks.<名前> で実行する。"""
@@ -0,0 +1,144 @@
+"""解答履歴のエクスポートのベンチマーク。
+
+一時ファイルのSQLiteに解答履歴を段階的に増やしながら、results_export.export
+（バッチごとに読んで書き出す）で全件を CSV / NDJSON / gzip 付き CSV に出力する時間と、
+Python のメモリの最大使用量（tracemalloc）を測る。比較のため、
+全件を .all() で読んでから CSV を組み立てる素朴な方法も同じ条件で測る。
+
+使い方: python -m benchmarks.bench_export --sizes 1000,100000,1000000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+
+import migrations
+import results_export
+from database import db
+from model import Question, QuizResult, User
+from settings import create_base_app
+
+
+def add_results(count, first_id, users, questions, rng, start):
+    rows = []
+    with db.engine.begin() as conn:
+        for i in range(first_id, first_id + count):
+            rows.append((
+                rng.randint(1, users),
+                rng.randint(1, questions),
+                rng.random() < 0.6,
+                (start + timedelta(seconds=i * 7)).isoformat(sep=" ", timespec="microseconds"),
+            ))
+            if len(rows) == 50000:
+                conn.exec_driver_sql(
+                    "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)", rows
+                )
+                rows = []
+        if rows:
+            conn.exec_driver_sql(
+                "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)", rows
+            )
+
+
+def naive_export():
+    # 全件を読み込んでから CSV を組み立てる（比較用）
+    rows = db.session.execute(
+        select(QuizResult.id, QuizResult.user_id, User.email, QuizResult.question_id,
+               Question.category, QuizResult.is_correct, QuizResult.timestamp)
+        .outerjoin(User, User.id == QuizResult.user_id)
+        .outerjoin(Question, Question.id == QuizResult.question_id)
+        .order_by(QuizResult.id)
+    ).all()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(results_export.COLUMNS)
+    writer.writerows(
+        (r.id, r.user_id, r.email, r.question_id, r.category, int(r.is_correct), r.timestamp.isoformat())
+        for r in rows
+    )
+    db.session.rollback()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def measure(make_chunks):
+    """出力を最後まで読み、(秒, 出力のバイト数, メモリの最大使用量 MB) を返す。
+
+    tracemalloc を有効にすると遅くなるので、時間とメモリは別々に読んで測る。
+    """
+    t0 = time.perf_counter()
+    size = sum(len(chunk) for chunk in make_chunks())
+    seconds = time.perf_counter() - t0
+    tracemalloc.start()
+    for _ in make_chunks():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(seconds, 3), size, round(peak / 1024 / 1024, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="解答履歴の件数（カンマ区切り、昇順）")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+
+    rng = random.Random(args.seed)
+    start = datetime(2025, 4, 1)
+    everything = results_export.ExportFilters(None, None, None, None)
+    report = {"batch_size": args.batch_size, "sizes": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_base_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db")})
+        with app.app_context():
+            migrations.upgrade()
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO users (id, email, password_hash) VALUES (:id, :email, 'x')"),
+                    [{"id": i, "email": f"user{i}@example.com"} for i in range(1, args.users + 1)],
+                )
+                conn.execute(
+                    text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, :c)"),
+                    [{"id": i, "q": f"question {i}", "c": str(i % 18 + 1)} for i in range(1, args.questions + 1)],
+                )
+
+            rows = 0
+            for size in sizes:
+                print(f"{size:,} 件まで解答履歴を追加中...")
+                add_results(size - rows, rows, args.users, args.questions, rng, start)
+                rows = size
+
+                result = {}
+                for name, fmt, level in (("csv", "csv", None), ("ndjson", "ndjson", None), ("csv_gzip", "csv", 6)):
+                    seconds, size_bytes, peak_mb = measure(
+                        lambda: results_export.export(everything, fmt, args.batch_size, level)
+                    )
+                    result[name] = {"seconds": seconds, "bytes": size_bytes, "peak_mb": peak_mb,
+                                    "rows_per_second": round(size / seconds) if seconds else None}
+                seconds, size_bytes, peak_mb = measure(naive_export)
+                result["naive_csv"] = {"seconds": seconds, "bytes": size_bytes, "peak_mb": peak_mb,
+                                       "rows_per_second": round(size / seconds) if seconds else None}
+                report["sizes"][size] = result
+                for name, r in result.items():
+                    print(f"  {name:10s} {r['seconds']:8.3f} 秒  {r['bytes'] / 1024 / 1024:9.2f} MB  "
+                          f"メモリの最大 {r['peak_mb']:8.2f} MB")
+            db.engine.dispose()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
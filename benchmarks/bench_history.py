@@ -0,0 +1,109 @@
+"""解答履歴のページ送りのベンチマーク。
+
+一時ファイルのSQLiteに1人分の大量の解答を作り、history.attempts_page（キーセット方式）と
+OFFSET を使う場合とで、浅いページと深いページを読む時間を比べる。
+
+使い方: python -m benchmarks.bench_history --answers 300000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+
+import history
+import migrations
+from database import db
+from model import QuizResult
+from settings import create_base_app
+
+USER_ID = 1
+
+
+def populate(answers, questions, seed):
+    rng = random.Random(seed)
+    start = datetime(2024, 4, 1)
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, password_hash) VALUES (:id, 'bench@example.com', 'x')"),
+                     {"id": USER_ID})
+        conn.execute(
+            text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, :c)"),
+            [{"id": i, "q": f"question {i}", "c": str(i % 18 + 1)} for i in range(1, questions + 1)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+            [
+                (USER_ID, rng.randint(1, questions), rng.random() < 0.6,
+                 (start + timedelta(seconds=i * 30)).isoformat(sep=" ", timespec="microseconds"))
+                for i in range(answers)
+            ],
+        )
+
+
+def offset_page(offset, per_page):
+    return db.session.execute(
+        select(QuizResult.id, QuizResult.question_id, QuizResult.is_correct, QuizResult.timestamp)
+        .where(QuizResult.user_id == USER_ID)
+        .order_by(QuizResult.timestamp.desc(), QuizResult.id.desc())
+        .limit(per_page).offset(offset)
+    ).all()
+
+
+def cursor_at(offset):
+    row = offset_page(offset - 1, 1)[0]
+    return history.encode_cursor(row.timestamp, row.id)
+
+
+def timed(func, samples):
+    times = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=300_000)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    depths = sorted({0, 1000, args.answers // 2, args.answers - args.per_page})
+    report = {"answers": args.answers, "per_page": args.per_page, "depths": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_base_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db")})
+        with app.app_context():
+            migrations.upgrade()
+            print(f"{args.answers:,} 件の解答を作成中...")
+            populate(args.answers, args.questions, args.seed)
+
+            for depth in depths:
+                cursor = cursor_at(depth) if depth else None
+                keyset_ms = timed(lambda: history.attempts_page(USER_ID, cursor, args.per_page), args.samples)
+                offset_ms = timed(lambda: offset_page(depth, args.per_page), args.samples)
+                report["depths"][depth] = {"keyset_ms": keyset_ms, "offset_ms": offset_ms}
+                print(f"{depth:8d} 件目から  キーセット {keyset_ms:8.3f}ms  OFFSET {offset_ms:8.3f}ms")
+
+            t0 = time.perf_counter()
+            history.chapter_progress(USER_ID)
+            report["progress_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+            print(f"章ごとの進み具合: {report['progress_ms']}ms")
+            db.engine.dispose()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
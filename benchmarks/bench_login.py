@@ -0,0 +1,109 @@
+"""ログイン集中時のパスワード照合の負荷テスト。
+
+複数のスレッドから同時に password_pool.check を呼び、プールを使わない場合
+（workers=0、リクエストのスレッドで計算）とプロセスプールの場合とで、
+1件あたりの待ち時間、PoolBusy になった件数、その間に動かした軽い処理
+（他のページの代わり）の待ち時間を比べる。
+
+使い方: python -m benchmarks.bench_login --threads 32 --logins 5 --workers 2
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from flask import Flask
+
+from password_pool import PasswordPool, PoolBusy
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, int(len(values) * p) - 1)]
+
+
+def run(workers, args):
+    app = Flask(__name__)
+    app.config["PASSWORD_POOL_WORKERS"] = workers
+    app.config["PASSWORD_POOL_MAX_PENDING"] = args.max_pending
+    app.config["PASSWORD_HASH_METHOD"] = args.method
+    pool = PasswordPool()
+    pool.init_app(app)
+
+    pwhash = pool.generate("password")
+    pool.check(pwhash, "password") # ワーカーの起動を計測に含めない
+
+    latencies = []
+    busy = []
+    ticks = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def student():
+        mine = []
+        rejected = 0
+        for _ in range(args.logins):
+            t0 = time.perf_counter()
+            try:
+                assert pool.check(pwhash, "password")
+            except PoolBusy:
+                rejected += 1
+                continue
+            mine.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            latencies.extend(mine)
+            busy.append(rejected)
+
+    def other_page():
+        # 10ms ごとに起きる軽い処理。照合が GIL を握っていると遅れる
+        while not done.is_set():
+            t0 = time.perf_counter()
+            time.sleep(0.01)
+            ticks.append((time.perf_counter() - t0) * 1000 - 10)
+
+    ticker = threading.Thread(target=other_page)
+    ticker.start()
+    threads = [threading.Thread(target=student) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    ticker.join()
+    pool.shutdown()
+
+    return {
+        "logins": len(latencies),
+        "busy": sum(busy),
+        "seconds": round(elapsed, 3),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "other_page_p99_delay_ms": round(percentile(ticks, 0.99), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=5, help="1スレッドあたりのログイン回数")
+    parser.add_argument("--workers", type=int, default=2, help="プールのプロセス数")
+    parser.add_argument("--max-pending", type=int, default=32)
+    parser.add_argument("--method", default="scrypt:32768:8:1")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    report = {}
+    for name, workers in (("inline", 0), ("pool", args.workers)):
+        report[name] = run(workers, args)
+        print(f"{name}: {report[name]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""quiz_results の複合インデックスの効果を測るベンチマーク。
+
+一時ファイルのSQLiteに大量の解答履歴を作り、マイグレーション適用前後で
+practice(exclude_answered) の履歴取得、解答履歴のページ（history.py の1ページ目）と
+delete_user の削除にかかる時間を比べる。適用前は quiz_results の主キー以外のインデックスをすべて消す。
+
+使い方: python -m benchmarks.bench_quiz_results_index --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+import migrations
+from database import db
+
+HISTORY_SQL = text(
+    "SELECT question_id, is_correct, timestamp FROM quiz_results "
+    "WHERE user_id = :user_id ORDER BY question_id, timestamp DESC"
+)
+# ix_quiz_results_user_time を使う（history.attempts_page と同じ並び）
+HISTORY_PAGE_SQL = text(
+    "SELECT id, question_id, is_correct, timestamp FROM quiz_results "
+    "WHERE user_id = :user_id ORDER BY timestamp DESC, id DESC LIMIT 51"
+)
+DELETE_SQL = text("DELETE FROM quiz_results WHERE user_id = :user_id")
+
+
+def populate(engine, rows, users, questions, seed):
+    rng = random.Random(seed)
+    start = datetime(2025, 4, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, email, password_hash) VALUES (:id, :email, 'x')"),
+            [{"id": i, "email": f"user{i}@example.com"} for i in range(1, users + 1)],
+        )
+        conn.execute(
+            text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, '1')"),
+            [{"id": i, "q": f"question {i}"} for i in range(1, questions + 1)],
+        )
+        batch = []
+        for i in range(rows):
+            batch.append((
+                rng.randint(1, users),
+                rng.randint(1, questions),
+                rng.random() < 0.6,
+                (start + timedelta(seconds=i * 7)).isoformat(sep=" ", timespec="microseconds"),
+            ))
+            if len(batch) == 50000:
+                conn.exec_driver_sql(
+                    "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                batch = []
+        if batch:
+            conn.exec_driver_sql(
+                "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+
+
+def drop_indexes(conn):
+    """quiz_results の主キー以外のインデックスを消す（旧スキーマの再現）。"""
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'quiz_results' AND sql IS NOT NULL"
+    )).scalars().all()
+    for name in names:
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    return names
+
+
+def measure(engine, user_ids):
+    history, page, delete = [], [], []
+    with engine.connect() as conn:
+        for user_id in user_ids:
+            t0 = time.perf_counter()
+            conn.execute(HISTORY_SQL, {"user_id": user_id}).all()
+            history.append((time.perf_counter() - t0) * 1000)
+            conn.rollback()
+
+            t0 = time.perf_counter()
+            conn.execute(HISTORY_PAGE_SQL, {"user_id": user_id}).all()
+            page.append((time.perf_counter() - t0) * 1000)
+            conn.rollback()
+
+            # 削除はロールバックして毎回同じデータで測る
+            t0 = time.perf_counter()
+            conn.execute(DELETE_SQL, {"user_id": user_id})
+            delete.append((time.perf_counter() - t0) * 1000)
+            conn.rollback()
+    return {
+        "history_ms_median": round(statistics.median(history), 3),
+        "history_page_ms_median": round(statistics.median(page), 3),
+        "delete_ms_median": round(statistics.median(delete), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine("sqlite:///" + os.path.join(tmp, "bench.db"))
+        # 旧スキーマ（インデックスなし）を再現する
+        with engine.begin() as conn:
+            db.metadata.create_all(conn)
+            print(f"インデックスを削除: {', '.join(drop_indexes(conn))}")
+
+        print(f"{args.rows:,} 行を作成中...")
+        populate(engine, args.rows, args.users, args.questions, args.seed)
+        user_ids = random.Random(args.seed).sample(range(1, args.users + 1), args.samples)
+
+        before = measure(engine, user_ids)
+        print(f"適用前: {before}")
+
+        t0 = time.perf_counter()
+        migrations.upgrade(engine, echo=print)
+        migrate_seconds = time.perf_counter() - t0
+
+        after = measure(engine, user_ids)
+        print(f"適用後: {after}（マイグレーション {migrate_seconds:.1f} 秒）")
+        engine.dispose()
+
+    report = {
+        "rows": args.rows,
+        "users": args.users,
+        "questions": args.questions,
+        "before": before,
+        "after": after,
+        "migration_seconds": round(migrate_seconds, 3),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
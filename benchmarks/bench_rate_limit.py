@@ -0,0 +1,109 @@
+"""回数制限（rate_limit.py）のバケツの置き場所ごとのベンチマーク。
+
+memory / sqlite / socket のそれぞれで、複数のスレッドから take（IP とユーザーの2つのバケツ）を
+呼び、1回あたりの時間の中央値・p99 と全体のスループットを測る。memory では、
+キーの数を増やしたときのメモリの使用量（tracemalloc）と、満杯に戻ったキーが掃除されることも確かめる。
+
+使い方: python -m benchmarks.bench_rate_limit --threads 8 --calls 20000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import rate_limit
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, int(len(values) * p) - 1)]
+
+
+def run(backend, threads, calls, keys):
+    times = []
+    lock = threading.Lock()
+
+    def client(n):
+        mine = []
+        for i in range(calls // threads):
+            user = (n * calls + i) % keys
+            items = [(f"login:ip:10.0.{n}.1", 1, 1_000_000, 60.0), (f"login:user:{user}", 1, 1_000_000, 60.0)]
+            t0 = time.perf_counter()
+            backend.take(items)
+            mine.append((time.perf_counter() - t0) * 1_000_000)
+        with lock:
+            times.extend(mine)
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - t0
+    return {"calls_per_second": round(len(times) / seconds), "median_us": round(statistics.median(times), 1),
+            "p99_us": round(percentile(times, 0.99), 1)}
+
+
+def memory_per_key(keys):
+    backend = rate_limit.MemoryBackend(min_sweep=keys * 2)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(keys):
+        backend.take([(f"check_answer:user:{i}", 1, 300, 60.0)])
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return round(used / keys, 1)
+
+
+def sweep(keys):
+    # すぐに満杯に戻るバケツを keys 個作り、戻った後に別のキーを keys 個使う。掃除しなければ 2 * keys 個残る
+    backend = rate_limit.MemoryBackend()
+    for i in range(keys):
+        backend.take([(f"a:{i}", 1, 10, 0.05)])
+    time.sleep(0.1)
+    for i in range(keys):
+        backend.take([(f"b:{i}", 1, 10, 60.0)])
+    return {"keys_used": 2 * keys, "keys_kept": len(backend)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=10000, help="ユーザーのキーの数")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    report = {"threads": args.threads, "calls": args.calls, "backends": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ratelimit.sock")
+        service = rate_limit.RateLimitService(path)
+        threading.Thread(target=service.serve_forever, daemon=True).start()
+        backends = {
+            "memory": rate_limit.MemoryBackend(),
+            "sqlite": rate_limit.SQLiteBackend(os.path.join(tmp, "ratelimit.db")),
+            "socket": rate_limit.SocketBackend(path),
+        }
+        for name, backend in backends.items():
+            result = report["backends"][name] = run(backend, args.threads, args.calls, args.keys)
+            print(f"{name:7s} {result['calls_per_second']:9,d} 回/秒  中央値 {result['median_us']:8.1f}µs  "
+                  f"p99 {result['p99_us']:8.1f}µs")
+        service.shutdown()
+        service.server_close()
+
+    report["memory_bytes_per_key"] = memory_per_key(args.keys * 10)
+    report["sweep"] = sweep(args.keys * 10)
+    print(f"memory のキー1つあたりの使用量: {report['memory_bytes_per_key']} バイト")
+    print(f"満杯に戻ったキーの掃除: {report['sweep']['keys_used']:,} 件のうち {report['sweep']['keys_kept']:,} 件を保持")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""result_writer のスレッド負荷テスト。
+
+一時ファイルのSQLiteに対して、複数のスレッドから同時に採点結果を送り、
+sync / async それぞれの1件あたりの待ち時間と、flush 後に全件が
+quiz_results と user_question_stats に書き込まれていることを確認する。
+
+使い方: python -m benchmarks.bench_result_writer --threads 16 --submissions 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+import db_profile
+import migrations
+from database import db
+from model import QuizResult, UserQuestionStat
+from result_writer import ResultWriter
+
+
+def make_app(db_path, mode, queue_size):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + db_path
+    app.config["RESULT_WRITE_MODE"] = mode
+    app.config["RESULT_QUEUE_SIZE"] = queue_size
+    db.init_app(app)
+    db_profile.init_app(app)
+    return app
+
+
+def run(mode, args, tmp):
+    db_path = os.path.join(tmp, f"{mode}.db")
+    app = make_app(db_path, mode, args.queue_size)
+    writer = ResultWriter()
+    writer.init_app(app)
+
+    with app.app_context():
+        migrations.upgrade()
+        with db.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO users (id, email, password_hash) VALUES (:id, :email, 'x')"),
+                [{"id": i, "email": f"user{i}@example.com"} for i in range(1, args.threads + 1)],
+            )
+            conn.execute(
+                text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, '1')"),
+                [{"id": i, "q": f"question {i}"} for i in range(1, args.questions + 1)],
+            )
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def student(user_id):
+        rng = random.Random(user_id)
+        mine = []
+        failed = 0
+        with app.app_context():
+            for _ in range(args.submissions):
+                outcomes = [
+                    (q_id, rng.random() < 0.6)
+                    for q_id in rng.sample(range(1, args.questions + 1), args.per_submission)
+                ]
+                t0 = time.perf_counter()
+                try:
+                    writer.submit(user_id, outcomes)
+                except OperationalError:
+                    # sync モードでは書き込みロックの競合で失敗することがある
+                    db.session.rollback()
+                    failed += 1
+                    continue
+                mine.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(1, args.threads + 1)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.flush()
+    elapsed = time.perf_counter() - started
+    writer.shutdown()
+
+    expected = len(latencies) * args.per_submission
+    with app.app_context():
+        written = db.session.execute(select(func.count()).select_from(QuizResult)).scalar()
+        attempts = db.session.execute(select(func.sum(UserQuestionStat.attempts))).scalar()
+        db.engine.dispose()
+    assert written == expected, f"{mode}: quiz_results {written} != {expected}"
+    assert attempts == expected, f"{mode}: user_question_stats.attempts {attempts} != {expected}"
+
+    latencies.sort()
+    return {
+        "submissions": len(latencies),
+        "errors": sum(errors),
+        "rows": written,
+        "seconds": round(elapsed, 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--submissions", type=int, default=200, help="1スレッドあたりの提出回数")
+    parser.add_argument("--per-submission", type=int, default=10, help="1回の提出の問題数")
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("sync", "async"):
+            report[mode] = run(mode, args, tmp)
+            print(f"{mode}: {report[mode]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
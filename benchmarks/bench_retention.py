@@ -0,0 +1,147 @@
+"""解答履歴のアーカイブと空き領域の回収のベンチマーク。
+
+一時ファイルのSQLiteに2年分の解答を作り、retention.archive で保存期間より前の解答を
+アーカイブに移してから retention.incremental_vacuum で空きページを返す。その間、
+別のスレッドが解答の保存と同じ大きさの書き込みを続け、1回の書き込みにかかった時間
+（アーカイブの処理に待たされた時間を含む）の中央値と最大を測る。
+
+使い方: python -m benchmarks.bench_retention --answers 1000000 --days 180
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import migrations
+import retention
+from database import db
+from settings import create_base_app
+
+
+def populate(answers, users, questions, seed, start, span):
+    rng = random.Random(seed)
+    with db.engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, email, password_hash) VALUES (:id, :email, 'x')"),
+            [{"id": i, "email": f"user{i}@example.com"} for i in range(1, users + 1)],
+        )
+        conn.execute(
+            text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, :c)"),
+            [{"id": i, "q": f"question {i}", "c": str(i % 18 + 1)} for i in range(1, questions + 1)],
+        )
+        step = span / answers
+        conn.exec_driver_sql(
+            "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+            [
+                (rng.randint(1, users), rng.randint(1, questions), rng.random() < 0.6,
+                 (start + step * i).isoformat(sep=" ", timespec="microseconds"))
+                for i in range(answers)
+            ],
+        )
+
+
+class Writer(threading.Thread):
+    """解答を10件ずつ保存し続け、1回ごとの時間（ミリ秒）を記録する。"""
+
+    def __init__(self, engine, users, questions, interval):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.users = users
+        self.questions = questions
+        self.interval = interval
+        self.times = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        rng = random.Random(0)
+        while not self.stopped.is_set():
+            rows = [(rng.randint(1, self.users), rng.randint(1, self.questions), True,
+                     datetime.utcnow().isoformat(sep=" ", timespec="microseconds")) for _ in range(10)]
+            t0 = time.perf_counter()
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)", rows
+                )
+            self.times.append((time.perf_counter() - t0) * 1000)
+            time.sleep(self.interval)
+
+
+def latency(times):
+    return {"writes": len(times), "median_ms": round(statistics.median(times), 3) if times else None,
+            "max_ms": round(max(times), 3) if times else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=180, help="保存する日数（解答は730日分）")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--pause", type=float, default=0.05)
+    parser.add_argument("--step-pages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    report = {"answers": args.answers, "days": args.days, "batch_size": args.batch_size}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        app = create_base_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path})
+        with app.app_context():
+            engine = db.engine
+            migrations.upgrade()
+            print(f"{args.answers:,} 件の解答を作成中...")
+            now = datetime.utcnow()
+            populate(args.answers, args.users, args.questions, args.seed, now - timedelta(days=730),
+                     timedelta(days=730))
+            report["size_before_mb"] = round(os.path.getsize(path) / 1024 / 1024, 2)
+
+            writer = Writer(engine, args.users, args.questions, 0.01)
+            writer.start()
+            time.sleep(1)
+            baseline = len(writer.times)
+
+            t0 = time.perf_counter()
+            moved = retention.archive(engine, os.path.join(tmp, "bench_archive.db"), retention.cutoff(args.days),
+                                      args.batch_size, args.pause)
+            archive_seconds = time.perf_counter() - t0
+            during_archive = len(writer.times)
+
+            t0 = time.perf_counter()
+            released = retention.incremental_vacuum(engine, args.step_pages, args.pause)
+            vacuum_seconds = time.perf_counter() - t0
+            writer.stopped.set()
+            writer.join()
+
+            report["moved"] = moved
+            report["archive"] = {"seconds": round(archive_seconds, 3),
+                                 "rows_per_second": round(moved / archive_seconds) if archive_seconds else None,
+                                 "writes": latency(writer.times[baseline:during_archive])}
+            report["vacuum"] = {"seconds": round(vacuum_seconds, 3), "released_pages": released,
+                                "writes": latency(writer.times[during_archive:])}
+            report["idle_writes"] = latency(writer.times[:baseline])
+            report["size_after_mb"] = round(os.path.getsize(path) / 1024 / 1024, 2)
+            engine.dispose()
+
+    print(f"アーカイブ: {moved:,} 件 {report['archive']['seconds']} 秒  "
+          f"書き込み 中央値 {report['archive']['writes']['median_ms']}ms 最大 {report['archive']['writes']['max_ms']}ms")
+    print(f"空き領域の回収: {released:,} ページ {report['vacuum']['seconds']} 秒  "
+          f"書き込み 中央値 {report['vacuum']['writes']['median_ms']}ms 最大 {report['vacuum']['writes']['max_ms']}ms")
+    print(f"処理していない間の書き込み: 中央値 {report['idle_writes']['median_ms']}ms "
+          f"最大 {report['idle_writes']['max_ms']}ms")
+    print(f"データベース: {report['size_before_mb']} MB -> {report['size_after_mb']} MB")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
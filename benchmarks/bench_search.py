@@ -0,0 +1,157 @@
+"""問題の全文検索のベンチマーク。
+
+一時ファイルのSQLiteに語彙を組み合わせた問題を大量に作り、question_search.search
+（FTS5 trigram）と、索引を使わずに全列を LIKE で探す場合とで、よく出る語・
+長い語・複数の語・2文字の語の検索時間を比べる。索引の作成時間と
+問題を1件ずつ追加・更新したときのトリガーの負荷も測る。
+
+使い方: python -m benchmarks.bench_search --questions 100000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import func, select, text
+
+import db_profile
+import migrations
+import question_search
+from database import db
+from model import Question
+
+WORDS = (
+    "変数", "関数", "リスト", "辞書", "タプル", "集合", "文字列", "整数", "浮動小数点数", "例外",
+    "クラス", "インスタンス", "継承", "モジュール", "パッケージ", "イテレータ", "ジェネレータ", "内包表記",
+    "デコレータ", "スコープ", "引数", "戻り値", "ループ", "条件分岐", "インデント", "コメント",
+    "__init__", "self", "import", "return", "lambda", "yield", "print()", "len()", "range()",
+    "for文", "while文", "if文", "try文", "with文", "append", "split", "join", "format", "f文字列",
+)
+TEMPLATES = (
+    "次のうち{0}について正しいものはどれですか？（{1}と{2}の違い）",
+    "{0}を使って{1}を作るとき、{2}はどうなりますか？",
+    "{0}の説明として誤っているものを選びなさい。{1}の場合は{2}に注意すること。",
+)
+QUERIES = {
+    "two_chars": "関数",
+    "long_word": "浮動小数点数",
+    "two_terms": "デコレータ 継承",
+    "identifier": "__init__",
+    "short": "例外 self", # 2文字の語は LIKE で絞り込む
+    "everywhere": "の章を復習", # すべての問題のヒントに一致する
+}
+
+
+def populate(questions, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(1, questions + 1):
+        words = rng.sample(WORDS, 7)
+        rows.append({
+            "id": i,
+            "question": rng.choice(TEMPLATES).format(*words[:3]) + f"（{i}）",
+            "choice1": f"{words[3]}は{words[4]}を返す",
+            "choice2": f"{words[4]}は使えない",
+            "choice3": f"{words[5]}が必要",
+            "choice4": f"{words[6]}と同じ",
+            "hint": f"{words[0]}の章を復習しよう",
+            "category": str(i % 18 + 1),
+        })
+    return rows
+
+
+def like_search(query):
+    # 索引を使わない場合（問題文・選択肢・ヒントのすべてを LIKE で探し、件数もすべて数える）
+    conditions = [question_search._like_any_column(t) for t in question_search.split_terms(query)]
+    total = db.session.execute(select(func.count()).select_from(Question).where(*conditions)).scalar()
+    db.session.execute(select(Question.id).where(*conditions).order_by(Question.id).limit(20)).all()
+    return total
+
+
+def timed(func, samples):
+    times = []
+    result = None
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(times), 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=100_000)
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    report = {"questions": args.questions, "queries": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(tmp, "bench.db")
+        db.init_app(app)
+        db_profile.init_app(app)
+
+        with app.app_context():
+            # 索引なしで問題を入れてから、索引を作る時間を測る
+            migrations.upgrade()
+            with db.engine.begin() as conn:
+                for trigger in ("questions_fts_insert", "questions_fts_update", "questions_fts_delete"):
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                conn.execute(text(f"DROP TABLE IF EXISTS {question_search.FTS_TABLE}"))
+            print(f"{args.questions:,} 問を作成中...")
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "INSERT INTO questions (id, question, choice1, choice2, choice3, choice4, hint, correct, category) "
+                        "VALUES (:id, :question, :choice1, :choice2, :choice3, :choice4, :hint, 1, :category)"
+                    ),
+                    populate(args.questions, args.seed),
+                )
+            t0 = time.perf_counter()
+            with db.engine.begin() as conn:
+                if not question_search.create_index(conn):
+                    raise SystemExit("この SQLite では FTS5 の trigram トークナイザを使えません")
+            report["index_seconds"] = round(time.perf_counter() - t0, 3)
+            print(f"索引の作成: {report['index_seconds']} 秒")
+
+            for name, query in QUERIES.items():
+                fts_ms, found = timed(lambda: question_search.search(query), args.samples)
+                page_ms, _ = timed(lambda: question_search.search(query, page=20), args.samples)
+                like_ms, like_total = timed(lambda: like_search(query), args.samples)
+                total = found.total
+                assert total == like_total or not found.exact, (query, total, like_total)
+                report["queries"][name] = {
+                    "query": query, "matches": total,
+                    "fts_ms": fts_ms, "fts_page20_ms": page_ms, "like_ms": like_ms,
+                }
+                print(f"{name:10s} {query!r:22s} {total:7d}{' ' if found.exact else '+'}件  FTS {fts_ms:8.3f}ms  "
+                      f"(20ページ目 {page_ms:8.3f}ms)  LIKE {like_ms:8.3f}ms")
+
+            # トリガーの負荷（問題の追加・更新1件ごとの時間）
+            def write_one(n=[0]):
+                n[0] += 1
+                q_id = args.questions + n[0]
+                with db.engine.begin() as conn:
+                    conn.execute(text(
+                        "INSERT INTO questions (id, question, hint, correct, category) VALUES (:id, :q, 'ヒント', 1, '1')"
+                    ), {"id": q_id, "q": f"追加した問題 {q_id}"})
+                    conn.execute(text("UPDATE questions SET question = :q WHERE id = :id"),
+                                 {"id": q_id, "q": f"更新した問題 {q_id}"})
+
+            report["insert_update_ms"], _ = timed(write_one, args.samples * 10)
+            print(f"問題の追加と更新（トリガーを含む）: {report['insert_update_ms']}ms")
+            db.engine.dispose()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
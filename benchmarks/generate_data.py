@@ -0,0 +1,174 @@
+"""負荷テスト用のデータベースを作る。
+
+N 人のユーザー、CHAPTERS の各章に分けた M 問の問題、K 件の解答履歴を
+乱数の種から再現できるように作り、最後に user_question_stats と問題ごと・章ごとの
+集計を作る。
+解答履歴はユーザーごとに「1章10問の演習」を日付順に繰り返したものとし、
+正答率はユーザーの実力と問題の難しさで決まり、同じ問題を解くたびに上がる。
+
+全ユーザーのパスワードは同じ（--password）。管理者は admin@example.com。
+
+使い方: python -m benchmarks.generate_data instance/bench.db --users 1000 --questions 2000 --results 1000000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from werkzeug.security import generate_password_hash
+
+import mastery
+import migrations
+import rollups
+from chapters import CHAPTERS
+from model import Question, User, question_content_hash
+
+ADMIN_EMAIL = "admin@example.com"
+SESSION_SIZE = 10
+BATCH_SIZE = 50000
+
+
+def user_email(i):
+    return f"user{i}@example.com"
+
+
+def make_questions(count, rng):
+    """章ごとにほぼ同じ数の問題を作る。(行のリスト, 章ごとの問題ID, 問題IDごとの難しさ) を返す。"""
+    rows = []
+    by_category = {str(chapter_id): [] for chapter_id, _ in CHAPTERS}
+    difficulty = {}
+    for q_id in range(1, count + 1):
+        chapter_id, title = CHAPTERS[(q_id - 1) % len(CHAPTERS)]
+        category = str(chapter_id)
+        question = f"{title} 問題 {q_id}: 次のうち正しいものはどれですか？"
+        choices = [f"選択肢 {n}（問題 {q_id}）" for n in range(1, 5)]
+        rows.append({
+            "id": q_id,
+            "question": question,
+            "choice1": choices[0],
+            "choice2": choices[1],
+            "choice3": choices[2],
+            "choice4": choices[3],
+            "correct": rng.randint(1, 4),
+            "category": category,
+            "hint": f"ヒント {q_id}",
+            "url": None,
+            "content_hash": question_content_hash(category, question, choices),
+        })
+        by_category[category].append(q_id)
+        difficulty[q_id] = rng.uniform(-0.25, 0.15)
+    return rows, {k: v for k, v in by_category.items() if v}, difficulty
+
+
+def result_counts(users, results, rng):
+    """K 件の解答をユーザーに配る。よく使う人とほとんど使わない人がいるよう偏らせる。"""
+    weights = [rng.paretovariate(1.5) for _ in range(users)]
+    total = sum(weights)
+    counts = [int(results * w / total) for w in weights]
+    for i in range(results - sum(counts)):
+        counts[i % users] += 1
+    return counts
+
+
+def user_history(user_id, count, by_category, difficulty, start, days, rng):
+    """1人分の解答履歴 (user_id, question_id, is_correct, timestamp) を日付順に返す。"""
+    ability = rng.uniform(0.45, 0.85)
+    categories = list(by_category)
+    # 前の章ほどよく解かれる
+    chapter_weights = [1.0 / (i + 1) for i in range(len(categories))]
+    sessions = max(1, -(-count // SESSION_SIZE))
+    step = timedelta(days=days) / sessions
+    seen = {}
+
+    end = start + timedelta(days=days)
+    when = start + timedelta(seconds=rng.randint(0, 86400))
+    produced = 0
+    while produced < count:
+        category = rng.choices(categories, chapter_weights)[0]
+        pool = by_category[category]
+        for q_id in rng.sample(pool, min(SESSION_SIZE, len(pool), count - produced)):
+            attempts = seen.get(q_id, 0)
+            p = min(0.97, ability + difficulty[q_id] + 0.12 * attempts)
+            seen[q_id] = attempts + 1
+            when += timedelta(seconds=rng.randint(10, 90))
+            # 間隔の揺らぎで今日を越えないようにする
+            yield (user_id, q_id, rng.random() < p, min(when, end))
+            produced += 1
+        when += step * rng.uniform(0.5, 1.5)
+
+
+def generate(db_path, users, questions, results, seed=1, days=180, password="password",
+             hash_method="scrypt:32768:8:1", echo=print):
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = create_engine("sqlite:///" + db_path)
+    migrations.upgrade(engine)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    # ハッシュの計算は重いので、全員で同じものを使う
+    pwhash = generate_password_hash(password, method=hash_method)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"id": 1, "email": ADMIN_EMAIL, "nickname": "管理者", "password_hash": pwhash, "role": "admin"}
+        ] + [
+            {"id": i + 1, "email": user_email(i), "nickname": f"user{i}", "password_hash": pwhash, "role": "student"}
+            for i in range(1, users + 1)
+        ])
+        rows, by_category, difficulty = make_questions(questions, rng)
+        conn.execute(insert(Question.__table__), rows)
+    echo(f"ユーザー {users} 人、問題 {questions} 問を作成しました")
+
+    # 同じ日に作れば同じ内容になるよう、今日の0時までの履歴にする
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=days)
+    written = 0
+    with engine.begin() as conn:
+        batch = []
+        for i, count in enumerate(result_counts(users, results, rng), start=1):
+            for user_id, q_id, is_correct, when in user_history(i + 1, count, by_category, difficulty, start, days, rng):
+                # アプリ（SQLAlchemy の DateTime）と同じくマイクロ秒まで書く（履歴のキーセットの比較が文字列で行われるため）
+                batch.append((user_id, q_id, is_correct, when.isoformat(sep=" ", timespec="microseconds")))
+                if len(batch) >= BATCH_SIZE:
+                    conn.exec_driver_sql(
+                        "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+                        batch,
+                    )
+                    written += len(batch)
+                    batch = []
+                    echo(f"  解答履歴 {written} 件")
+        if batch:
+            conn.exec_driver_sql(
+                "INSERT INTO quiz_results (user_id, question_id, is_correct, timestamp) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            written += len(batch)
+
+    with engine.begin() as conn:
+        stats = mastery.backfill(conn)
+        rollups.rebuild(conn)
+    engine.dispose()
+    echo(f"解答履歴 {written} 件、user_question_stats {stats} 件（{time.perf_counter() - started:.1f} 秒）")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", help="作成するSQLiteファイル（既存のものは削除する）")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--results", type=int, default=200000, help="quiz_results の件数")
+    parser.add_argument("--days", type=int, default=180, help="解答履歴の期間（日）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--hash-method", default="scrypt:32768:8:1")
+    args = parser.parse_args()
+
+    generate(args.db_path, args.users, args.questions, args.results, seed=args.seed, days=args.days,
+             password=args.password, hash_method=args.hash_method)
+
+
+if __name__ == "__main__":
+    main()
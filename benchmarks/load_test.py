@@ -0,0 +1,274 @@
+"""MyQuest の負荷テスト。
+
+benchmarks.generate_data で作ったデータベースを使ってアプリを起動し
+（--url を指定したときは起動済みのサーバーに対して）、複数のクライアントが
+実際の操作の流れを繰り返す。
+
+    ログイン → /section_test/<章> → /submit_section_test
+             → /practice?type=exclude_answered → /check_answer
+
+ルートごとのスループットと p50 / p95 / p99 の待ち時間を JSON に書き出す。
+--baseline に以前の JSON を渡すと p95 とスループットの差を表示する。
+
+使い方:
+    python -m benchmarks.generate_data /tmp/bench.db
+    python -m benchmarks.load_test /tmp/bench.db --clients 16 --duration 30 --output load.json
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from chapters import CHAPTERS
+
+ROUTES = [
+    "POST /try_login",
+    "GET /section_test/<category>",
+    "POST /submit_section_test",
+    "GET /practice?type=exclude_answered",
+    "POST /check_answer",
+]
+
+_ANSWER_FIELD = re.compile(r'name="answer_(\d+)"')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # リダイレクトを追わず、そのリクエスト自体の時間だけを測る
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Client:
+    def __init__(self, base_url, email, password, rng, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.rng = rng
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+        self.samples = []  # (ルート, ミリ秒, 成功したか)
+
+    def request(self, route, path, data=None, json_body=None):
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif data is not None:
+            data = urllib.parse.urlencode(data).encode("utf-8")
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+
+        t0 = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as res:
+                status, body = res.status, res.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except OSError:
+            status, body = None, b""
+        elapsed = (time.perf_counter() - t0) * 1000
+
+        ok = status is not None and status < 400
+        self.samples.append((route, elapsed, ok))
+        return status, body.decode("utf-8", "replace")
+
+    def login(self):
+        status, _ = self.request(ROUTES[0], "/try_login", {"email": self.email, "password": self.password})
+        # 成功すると /home へのリダイレクトになる
+        return status == 302
+
+    def iteration(self):
+        category = str(self.rng.choice(CHAPTERS)[0])
+        _, html = self.request(ROUTES[1], f"/section_test/{category}")
+        ids = list(dict.fromkeys(_ANSWER_FIELD.findall(html)))
+
+        if ids:
+            form = {"category_name": category}
+            form.update({f"answer_{q_id}": str(self.rng.randint(1, 4)) for q_id in ids})
+            self.request(ROUTES[2], "/submit_section_test", form)
+
+        _, html = self.request(ROUTES[3], "/practice?type=exclude_answered")
+        ids = _ANSWER_FIELD.findall(html) or ids
+        if ids:
+            self.request(ROUTES[4], "/check_answer", json_body={
+                "question_id": int(self.rng.choice(ids)),
+                "user_answer": self.rng.randint(1, 4),
+            })
+
+
+def start_server(db_path):
+    """データベースを指定してアプリを読み込み、空いているポートで起動する。"""
+    from werkzeug.serving import make_server
+
+    from app import create_app
+
+    # クライアントはすべて 127.0.0.1 から送るので、回数制限はかけない
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.abspath(db_path),
+                      "RATE_LIMIT_ENABLED": False})
+
+    # 1リクエストごとのアクセスログは計測の邪魔になるので出さない
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def summarize(samples, seconds):
+    by_route = {}
+    for route, elapsed, ok in samples:
+        by_route.setdefault(route, ([], [0]))
+        latencies, errors = by_route[route]
+        if ok:
+            latencies.append(elapsed)
+        else:
+            errors[0] += 1
+
+    report = {}
+    for route in ROUTES + sorted(set(by_route) - set(ROUTES)):
+        if route not in by_route:
+            continue
+        latencies, errors = by_route[route]
+        latencies.sort()
+        entry = {"requests": len(latencies) + errors[0], "errors": errors[0]}
+        entry["throughput_rps"] = round(entry["requests"] / seconds, 2) if seconds else None
+        if latencies:
+            entry.update({
+                "mean_ms": round(statistics.fmean(latencies), 3),
+                "p50_ms": round(percentile(latencies, 0.50), 3),
+                "p95_ms": round(percentile(latencies, 0.95), 3),
+                "p99_ms": round(percentile(latencies, 0.99), 3),
+                "max_ms": round(latencies[-1], 3),
+            })
+        report[route] = entry
+    return report
+
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, int(round(len(sorted_values) * p)) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print(f"比較対象: {baseline['meta'].get('revision')}")
+    for route, entry in report["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before or "p95_ms" not in entry or "p95_ms" not in before:
+            continue
+        p95 = (entry["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        rps = (entry["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100 \
+            if before["throughput_rps"] else 0
+        print(f"  {route:40s} p95 {before['p95_ms']:9.2f} → {entry['p95_ms']:9.2f} ms ({p95:+.1f}%)"
+              f"  rps {rps:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", nargs="?", help="generate_data で作ったSQLiteファイル（--url のときは不要）")
+    parser.add_argument("--url", help="起動済みのサーバーのURL（指定しなければアプリをこのプロセスで起動する）")
+    parser.add_argument("--clients", type=int, default=16, help="同時に操作するユーザー数")
+    parser.add_argument("--duration", type=float, default=30.0, help="計測する秒数")
+    parser.add_argument("--users", type=int, default=1000, help="ログインに使う user<i>@example.com の人数")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較する以前の結果のJSONファイル")
+    args = parser.parse_args()
+    if not args.url and not args.db_path:
+        parser.error("db_path か --url のどちらかが必要です")
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_server(args.db_path)
+
+    clients = [
+        Client(base_url, f"user{(i % args.users) + 1}@example.com", args.password,
+               random.Random(args.seed * 1000 + i), args.timeout)
+        for i in range(args.clients)
+    ]
+    deadline = None
+    login_failures = []
+
+    def worker(client):
+        if not client.login():
+            login_failures.append(client.email)
+            return
+        while time.perf_counter() < deadline:
+            client.iteration()
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in clients]
+    started = time.perf_counter()
+    deadline = started + args.duration
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - started
+
+    if server is not None:
+        server.shutdown()
+        from result_writer import result_writer
+        result_writer.flush()
+
+    samples = [s for c in clients for s in c.samples]
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "url": args.url or "(in-process)",
+            "clients": args.clients,
+            "duration_s": round(seconds, 3),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "login_failures": len(login_failures),
+        },
+        "routes": summarize(samples, seconds),
+    }
+    total = [elapsed for _, elapsed, ok in samples if ok]
+    report["total"] = {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not s[2]),
+        "throughput_rps": round(len(samples) / seconds, 2),
+    }
+
+    for route, entry in report["routes"].items():
+        print(f"{route:40s} {entry['requests']:7d} req {entry['throughput_rps']:8.2f} rps  "
+              f"p50 {entry.get('p50_ms', 0):8.2f}  p95 {entry.get('p95_ms', 0):8.2f}  "
+              f"p99 {entry.get('p99_ms', 0):8.2f} ms  errors {entry['errors']}")
+    print(f"合計 {report['total']['requests']} 件（{report['total']['throughput_rps']} rps）、"
+          f"エラー {report['total']['errors']} 件、ログイン失敗 {len(login_failures)} 人")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if login_failures and not total:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""問題の一括編集（管理者用の /api/questions/bulk）。
+
+作成・更新・削除の操作のリストを受け取り、まず全件を検証してから
+1トランザクションで適用する。問題バンクのバージョン、章ごとの集計、
+HTML 断片のキャッシュの更新はバッチ全体で一度だけ行う。
+
+操作の形式（JSON 配列または JSON Lines、1行1操作）:
+    {"op": "create", "question": ..., "choices": [4つ], "correct": 1-4, "category": ..., "hint": ..., "url": ...}
+    {"op": "update", "id": 12, 変更する項目だけ}
+    {"op": "delete", "id": 12}
+op を省略したときは id があれば update、なければ create とみなす。
+選択肢は "choices" のほか update_question と同じ choice1〜choice4 でも指定できる。
+作成はインポートと同じく content_hash で upsert するので、同じ内容の問題は重複しない。
+"""
+import time
+
+from sqlalchemy import bindparam, delete, select, update
+
+import rollups
+from database import db
+from fragment_cache import fragment_cache
+from import_questions import upsert_questions, validate_item
+from model import Question
+from question_bank import question_bank
+
+OPERATIONS = ("create", "update", "delete")
+FIELDS = ("question", "choices", "correct", "category", "hint", "url")
+
+
+class BulkReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.errors = []
+        self.applied = False
+        self.seconds = 0.0
+
+    def add_error(self, index, question_id, message, offset=None):
+        error = {"index": index, "id": question_id, "error": message}
+        if offset is not None:
+            error["offset"] = offset
+        self.errors.append(error)
+
+    def to_dict(self):
+        return {
+            "applied": self.applied,
+            "created": self.created,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def _fields(item):
+    """choice1〜choice4 で指定された選択肢を choices にまとめる。"""
+    fields = {k: item[k] for k in FIELDS if k in item}
+    if "choices" not in fields and any(f"choice{n}" in item for n in range(1, 5)):
+        fields["choices"] = [item.get(f"choice{n}") for n in range(1, 5)]
+    return fields
+
+
+def _existing_fields(question):
+    return {
+        "question": question.question,
+        "choices": [question.choice1, question.choice2, question.choice3, question.choice4],
+        "correct": question.correct,
+        "category": question.category,
+        "hint": question.hint,
+        "url": question.url,
+    }
+
+
+def _question_id(item):
+    try:
+        return int(item["id"])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def apply_operations(records, partial=False):
+    """(位置, 操作, 読み込みエラー) を検証して適用する。
+
+    partial が False のときは1件でもエラーがあれば何も変更しない。
+    True のときは正しい操作だけを適用する。
+    """
+    started = time.perf_counter()
+    report = BulkReport()
+    parsed = []
+    for index, (offset, item, error) in enumerate(records):
+        if error is None and not isinstance(item, dict):
+            error = "操作はオブジェクトである必要があります"
+        if error is not None:
+            report.add_error(index, None, error, offset)
+            continue
+        op = item.get("op") or ("update" if "id" in item else "create")
+        if op not in OPERATIONS:
+            report.add_error(index, item.get("id"), f"op は {', '.join(OPERATIONS)} のいずれかです: {op!r}", offset)
+            continue
+        parsed.append((index, offset, op, item))
+
+    # 更新・削除の対象を1回の検索で読み込む
+    target_ids = {_question_id(item) for _, _, op, item in parsed if op != "create"} - {None}
+    existing = {
+        q.id: q for q in db.session.execute(select(Question).where(Question.id.in_(target_ids))).scalars()
+    } if target_ids else {}
+
+    creates = []
+    updates = []
+    deletes = []
+    touched = set()
+    for index, offset, op, item in parsed:
+        if op == "create":
+            try:
+                creates.append((index, offset, validate_item(_fields(item))))
+            except ValueError as e:
+                report.add_error(index, None, str(e), offset)
+            continue
+
+        q_id = _question_id(item)
+        if q_id is None:
+            report.add_error(index, item.get("id"), "id が必要です", offset)
+            continue
+        question = existing.get(q_id)
+        if question is None:
+            report.add_error(index, q_id, "Question not found", offset)
+            continue
+        if q_id in touched:
+            report.add_error(index, q_id, "同じ問題に対する操作が複数あります", offset)
+            continue
+        touched.add(q_id)
+
+        if op == "delete":
+            deletes.append((index, offset, question))
+            continue
+        merged = _existing_fields(question)
+        merged.update(_fields(item))
+        try:
+            updates.append((index, offset, question, validate_item(merged)))
+        except ValueError as e:
+            report.add_error(index, q_id, str(e), offset)
+
+    updates = _check_duplicates(updates, creates, {q.id for _, _, q in deletes}, report)
+
+    if report.errors and not partial:
+        report.seconds = time.perf_counter() - started
+        return report
+    if not (creates or updates or deletes):
+        report.seconds = time.perf_counter() - started
+        return report
+
+    # commit 後は ORM オブジェクトを読めないので先にIDを控える
+    changed_ids = [q.id for _, _, q in deletes] + [q.id for _, _, q, _ in updates]
+    # 章ごとの集計は、問題が移動・削除された章だけを作り直す
+    changed_categories = {q.category for _, _, q in deletes}
+    for _, _, question, row in updates:
+        if question.category != row["category"]:
+            changed_categories.update((question.category, row["category"]))
+
+    if deletes:
+        deleted_ids = [q.id for _, _, q in deletes]
+        rollups.forget_questions(deleted_ids)
+        db.session.execute(delete(Question.__table__).where(Question.id.in_(deleted_ids)))
+        report.deleted = len(deleted_ids)
+    if updates:
+        table = Question.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam("b_id")),
+            [dict(row, b_id=question.id) for _, _, question, row in updates],
+        )
+        report.updated += len(updates)
+    if creates:
+        inserted, upserted = upsert_questions([row for _, _, row in creates])
+        report.created += inserted
+        report.updated += upserted
+
+    rollups.rebuild_chapters(changed_categories)
+    question_bank.mark_changed()
+    db.session.commit()
+    question_bank.invalidate()
+    report.applied = True
+
+    for question_id in changed_ids:
+        fragment_cache.invalidate(question_id)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def _check_duplicates(updates, creates, deleted_ids, report):
+    """更新後の内容が他の問題と同じになるもの（content_hash の一意制約に反するもの）を除く。"""
+    if not updates:
+        return updates
+    hashes = [row["content_hash"] for _, _, _, row in updates]
+    owners = dict(db.session.execute(
+        select(Question.content_hash, Question.id).where(Question.content_hash.in_(hashes))
+    ).all())
+    # このバッチで内容が変わる・削除される問題は古いハッシュを手放す
+    for _, _, question, _ in updates:
+        if owners.get(question.content_hash) == question.id:
+            del owners[question.content_hash]
+    for q_id in deleted_ids:
+        for content_hash, owner in list(owners.items()):
+            if owner == q_id:
+                del owners[content_hash]
+    created_hashes = {row["content_hash"] for _, _, row in creates}
+
+    valid = []
+    for index, offset, question, row in updates:
+        content_hash = row["content_hash"]
+        owner = owners.get(content_hash)
+        if (owner is not None and owner != question.id) or content_hash in created_hashes:
+            report.add_error(index, question.id, "同じ内容の問題が既に存在します", offset)
+            continue
+        owners[content_hash] = question.id
+        valid.append((index, offset, question, row))
+    return valid
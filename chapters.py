@@ -0,0 +1,20 @@
+# home.html からコピーした章のリスト
+# 順序を維持するためにリスト・オブ・タプルを使用
+CHAPTERS = [
+    (1, "1. やる気を高めよう"),
+    (2, "2. Python インタプリタを使う"),
+    (3, "3. 形式ばらない Python の紹介"),
+    (4, "4. その他の制御フローツール"),
+    (5, "5. データ構造"),
+    (6, "6. モジュール"),
+    (7, "7. 入力と出力"),
+    (8, "8. エラーと例外"),
+    (9, "9. クラス"),
+    (10, "10. 標準ライブラリミニツアー"),
+    (11, "11. 標準ライブラリミニツアー --- その 2"),
+    (12, "12. 仮想環境とパッケージ"),
+    (14, "14. 対話入力編集と履歴置換"),
+]
+
+# インポート時の検証などで使うカテゴリ（questions.category は文字列）
+CATEGORY_IDS = frozenset(str(chapter_id) for chapter_id, _ in CHAPTERS)
@@ -1,12 +1,15 @@
-from app import app
 from database import db
+from settings import create_base_app
 from model import Question, User
+import migrations
+
+app = create_base_app()
 
 def setup_database():
     with app.app_context():
         # すべてのテーブルを作成（Userテーブルも含まれる）
         print("--- テーブルを作成します ---")
-        db.create_all()
+        migrations.upgrade(echo=print)
         print("--- テーブル作成完了 ---")
 
         # 初期ユーザーを登録
@@ -23,7 +26,7 @@ def setup_database():
             print("student@example.com は既に登録されています。")
 
         if not admin_exists:
-            admin = User(email='admin@example.com')
+            admin = User(email='admin@example.com', role='admin')
             admin.set_password('admin123')
             db.session.add(admin)
             print("admin@example.com を登録しました。")
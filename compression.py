@@ -0,0 +1,52 @@
+"""JSON / HTML レスポンスの圧縮。
+
+Accept-Encoding に応じて brotli（brotli パッケージがあれば）か gzip で圧縮する。
+ストリーミングのレスポンスや小さいレスポンスはそのまま返す。
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError: # brotli は任意の依存パッケージ
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html"}
+
+
+def init_app(app):
+    level = app.config.get("COMPRESS_LEVEL", 6)
+    min_size = app.config.get("COMPRESS_MIN_SIZE", 500)
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            encoding = "br"
+        elif accepted["gzip"]:
+            encoding = "gzip"
+        else:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        if encoding == "br":
+            data = brotli.compress(data, quality=min(level, 11))
+        else:
+            data = gzip.compress(data, compresslevel=level)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -1,6 +1,10 @@
 import os
-from app import app, db
+from database import db
+from settings import create_base_app
 from model import User
+import migrations
+
+app = create_base_app()
 
 def create_users():
     """データベースに初期ユーザーを追加します。"""
@@ -13,20 +17,20 @@ def create_users():
             print("既存のデータベースを削除しました。")
 
         # データベーステーブルを作成
-        db.create_all()
+        migrations.upgrade(echo=print)
 
         # 追加するユーザーのリスト
         users_to_add = [
-            {"email": "admin@example.com", "password": "pass123", "nickname": "管理者"},
-            {"email": "user1@example.com", "password": "password", "nickname": "user1"},
-            {"email": "user2@example.com", "password": "password", "nickname": "user2"}
+            {"email": "admin@example.com", "password": "pass123", "nickname": "管理者", "role": "admin"},
+            {"email": "user1@example.com", "password": "password", "nickname": "user1", "role": "student"},
+            {"email": "user2@example.com", "password": "password", "nickname": "user2", "role": "student"}
         ]
 
         for user_data in users_to_add:
             # ユーザーが既に存在するか確認
             existing_user = User.query.filter_by(email=user_data["email"]).first()
             if not existing_user:
-                new_user = User(email=user_data["email"], nickname=user_data["nickname"])
+                new_user = User(email=user_data["email"], nickname=user_data["nickname"], role=user_data["role"])
                 new_user.set_password(user_data["password"])
                 db.session.add(new_user)
                 print(f"ユーザー '{user_data['email']}' を追加しました。")
@@ -1,3 +1,36 @@
+from flask import has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
 
-db = SQLAlchemy()
\ No newline at end of file
+READONLY_BIND = "readonly"
+
+
+class RoutingSession(Session):
+    """GET / HEAD リクエスト中の SELECT を読み取り専用の接続（bind "readonly"）に振り分ける。"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and has_request_context()
+            and request.method in ("GET", "HEAD")
+        ):
+            engine = self._db.engines.get(READONLY_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def upsert_insert(table, bind=None):
+    """ON CONFLICT ... DO UPDATE を使える INSERT 文を返す（SQLite / PostgreSQL）。"""
+    dialect = (bind if bind is not None else db.engine).dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
@@ -0,0 +1,84 @@
+"""データベース接続の設定（本番向けプロファイル）。
+
+- MYQUEST_DATABASE_URL が設定されていればそのURIを使う（サーバー型DBへの切り替え）。
+  未設定なら instance/quiz.db を使う。create_app に SQLALCHEMY_DATABASE_URI を渡せばそれを優先する。
+- SQLite では接続ごとに PRAGMA（WAL、synchronous=NORMAL、busy_timeout など）を設定する。
+- 接続プールの大きさは MYQUEST_DB_POOL_SIZE / MYQUEST_DB_MAX_OVERFLOW で変更できる。
+- SQLite のとき、GET / HEAD リクエストの SELECT は query_only の読み取り専用接続
+  （bind "readonly"）を使う。振り分けは database.RoutingSession が行う。
+"""
+import os
+
+from sqlalchemy import event
+
+from database import READONLY_BIND, db
+
+DEFAULT_SQLITE_PRAGMAS = {
+    # 新しく作るデータベースで PRAGMA incremental_vacuum を使えるようにする（retention.py）。
+    # 既存のデータベースでは python retention.py enable-incremental-vacuum を1回実行する
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",       # 読み取りが書き込みを待たない
+    "synchronous": "NORMAL",     # WAL ではコミットごとの fsync を省いても壊れない
+    "busy_timeout": 5000,        # ロック待ち（ミリ秒）
+    "mmap_size": 268435456,      # 256MB
+    "cache_size": -65536,        # 64MB（負の値は KiB 単位）
+    "temp_store": "MEMORY",
+}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def configure(app, basedir):
+    """環境変数から接続先とエンジンの設定を app.config に入れる。db.init_app の前に呼ぶ。"""
+    default_uri = "sqlite:///" + os.path.join(basedir, "instance", "quiz.db")
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI") or os.environ.get("MYQUEST_DATABASE_URL", default_uri)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config.setdefault("SQLITE_PRAGMAS", dict(DEFAULT_SQLITE_PRAGMAS))
+
+    is_sqlite = uri.startswith("sqlite")
+    in_memory = is_sqlite and (uri in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in uri)
+    if in_memory:
+        return
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": _env_int("MYQUEST_DB_POOL_SIZE", 10),
+        "max_overflow": _env_int("MYQUEST_DB_MAX_OVERFLOW", 20),
+        "pool_timeout": _env_int("MYQUEST_DB_POOL_TIMEOUT", 10),
+        "pool_pre_ping": not is_sqlite,
+    }
+    if is_sqlite and os.environ.get("MYQUEST_READONLY_GET", "1") != "0":
+        app.config["SQLALCHEMY_BINDS"] = {READONLY_BIND: uri}
+
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """作成済みのエンジンに接続ごとの PRAGMA を登録する。db.init_app の後に呼ぶ。"""
+    pragmas = app.config.get("SQLITE_PRAGMAS", DEFAULT_SQLITE_PRAGMAS)
+    with app.app_context():
+        engines = dict(db.engines)
+
+    for key, engine in engines.items():
+        if engine.dialect.name != "sqlite":
+            continue
+        if key == READONLY_BIND:
+            # journal_mode は書き込み用の接続で設定済み。こちらは書き込みを禁止するだけ
+            engine_pragmas = {k: v for k, v in pragmas.items() if k != "journal_mode"}
+            engine_pragmas["query_only"] = "ON"
+        else:
+            engine_pragmas = pragmas
+        event.listen(engine, "connect", _pragma_listener(engine_pragmas))
@@ -0,0 +1,83 @@
+"""問題ごとの HTML 断片のキャッシュ。
+
+問題文と選択肢（templates/_question.html）、解説と参考URL（templates/_question_explanation.html）は
+誰が開いても同じなので、問題の内容ごとに一度だけ描画して使い回す。section_test.html と
+practice.html は question_fragment(q_obj, 番号) と question_explanation(q_obj) を呼ぶだけで、
+リクエストごとの Jinja の処理はユーザーごとに異なる外側の部分だけになる。
+問題の番号はページごとに違うので、断片は番号の前後に分けて保存し、描画のたびにつなぐ。
+
+キャッシュは問題の内容のバージョン（問題バンクの question_versions と同じ値）で引き、
+内容が変わっていれば描画し直す。update_question は invalidate も呼ぶ。
+テンプレートは毎回 Jinja の環境から取り出す（Jinja のキャッシュがあるので読み直しはしない）ので、
+開発中にテンプレートを変えたときは、変わったテンプレートの断片だけが描画し直される。
+"""
+import threading
+
+from markupsafe import Markup
+
+from question_bank import content_version, question_bank
+
+QUESTION_TEMPLATE = "_question.html"
+EXPLANATION_TEMPLATE = "_question_explanation.html"
+
+# 番号の位置の目印（問題文より前にあるので、最初に見つかったものが番号の位置）
+_NUMBER = Markup("\x00")
+
+
+class FragmentCache:
+    def __init__(self):
+        self.app = None
+        self._fragments = {} # (テンプレート名, 問題ID) → (内容のバージョン, テンプレート, HTML)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.jinja_env.globals["question_fragment"] = self.render
+        app.jinja_env.globals["question_explanation"] = self.render_explanation
+
+    def render(self, question, number):
+        """問題文と選択肢の HTML。"""
+        head, tail = self._get(QUESTION_TEMPLATE, question, _split_number)
+        # 描画済みの HTML なのでエスケープせずにつなぐ（番号は整数に限る）
+        return Markup(f"{head}{number:d}{tail}")
+
+    def render_explanation(self, question):
+        """解説と参考URLの HTML。"""
+        return self._get(EXPLANATION_TEMPLATE, question, Markup)
+
+    def invalidate(self, question_id=None):
+        with self._lock:
+            if question_id is None:
+                self._fragments.clear()
+            else:
+                for name in (QUESTION_TEMPLATE, EXPLANATION_TEMPLATE):
+                    self._fragments.pop((name, question_id), None)
+
+    def _get(self, name, question, build):
+        template = self.app.jinja_env.get_template(name)
+        version = _version(question)
+        key = (name, question.id)
+        cached = self._fragments.get(key)
+        if cached is not None and cached[0] == version and cached[1] is template:
+            return cached[2]
+
+        fragment = build(template.render(q_obj=question, number=_NUMBER))
+        with self._lock:
+            self._fragments[key] = (version, template, fragment)
+        return fragment
+
+
+def _version(question):
+    # 今のスナップショットの問題なら計算済みのバージョンを使う
+    snap = question_bank.snapshot()
+    if snap.by_id.get(question.id) is question:
+        return snap.question_versions[question.id]
+    return content_version(question)
+
+
+def _split_number(html):
+    head, tail = html.split(_NUMBER, 1)
+    return head, tail
+
+
+fragment_cache = FragmentCache()
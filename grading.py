@@ -0,0 +1,108 @@
+"""解答の採点と保存。
+
+submit_section_test と practice の POST はどちらも grade_and_record を呼ぶ。
+1回の提出を1回のループで採点し、結果の保存は result_writer に任せる。
+check_answer / check_answer_batch の JSON API は check_items で採点する。
+"""
+from collections import namedtuple
+
+from question_bank import question_bank
+from result_writer import result_writer
+
+GradedSubmission = namedtuple("GradedSubmission", ["results", "questions", "score", "total", "percentage"])
+CheckedItems = namedtuple("CheckedItems", ["results", "outcomes", "score"])
+
+# check_items の結果のエラー
+MISSING_DATA = "Missing data"
+QUESTION_NOT_FOUND = "Question not found"
+
+
+def answered_question_ids(answers):
+    """フォームの answer_<id> キーから問題IDを取り出す。"""
+    return [key.split('_')[1] for key in answers.keys() if key.startswith('answer_')]
+
+
+def _to_answer(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return -1 # 未回答・不正な値はどの選択肢とも一致しない
+
+
+def grade_answer(question, user_answer_val):
+    """1問分の採点結果をテンプレートで使う辞書で返す。"""
+    is_correct = (user_answer_val == question.correct)
+    choices = [question.choice1, question.choice2, question.choice3, question.choice4]
+
+    user_choice_text = choices[user_answer_val - 1] if 0 < user_answer_val <= 4 else "未回答"
+    correct_choice_text = choices[question.correct - 1] if 0 < question.correct <= 4 else ""
+
+    return {
+        "question": question,
+        "user_answer": user_answer_val,
+        "user_choice_text": user_choice_text,
+        "correct_answer": question.correct,
+        "correct_choice_text": correct_choice_text,
+        "is_correct": is_correct
+    }
+
+
+def check_items(items):
+    """{question_id, user_answer} のリストを問題バンクのスナップショット1つで採点する。
+
+    結果は入力と同じ順で、1件ごとに correct / correct_answer / correct_choice_text か error を持つ。
+    """
+    by_id = question_bank.snapshot().by_id
+    results = []
+    outcomes = []
+    score = 0
+    for item in items:
+        question_id = item.get("question_id") if isinstance(item, dict) else None
+        user_answer = item.get("user_answer") if isinstance(item, dict) else None
+        if not question_id or not user_answer:
+            results.append({"question_id": question_id, "error": MISSING_DATA})
+            continue
+
+        try:
+            question = by_id.get(int(question_id))
+        except (ValueError, TypeError):
+            question = None
+        if not question:
+            results.append({"question_id": question_id, "error": QUESTION_NOT_FOUND})
+            continue
+
+        graded = grade_answer(question, _to_answer(user_answer))
+        results.append({
+            "question_id": question.id,
+            "correct": graded["is_correct"],
+            "correct_answer": graded["correct_answer"],
+            "correct_choice_text": graded["correct_choice_text"],
+        })
+        outcomes.append((question.id, graded["is_correct"]))
+        if graded["is_correct"]:
+            score += 1
+    return CheckedItems(results, outcomes, score)
+
+
+def grade_and_record(user_id, answers):
+    """提出されたフォームを採点し、結果をまとめて保存する。"""
+    questions = []
+    results = []
+    outcomes = []
+    score = 0
+    for q_id in answered_question_ids(answers):
+        question = question_bank.get(q_id)
+        if not question:
+            continue
+        questions.append(question)
+        graded = grade_answer(question, _to_answer(answers.get(f'answer_{q_id}')))
+        results.append(graded)
+        outcomes.append((question.id, graded["is_correct"]))
+        if graded["is_correct"]:
+            score += 1
+
+    result_writer.submit(user_id, outcomes)
+
+    total = len(questions)
+    percentage = (score / total) * 100 if total > 0 else 0
+    return GradedSubmission(results, questions, score, total, f"{percentage:.1f}")
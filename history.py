@@ -0,0 +1,113 @@
+"""学習者の解答履歴と章ごとの進み具合（/history と /api/history）。
+
+章ごとの正答率は user_question_stats（mastery.py が解答の保存と同時に更新する
+問題ごとの集計）を問題バンクの章でまとめるだけなので、読む行数は解答したことのある
+問題の数までで、解答の回数には関係しない。
+
+解答の一覧は新しい順に、(user_id, timestamp, id) のインデックスを
+「前のページの最後の (timestamp, id) より前」の条件で読む（キーセット方式）。
+OFFSET と違って読み飛ばす行がないので、何ページ目でも1ページ分の行だけを読む。
+カーソルは前のページの最後の解答の "<timestamp>_<id>"。
+アーカイブに移した古い解答（retention.py）は一覧には出ないが、章ごとの集計には含まれる。
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from chapters import CHAPTERS
+from database import db
+from mastery import MASTERY_STREAK
+from model import QuizResult, UserQuestionStat
+from question_bank import question_bank
+
+MAX_PER_PAGE = 200
+
+# next_cursor が None なら最後のページ
+HistoryPage = namedtuple("HistoryPage", ["attempts", "next_cursor"])
+
+
+def encode_cursor(timestamp, result_id):
+    return f"{timestamp.isoformat()}_{result_id}"
+
+
+def decode_cursor(cursor):
+    """カーソルを (timestamp, id) に戻す。不正な値は ValueError。"""
+    timestamp, sep, result_id = cursor.rpartition("_")
+    if not sep:
+        raise ValueError(f"カーソルが不正です: {cursor!r}")
+    return datetime.fromisoformat(timestamp), int(result_id)
+
+
+def attempts_page(user_id, cursor=None, per_page=50):
+    """ユーザーの解答を新しい順に1ページ分返す。cursor は前のページの next_cursor。"""
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    stmt = (
+        select(QuizResult.id, QuizResult.question_id, QuizResult.is_correct, QuizResult.timestamp)
+        .where(QuizResult.user_id == user_id)
+        .order_by(QuizResult.timestamp.desc(), QuizResult.id.desc())
+        .limit(per_page + 1)
+    )
+    if cursor:
+        stmt = stmt.where(tuple_(QuizResult.timestamp, QuizResult.id) < decode_cursor(cursor))
+    rows = db.session.execute(stmt).all()
+
+    # 1件多く読み、次のページがあるかを判定する
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    snapshot = question_bank.snapshot()
+    titles = {str(chapter_id): title for chapter_id, title in CHAPTERS}
+    attempts = []
+    for result_id, question_id, is_correct, timestamp in rows:
+        question = snapshot.by_id.get(question_id)
+        category = question.category if question else None
+        attempts.append({
+            "id": result_id,
+            "question_id": question_id,
+            "question": question.question if question else None,
+            "category": category,
+            "chapter": titles.get(category),
+            "is_correct": bool(is_correct),
+            "timestamp": timestamp.isoformat(timespec="seconds") + "Z",
+        })
+    next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if has_next else None
+    return HistoryPage(attempts, next_cursor)
+
+
+def _rate(attempts, corrects):
+    return round(corrects / attempts, 4) if attempts else None
+
+
+def chapter_progress(user_id):
+    """章ごとの問題数・解答した問題数・解答数・正解数・正答率・習得済みの問題数（CHAPTERS の順）。"""
+    snapshot = question_bank.snapshot()
+    totals = {}
+    for question_id, attempts, corrects, streak in db.session.execute(
+        select(UserQuestionStat.question_id, UserQuestionStat.attempts, UserQuestionStat.corrects,
+               UserQuestionStat.streak)
+        .where(UserQuestionStat.user_id == user_id)
+    ):
+        question = snapshot.by_id.get(question_id)
+        if question is None or not attempts:
+            continue
+        entry = totals.setdefault(question.category, [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] += attempts
+        entry[2] += corrects
+        entry[3] += 1 if streak >= MASTERY_STREAK else 0
+
+    progress = []
+    for chapter_id, title in CHAPTERS:
+        category = str(chapter_id)
+        answered, attempts, corrects, mastered = totals.get(category, (0, 0, 0, 0))
+        progress.append({
+            "category": category,
+            "title": title,
+            "questions": len(snapshot.by_category.get(category, ())),
+            "answered": answered,
+            "attempts": attempts,
+            "corrects": corrects,
+            "correct_rate": _rate(attempts, corrects),
+            "mastered": mastered,
+        })
+    return progress
@@ -0,0 +1,22 @@
+"""条件付き GET（ETag / 304 Not Modified）と Cache-Control の補助。
+
+ETag は問題バンクのスナップショットが持つバージョンから作るので、
+304 を返すときは JSON の組み立ても DB へのアクセスも行わない。
+本文は compression.py で圧縮されることがあるため、弱い ETag を使う。
+"""
+from flask import current_app, request
+
+
+def not_modified(etag):
+    """If-None-Match が etag と一致すれば 304 のレスポンスを返す。一致しなければ None。"""
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(current_app.response_class(status=304), etag)
+    return None
+
+
+def with_cache_headers(response, etag):
+    """ETag と「毎回再検証する」Cache-Control を付ける。"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,126 @@
+"""ログイン中のユーザーの解決。
+
+try_login でユーザーIDとロールを署名付きセッションに保存し、各リクエストでは
+current_user() が最初に呼ばれたときに一度だけユーザーを解決して flask.g に置く。
+解決結果は短い TTL のプロセス内キャッシュにも保持するので、同じユーザーの
+リクエストが続いても users テーブルを毎回引かない。
+"""
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, session
+
+from database import db
+from model import User
+
+ADMIN_ROLE = "admin"
+STUDENT_ROLE = "student"
+# user_deletion が削除中のユーザー（ログインできない）
+DELETED_ROLE = "deleted"
+
+Identity = namedtuple("Identity", ["id", "email", "nickname", "role"])
+
+_MISSING = object()
+
+
+class IdentityCache:
+    """ユーザーID → Identity の TTL 付きキャッシュ。"""
+
+    def __init__(self, ttl=30.0, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, identity = entry
+        if expires < time.monotonic():
+            self.invalidate(user_id)
+            return None
+        return identity
+
+    def put(self, identity):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[identity.id] = (time.monotonic() + self.ttl, identity)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache()
+
+
+def init_app(app):
+    identity_cache.ttl = app.config.get("IDENTITY_CACHE_TTL", identity_cache.ttl)
+
+
+def _to_identity(user):
+    return Identity(user.id, user.email, user.nickname, user.role or STUDENT_ROLE)
+
+
+def login_user(user):
+    """ログインしたユーザーをセッションに保存する。"""
+    session["user"] = user.email
+    session["nickname"] = user.nickname # ニックネームがなければそのままNoneまたは空文字列
+    session["user_id"] = user.id
+    session["role"] = user.role or STUDENT_ROLE
+    identity = _to_identity(user)
+    identity_cache.put(identity)
+    g._current_user = identity
+
+
+def logout_user():
+    for key in ("user", "nickname", "user_id", "role"):
+        session.pop(key, None)
+    g.pop("_current_user", None)
+
+
+def current_user():
+    """ログイン中のユーザーの Identity。ログインしていなければ None。"""
+    identity = g.get("_current_user", _MISSING)
+    if identity is not _MISSING:
+        return identity
+
+    identity = None
+    user_id = session.get("user_id")
+    if user_id is not None:
+        identity = identity_cache.get(user_id)
+        if identity is None:
+            user = db.session.get(User, user_id)
+            identity = _to_identity(user) if user else None
+    elif "user" in session:
+        # user_id を保存する前のセッション
+        user = User.query.filter_by(email=session["user"]).first()
+        if user:
+            identity = _to_identity(user)
+            session["user_id"] = user.id
+            session["role"] = identity.role
+
+    if identity is not None:
+        identity_cache.put(identity)
+        if identity.role == DELETED_ROLE:
+            identity = None
+    g._current_user = identity
+    return identity
+
+
+def is_admin():
+    identity = current_user()
+    return identity is not None and identity.role == ADMIN_ROLE
+
+
+def forget_user(user_id):
+    """ユーザー情報を変更・削除したときにキャッシュから外す。"""
+    identity_cache.invalidate(user_id)
+    if g.get("_current_user") is not None and g._current_user.id == user_id:
+        g.pop("_current_user", None)
@@ -1,36 +1,285 @@
+"""問題のインポート。
+
+JSON 配列と JSON Lines のどちらもファイルの先頭から少しずつ読み込むので、
+大きな問題バンクでもメモリ使用量は一定に収まる。各問題を検証し、不正なものは
+ファイル先頭からのバイト位置つきで報告する。content_hash をキーにして
+一定件数ずつ upsert するので、同じファイルを何度インポートしても重複しない。
+
+使い方:
+    python import_questions.py [ファイル] [--batch-size N] [--check]
+"""
+import argparse
+import codecs
+import io
 import json
-from model import Question
-from app import app
-from database import db
+import re
+
+from sqlalchemy import select
+
+import migrations
+from chapters import CATEGORY_IDS
+from database import db, upsert_insert
+from model import Question, question_content_hash
+from question_bank import question_bank
+
+CHUNK_SIZE = 1 << 16
+# 1件の問題がこれより大きければ壊れているとみなす（読み込みを打ち切る）
+MAX_RECORD_CHARS = 1 << 20
+# 報告用に保持するエラーの上限（件数自体はすべて数える）
+MAX_REPORTED_ERRORS = 1000
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class ImportReport:
+    def __init__(self):
+        self.total = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, offset, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((offset, message))
+
+
+def iter_json_array(f, offset=0):
+    """バイナリファイルの JSON 配列から (バイト位置, 要素, エラー) を順に返す。
+
+    構文エラーのあとは続きを読めないため、エラーを1件返して終了する。
+    offset は f の読み取り位置のファイル先頭からのバイト位置（読み飛ばした分）。
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0       # buf の中の読み取り位置
+    byte_pos = offset  # pos に対応するファイル先頭からのバイト位置
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(CHUNK_SIZE)
+        # 読み終えた部分は捨てる（buf は未処理の部分だけを持つ）
+        buf = buf[pos:] + utf8.decode(chunk, final=not chunk)
+        pos = 0
+        eof = not chunk
+
+    def advance(to):
+        nonlocal pos, byte_pos
+        byte_pos += len(buf[pos:to].encode("utf-8"))
+        pos = to
+
+    def skip_whitespace():
+        while True:
+            advance(_WHITESPACE.match(buf, pos).end())
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    try:
+        skip_whitespace()
+        if buf[pos:pos + 1] != "[":
+            yield byte_pos, None, "JSON 配列は '[' で始まる必要があります"
+            return
+        advance(pos + 1)
+
+        first = True
+        while True:
+            skip_whitespace()
+            if pos >= len(buf):
+                yield byte_pos, None, "配列が ']' で閉じられていません"
+                return
+            if buf[pos] == "]":
+                return
+            if not first:
+                if buf[pos] != ",":
+                    yield byte_pos, None, "',' が必要です"
+                    return
+                advance(pos + 1)
+                skip_whitespace()
+
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # 数値などはバッファの終わりで途切れている可能性がある
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError as e:
+                    if eof or len(buf) - pos > MAX_RECORD_CHARS:
+                        yield byte_pos + len(buf[pos:e.pos].encode("utf-8")), None, e.msg
+                        return
+                fill()
+
+            yield byte_pos, item, None
+            advance(end)
+            first = False
+    except UnicodeDecodeError as e:
+        yield byte_pos, None, f"UTF-8 として読めません: {e.reason}"
+
+
+def iter_json_lines(f, offset=0):
+    """バイナリファイルの JSON Lines から (バイト位置, 要素, エラー) を順に返す。
+
+    offset は f の読み取り位置のファイル先頭からのバイト位置（読み飛ばした分）。
+    """
+    for line in f:
+        start = offset
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            yield start, json.loads(line), None
+        except UnicodeDecodeError as e:
+            yield start, None, f"UTF-8 として読めません: {e.reason}"
+        except json.JSONDecodeError as e:
+            yield start + len(line.decode("utf-8", "replace")[:e.pos].encode("utf-8")), None, e.msg
 
-# JSON → DBインポート
-def import_json(json_file):
-    print(f"JSON 読み込み中：{json_file}")
-    with app.app_context():
-    
-        db.create_all()
-
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        for item in data:
-            q = Question(
-                question = item["question"],
-                choice1 = item["choices"][0],
-                choice2 = item["choices"][1],
-                choice3 = item["choices"][2],
-                choice4 = item["choices"][3],
-                correct = item["correct"],
-                category = item.get("category", "none"),
-                hint = item.get("hint"),
-                url = item.get("url")
-            )
-            db.session.add(q)
 
+def iter_records(f):
+    """先頭の文字で JSON 配列か JSON Lines かを判定して読み込む。f はバイナリのストリーム。
+
+    先頭の BOM と空白は読み飛ばし、その分のバイト数をエラーの位置に含める。
+    """
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f) # アップロードされたファイルなど
+    skipped = 0
+    if f.peek(len(codecs.BOM_UTF8))[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+        skipped += len(f.read(len(codecs.BOM_UTF8)))
+    head = f.peek(1)
+    while head[:1].isspace():
+        skipped += len(f.read(1))
+        head = f.peek(1)
+    if head[:1] == b"[":
+        return iter_json_array(f, skipped)
+    return iter_json_lines(f, skipped)
+
+
+def validate_item(item):
+    """1問分の要素を検証し、questions テーブルの行に変換する。不正なら ValueError。"""
+    if not isinstance(item, dict):
+        raise ValueError("問題はオブジェクトである必要があります")
+
+    question = item.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question が空です")
+
+    choices = item.get("choices")
+    if not isinstance(choices, list) or len(choices) != 4 or not all(isinstance(c, str) for c in choices):
+        raise ValueError("choices は4つの文字列である必要があります")
+
+    correct = item.get("correct")
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 1 <= correct <= 4:
+        raise ValueError(f"correct は1〜4の整数である必要があります: {correct!r}")
+
+    category = str(item.get("category"))
+    if category not in CATEGORY_IDS:
+        raise ValueError(f"category {category!r} は CHAPTERS にありません")
+
+    hint = item.get("hint")
+    url = item.get("url")
+    if hint is not None and not isinstance(hint, str):
+        raise ValueError("hint は文字列である必要があります")
+    if url is not None and not isinstance(url, str):
+        raise ValueError("url は文字列である必要があります")
+
+    return {
+        "question": question,
+        "choice1": choices[0],
+        "choice2": choices[1],
+        "choice3": choices[2],
+        "choice4": choices[3],
+        "correct": correct,
+        "category": category,
+        "hint": hint,
+        "url": url,
+        "content_hash": question_content_hash(category, question, choices),
+    }
+
+
+def upsert_questions(rows):
+    """content_hash をキーに問題を挿入・更新する。(挿入数, 更新数) を返す。commit は呼び出し側で行う。"""
+    # 同じバッチ内の重複は後のものを優先する
+    by_hash = {row["content_hash"]: row for row in rows}
+    existing = set(db.session.execute(
+        select(Question.content_hash).where(Question.content_hash.in_(list(by_hash)))
+    ).scalars())
+
+    table = Question.__table__
+    stmt = upsert_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.content_hash],
+        set_={
+            "correct": stmt.excluded.correct,
+            "hint": stmt.excluded.hint,
+            "url": stmt.excluded.url,
+        },
+    )
+    db.session.execute(stmt, list(by_hash.values()))
+    return len(by_hash) - len(existing), len(existing)
+
+
+def import_json(json_file, batch_size=1000, check_only=False, echo=print):
+    """ファイルを読み込んで問題をインポートする。check_only なら検証だけを行う。"""
+    echo(f"JSON 読み込み中：{json_file}")
+    report = ImportReport()
+    batch = []
+
+    def flush():
+        inserted, updated = upsert_questions(batch)
+        question_bank.mark_changed()
         db.session.commit()
+        question_bank.invalidate()
+        report.inserted += inserted
+        report.updated += updated
+        batch.clear()
+        echo(f"  {report.total} 件を処理しました")
+
+    with open(json_file, "rb") as f:
+        for offset, item, error in iter_records(f):
+            if error is None:
+                try:
+                    row = validate_item(item)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                report.add_error(offset, error)
+                echo(f"  {offset} バイト目: {error}")
+                continue
+
+            report.total += 1
+            if check_only:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+
+    if batch:
+        flush()
+    return report
 
-        print("インポート完了")
 
 # メイン処理
 if __name__ == "__main__":
-    import_json("questions.json")
\ No newline at end of file
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    parser = argparse.ArgumentParser(description="問題を JSON 配列または JSON Lines からインポートします")
+    parser.add_argument("json_file", nargs="?", default="questions.json")
+    parser.add_argument("--batch-size", type=int, default=1000, help="1トランザクションで書き込む件数")
+    parser.add_argument("--check", action="store_true", help="書き込まずに検証だけを行う")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.check:
+            migrations.upgrade(echo=print)
+        result = import_json(args.json_file, args.batch_size, args.check)
+
+    if args.check:
+        print(f"検証完了：正常 {result.total} 件、エラー {result.error_count} 件")
+    else:
+        print(f"インポート完了：追加 {result.inserted} 件、更新 {result.updated} 件、エラー {result.error_count} 件")
+    if result.error_count:
+        raise SystemExit(1)
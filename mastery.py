@@ -0,0 +1,183 @@
+"""ユーザーごと・問題ごとの習熟状況（user_question_stats）の管理。
+
+解答を保存するのと同じトランザクションで1問1行の集計を更新するので、
+「2回以上連続で正解した問題を除く」はユーザー単位のインデックス検索だけで済む。
+間隔反復の箱と次の出題時刻（spaced_repetition.py）も同じ upsert で更新する。
+
+既存の解答履歴からの作り直し: python mastery.py backfill
+"""
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, insert, inspect, select
+
+import spaced_repetition
+from database import db, upsert_insert
+from model import QuizResult, ResultSummary, UserQuestionStat
+
+# この回数以上連続で正解した問題を「習得済み」とみなす
+MASTERY_STREAK = 2
+
+
+def record_outcomes(user_id, outcomes, answered_at=None):
+    """(question_id, is_correct) のリストを集計に反映する。commit は呼び出し側で行う。"""
+    if not outcomes:
+        return
+    answered_at = answered_at or datetime.utcnow()
+    stats = UserQuestionStat.__table__
+
+    stmt = upsert_insert(stats)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[stats.c.user_id, stats.c.question_id],
+        set_={
+            "attempts": stats.c.attempts + 1,
+            "corrects": stats.c.corrects + excluded.corrects,
+            "streak": case((excluded.last_correct, stats.c.streak + 1), else_=0),
+            "prev_correct": stats.c.last_correct,
+            "last_correct": excluded.last_correct,
+            "last_seen": excluded.last_seen,
+            **spaced_repetition.upsert_values(stats, excluded, answered_at),
+        },
+    )
+    db.session.execute(stmt, [
+        {
+            "user_id": user_id,
+            "question_id": question_id,
+            "attempts": 1,
+            "corrects": 1 if is_correct else 0,
+            "streak": 1 if is_correct else 0,
+            "last_correct": is_correct,
+            "prev_correct": None,
+            "last_seen": answered_at,
+            "box": spaced_repetition.next_box(0, is_correct),
+            "due_at": spaced_repetition.due_time(spaced_repetition.next_box(0, is_correct), answered_at),
+        }
+        for question_id, is_correct in outcomes
+    ])
+
+
+def mastered_question_ids(user_id):
+    """直近の解答が MASTERY_STREAK 回以上連続で正解している問題のID。"""
+    return set(db.session.execute(
+        select(UserQuestionStat.question_id).where(
+            UserQuestionStat.user_id == user_id,
+            UserQuestionStat.streak >= MASTERY_STREAK,
+        )
+    ).scalars())
+
+
+STAT_COLUMNS = (
+    "user_id", "question_id", "attempts", "corrects", "streak", "last_correct", "prev_correct", "last_seen",
+    "box", "due_at",
+)
+
+
+def new_state(user_id, question_id, timestamp):
+    """まだ解答のない問題の集計（apply_outcome で解答を1件ずつ加える）。"""
+    return {
+        "user_id": user_id,
+        "question_id": question_id,
+        "attempts": 0,
+        "corrects": 0,
+        "streak": 0,
+        "last_correct": False,
+        "prev_correct": None,
+        "last_seen": timestamp,
+        "box": 0,
+        "due_at": None,
+    }
+
+
+def apply_outcome(state, is_correct, timestamp):
+    """集計に解答を1件加える（record_outcomes の upsert と同じ計算）。解答は古い順に加える。"""
+    if state["attempts"]:
+        state["prev_correct"] = state["last_correct"]
+    state["attempts"] += 1
+    state["corrects"] += 1 if is_correct else 0
+    state["streak"] = state["streak"] + 1 if is_correct else 0
+    state["last_correct"] = bool(is_correct)
+    state["last_seen"] = timestamp
+    state["box"] = spaced_repetition.next_box(state["box"], is_correct)
+    state["due_at"] = spaced_repetition.due_time(state["box"], timestamp)
+    return state
+
+
+def backfill(conn, batch_size=5000, echo=None):
+    """user_question_stats を作り直す。
+
+    アーカイブに移した解答の集計（result_summaries）から始めて、quiz_results に残っている解答を古い順に加える。
+    """
+    stats = UserQuestionStat.__table__
+    conn.execute(delete(stats))
+    # result_summaries を作る前のマイグレーション（3）からも呼ばれる
+    has_summaries = inspect(conn).has_table(ResultSummary.__tablename__)
+    if has_summaries:
+        summaries = ResultSummary.__table__
+        conn.execute(insert(stats).from_select(STAT_COLUMNS, select(*[summaries.c[c] for c in STAT_COLUMNS])))
+
+    # アーカイブの集計がある組は、その続きから数えて行を置き換える
+    stmt = upsert_insert(stats, bind=conn)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[stats.c.user_id, stats.c.question_id],
+        set_={c: stmt.excluded[c] for c in STAT_COLUMNS[2:]},
+    )
+
+    history = conn.execution_options(yield_per=batch_size).execute(
+        select(QuizResult.user_id, QuizResult.question_id, QuizResult.is_correct, QuizResult.timestamp)
+        .order_by(QuizResult.user_id, QuizResult.question_id, QuizResult.timestamp, QuizResult.id)
+    )
+
+    batch = []
+    written = 0
+    current = None
+    archived = {}
+    archived_user = None
+    for user_id, question_id, is_correct, timestamp in history:
+        if current is None or (current["user_id"], current["question_id"]) != (user_id, question_id):
+            if current is not None:
+                batch.append(current)
+            if has_summaries and user_id != archived_user:
+                archived = _summaries_of(conn, user_id)
+                archived_user = user_id
+            current = archived.get(question_id) or new_state(user_id, question_id, timestamp)
+        apply_outcome(current, is_correct, timestamp)
+
+        if len(batch) >= batch_size:
+            conn.execute(stmt, batch)
+            written += len(batch)
+            batch = []
+            if echo:
+                echo(f"  {written} 件を集計しました")
+
+    if current is not None:
+        batch.append(current)
+    if batch:
+        conn.execute(stmt, batch)
+        written += len(batch)
+    return conn.execute(select(func.count()).select_from(stats)).scalar()
+
+
+def _summaries_of(conn, user_id):
+    # 解答履歴はユーザーごとにまとめて読むので、アーカイブの集計もユーザー単位で引く
+    summaries = ResultSummary.__table__
+    rows = conn.execute(
+        select(*[summaries.c[c] for c in STAT_COLUMNS]).where(summaries.c.user_id == user_id)
+    ).mappings()
+    return {row["question_id"]: dict(row) for row in rows}
+
+
+if __name__ == "__main__":
+    import sys
+
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    if sys.argv[1:] != ["backfill"]:
+        print("使い方: python mastery.py backfill")
+        sys.exit(1)
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            count = backfill(conn, echo=print)
+        print(f"user_question_stats を {count} 件作成しました")
@@ -0,0 +1,241 @@
+"""リクエストと SQL の計測。
+
+各リクエストのルート（url_rule）ごとに件数・ステータス・処理時間のヒストグラムを、
+SQLAlchemy の before/after_cursor_execute でルートごとの SQL の件数と時間を数える。
+これらは常に記録する（perf_counter とロック1回程度の負荷）。
+
+METRICS_SAMPLE_RATE の割合のリクエストだけは詳しく記録し、正規化した SQL 文
+（リテラルを ? に置き換えたもの）ごとの件数と時間も数える。
+METRICS_SLOW_QUERY_MS を超えた SQL はサンプリングに関係なく正規化した文をログに出す。
+
+/admin/metrics で Prometheus のテキスト形式として出力する。
+"""
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# リクエストの外（バックグラウンドのスレッドなど）で実行された SQL のルート名
+NO_ROUTE = "-"
+OTHER_STATEMENT = "<other>"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_NAMED_PARAM = re.compile(r"%\(\w+\)s|:\w+\b|\$\d+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(\(\?[^()]*\))(?:\s*,\s*\(\?[^()]*\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    """SQL 文のリテラルとパラメータを ? にまとめ、同じ形の文が同じ文字列になるようにする。"""
+    s = _STRING.sub("?", statement)
+    s = _NAMED_PARAM.sub("?", s)
+    s = _NUMBER.sub("?", s)
+    s = _IN_LIST.sub("(?, ...)", s)
+    s = _VALUES_LIST.sub(r"\1, ...", s)
+    return _SPACES.sub(" ", s).strip()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.sample_rate = 0.1
+        self.slow_query_seconds = 0.2
+        self.max_statements = 200
+        self._lock = threading.Lock()
+        self._normalized = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}         # (ルート, メソッド, ステータス) → 件数
+            self.durations = {}        # (ルート, メソッド) → [バケットごとの件数..., 合計秒]
+            self.sql = {}              # ルート → [件数, 合計秒]
+            self.statements = {}       # 正規化した文 → [件数, 合計秒]（サンプリングしたリクエストのみ）
+            self.slow_queries = 0
+            self.sampled_requests = 0
+
+    def init_app(self, app):
+        """リクエストのフックと SQL のフックを登録する。db.init_app の後、他のフックより先に呼ぶ。"""
+        self.sample_rate = app.config.get("METRICS_SAMPLE_RATE", self.sample_rate)
+        self.slow_query_seconds = app.config.get("METRICS_SLOW_QUERY_MS", self.slow_query_seconds * 1000) / 1000
+        self.max_statements = app.config.get("METRICS_MAX_STATEMENTS", self.max_statements)
+
+        @app.before_request
+        def start_timer():
+            g._metrics_started = time.perf_counter()
+            g._metrics_sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+
+        @app.after_request
+        def remember_status(response):
+            g._metrics_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def record_request(exc):
+            started = g.pop("_metrics_started", None)
+            if started is None:
+                return
+            status = 500 if exc is not None else g.pop("_metrics_status", 200)
+            self._record_request(_route(), request.method, status, time.perf_counter() - started,
+                                 g.pop("_metrics_sampled", False))
+
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _record_request(self, route, method, status, seconds, sampled):
+        index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+        with self._lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.get((route, method))
+            if histogram is None:
+                histogram = self.durations[(route, method)] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+            if sampled:
+                self.sampled_requests += 1
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # 開始時刻は文ごとの実行コンテキストに置く（失敗した文の分が接続に残らない）
+        context._metrics_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_query_start", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+
+        in_request = has_request_context()
+        route = _route() if in_request else NO_ROUTE
+        sampled = in_request and g.get("_metrics_sampled", False)
+        slow = seconds >= self.slow_query_seconds
+        normalized = self._normalize(statement) if sampled or slow else None
+
+        with self._lock:
+            totals = self.sql.get(route)
+            if totals is None:
+                totals = self.sql[route] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+            if sampled:
+                key = normalized
+                if key not in self.statements and len(self.statements) >= self.max_statements:
+                    key = OTHER_STATEMENT
+                entry = self.statements.setdefault(key, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+            if slow:
+                self.slow_queries += 1
+
+        if slow:
+            logger.warning("遅いSQL %.1fms (%s): %s", seconds * 1000, route, normalized)
+
+    def _normalize(self, statement):
+        # 同じ文が何度も来るので結果を覚えておく
+        normalized = self._normalized.get(statement)
+        if normalized is None:
+            normalized = normalize_statement(statement)
+            if len(self._normalized) >= self.max_statements * 4:
+                self._normalized.clear()
+            self._normalized[statement] = normalized
+        return normalized
+
+    def render(self):
+        """Prometheus のテキスト形式で出力する。"""
+        with self._lock:
+            requests = dict(self.requests)
+            durations = {k: list(v) for k, v in self.durations.items()}
+            sql = {k: list(v) for k, v in self.sql.items()}
+            statements = {k: list(v) for k, v in self.statements.items()}
+            slow_queries = self.slow_queries
+            sampled_requests = self.sampled_requests
+
+        lines = [
+            "# HELP myquest_http_requests_total リクエスト数",
+            "# TYPE myquest_http_requests_total counter",
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f"myquest_http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+        lines += [
+            "# HELP myquest_http_request_duration_seconds リクエストの処理時間",
+            "# TYPE myquest_http_request_duration_seconds histogram",
+        ]
+        for (route, method), histogram in sorted(durations.items()):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ("+Inf",), histogram):
+                cumulative += count
+                lines.append(
+                    f"myquest_http_request_duration_seconds_bucket{_labels(route=route, method=method, le=bound)} {cumulative}"
+                )
+            lines.append(f"myquest_http_request_duration_seconds_sum{_labels(route=route, method=method)} {histogram[-1]:.6f}")
+            lines.append(f"myquest_http_request_duration_seconds_count{_labels(route=route, method=method)} {cumulative}")
+
+        lines += [
+            "# HELP myquest_sql_statements_total ルートごとの SQL の実行回数",
+            "# TYPE myquest_sql_statements_total counter",
+        ]
+        for route, (count, _) in sorted(sql.items()):
+            lines.append(f"myquest_sql_statements_total{_labels(route=route)} {count}")
+        lines += [
+            "# HELP myquest_sql_seconds_total ルートごとの SQL の実行時間",
+            "# TYPE myquest_sql_seconds_total counter",
+        ]
+        for route, (_, seconds) in sorted(sql.items()):
+            lines.append(f"myquest_sql_seconds_total{_labels(route=route)} {seconds:.6f}")
+
+        lines += [
+            "# HELP myquest_sql_statement_calls_total 正規化した SQL 文ごとの実行回数（サンプリングしたリクエストのみ）",
+            "# TYPE myquest_sql_statement_calls_total counter",
+        ]
+        for statement, (count, _) in sorted(statements.items()):
+            lines.append(f"myquest_sql_statement_calls_total{_labels(statement=statement)} {count}")
+        lines += [
+            "# HELP myquest_sql_statement_seconds_total 正規化した SQL 文ごとの実行時間（サンプリングしたリクエストのみ）",
+            "# TYPE myquest_sql_statement_seconds_total counter",
+        ]
+        for statement, (_, seconds) in sorted(statements.items()):
+            lines.append(f"myquest_sql_statement_seconds_total{_labels(statement=statement)} {seconds:.6f}")
+
+        lines += [
+            "# HELP myquest_sql_slow_queries_total METRICS_SLOW_QUERY_MS を超えた SQL の数",
+            "# TYPE myquest_sql_slow_queries_total counter",
+            f"myquest_sql_slow_queries_total {slow_queries}",
+            "# HELP myquest_sampled_requests_total 詳しく記録したリクエスト数",
+            "# TYPE myquest_sampled_requests_total counter",
+            f"myquest_sampled_requests_total {sampled_requests}",
+            "# HELP myquest_metrics_sample_rate 詳しく記録するリクエストの割合",
+            "# TYPE myquest_metrics_sample_rate gauge",
+            f"myquest_metrics_sample_rate {self.sample_rate}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+metrics = Metrics()
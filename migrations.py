@@ -0,0 +1,198 @@
+"""スキーマのバージョン管理。
+
+db.create_all() は既存のテーブルに列やインデックスを追加しないため、
+変更を番号付きのマイグレーションとして登録し、既存の instance/quiz.db を
+その場でアップグレードする。適用済みのバージョンは counters テーブルの
+schema_version に記録する。
+
+使い方: python migrations.py
+"""
+import threading
+
+from sqlalchemy import inspect, select, text
+
+from database import db
+import mastery
+import question_search
+import rollups
+import spaced_repetition
+from model import (
+    ChapterDailyStat, ChapterStat, Counter, Question, QuestionDailyStat, QuestionStat, QuizResult, ResultSummary,
+    User, UserQuestionStat, question_content_hash,
+)
+
+SCHEMA_COUNTER = "schema_version"
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """マイグレーション関数を登録するデコレータ。関数は Connection を受け取る。"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def add_column_if_missing(conn, table, column, ddl):
+    """列がなければ ALTER TABLE で追加する（新規DBでは create_all 済みのため）。"""
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+@migration(1, "基本テーブルを作成")
+def _create_base_tables(conn):
+    db.metadata.create_all(
+        conn,
+        tables=[User.__table__, Question.__table__, QuizResult.__table__, Counter.__table__],
+    )
+
+
+@migration(2, "quiz_results に (user_id, question_id, timestamp, is_correct) の複合インデックスを追加")
+def _index_quiz_results(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_quiz_results_user_question_time "
+        "ON quiz_results (user_id, question_id, timestamp, is_correct)"
+    ))
+
+
+@migration(3, "user_question_stats を作成し、既存の解答履歴から集計")
+def _create_user_question_stats(conn):
+    UserQuestionStat.__table__.create(conn, checkfirst=True)
+    mastery.backfill(conn)
+
+
+@migration(4, "questions に content_hash 列と一意インデックスを追加")
+def _add_question_content_hash(conn):
+    add_column_if_missing(conn, "questions", "content_hash", "VARCHAR(64)")
+    rows = conn.execute(select(
+        Question.id, Question.category, Question.question,
+        Question.choice1, Question.choice2, Question.choice3, Question.choice4,
+    ).order_by(Question.id)).all()
+
+    # 過去のインポートで重複した行は、最も古い行だけにハッシュを付ける
+    seen = set()
+    updates = []
+    for q_id, category, question, *choices in rows:
+        content_hash = question_content_hash(category, question, choices)
+        if content_hash not in seen:
+            seen.add(content_hash)
+            updates.append({"q_id": q_id, "content_hash": content_hash})
+    if updates:
+        conn.execute(text("UPDATE questions SET content_hash = :content_hash WHERE id = :q_id"), updates)
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_questions_content_hash ON questions (content_hash)"
+    ))
+
+
+@migration(5, "users に role 列を追加し、admin@example.com を管理者にする")
+def _add_user_role(conn):
+    add_column_if_missing(conn, "users", "role", "VARCHAR(20) NOT NULL DEFAULT 'student'")
+    conn.execute(text("UPDATE users SET role = 'admin' WHERE email = 'admin@example.com'"))
+
+
+@migration(6, "問題ごと・章ごとの集計テーブルを作成し、既存の解答履歴から集計")
+def _create_rollups(conn):
+    db.metadata.create_all(conn, tables=[
+        QuestionStat.__table__, ChapterStat.__table__, QuestionDailyStat.__table__, ChapterDailyStat.__table__,
+    ])
+    rollups.rebuild(conn)
+
+
+@migration(7, "問題の全文検索の索引（FTS5 trigram）とトリガーを作成")
+def _create_question_search_index(conn):
+    # FTS5 が使えないデータベースでは作らない（検索は LIKE になる）
+    question_search.create_index(conn)
+
+
+@migration(8, "user_question_stats に間隔反復の box / due_at 列とインデックスを追加し、連続正解数から計算")
+def _add_spaced_repetition(conn):
+    add_column_if_missing(conn, "user_question_stats", "box", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "user_question_stats", "due_at", "TIMESTAMP")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_question_stats_user_due ON user_question_stats (user_id, due_at)"
+    ))
+    # マイグレーション 3 の集計を使い、解答履歴は読み直さない
+    spaced_repetition.recompute(conn)
+
+
+@migration(9, "quiz_results に解答履歴のページ送り用の (user_id, timestamp, id) インデックスを追加")
+def _add_history_index(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_quiz_results_user_time ON quiz_results (user_id, timestamp, id)"
+    ))
+
+
+@migration(10, "アーカイブした解答の集計テーブル result_summaries を作成")
+def _create_result_summaries(conn):
+    ResultSummary.__table__.create(conn, checkfirst=True)
+
+
+@migration(11, "users に削除を引き受けた時刻の列 deletion_claimed_at を追加")
+def _add_deletion_claim(conn):
+    add_column_if_missing(conn, "users", "deletion_claimed_at", "TIMESTAMP")
+
+
+def current_version(conn):
+    Counter.__table__.create(conn, checkfirst=True)
+    version = conn.execute(select(Counter.value).where(Counter.name == SCHEMA_COUNTER)).scalar()
+    return version or 0
+
+
+def _set_version(conn, version):
+    updated = conn.execute(
+        Counter.__table__.update().where(Counter.name == SCHEMA_COUNTER).values(value=version)
+    )
+    if updated.rowcount == 0:
+        conn.execute(Counter.__table__.insert().values(name=SCHEMA_COUNTER, value=version))
+
+
+def upgrade(engine=None, echo=None):
+    """未適用のマイグレーションを順番に適用する。1つのマイグレーションが1トランザクション。"""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for target, description, func in MIGRATIONS:
+        if target <= version:
+            continue
+        if echo:
+            echo(f"マイグレーション {target}: {description}")
+        with engine.begin() as conn:
+            func(conn)
+            _set_version(conn, target)
+        version = target
+    return version
+
+
+_upgraded = False
+_upgrade_lock = threading.Lock()
+
+
+def ensure_upgraded(echo=None):
+    """このプロセスでまだなら upgrade する（serve.py が fork の前に呼べば、ワーカーでは何もしない）。"""
+    global _upgraded
+    if _upgraded:
+        return
+    with _upgrade_lock:
+        if not _upgraded:
+            upgrade(echo=echo)
+            _upgraded = True
+
+
+def init_app(app):
+    """最初のリクエストの前にスキーマを最新にする。"""
+    @app.before_request
+    def ensure_schema():
+        ensure_upgraded(echo=app.logger.info)
+
+
+if __name__ == "__main__":
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    with app.app_context():
+        print(f"スキーマバージョン: {upgrade(echo=print)}")
@@ -1,6 +1,14 @@
 from database import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import hashlib
+import json
+
+
+def question_content_hash(category, question, choices):
+    """問題の同一性を判定するハッシュ（インポートの upsert のキー）。"""
+    key = json.dumps([str(category), question, list(choices)], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 class User(db.Model):
     __tablename__ = "users"
@@ -9,6 +17,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     nickname = db.Column(db.String(50), nullable=True)
     password_hash = db.Column(db.String(200), nullable=False)
+    role = db.Column(db.String(20), nullable=False, default="student", server_default="student") # "admin" / "student"
+    deletion_claimed_at = db.Column(db.DateTime, nullable=True) # 削除を引き受けたワーカーが最後に進めた時刻（user_deletion.py）
     results = db.relationship('QuizResult', backref='user', lazy=True) # Add relationship
 
     def set_password(self, password):
@@ -19,6 +29,9 @@ class User(db.Model):
 
 class Question(db.Model):
     __tablename__ = "questions"
+    __table_args__ = (
+        db.Index("ix_questions_content_hash", "content_hash", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String(300), nullable=False)
@@ -30,13 +43,108 @@ class Question(db.Model):
     category = db.Column(db.String(50)) # section / practiceなど
     hint = db.Column(db.String(500))
     url = db.Column(db.String(500))
+    content_hash = db.Column(db.String(64), nullable=True) # question_content_hash の値
     results = db.relationship('QuizResult', backref='question', lazy=True) # Add relationship
 
+    def refresh_content_hash(self):
+        self.content_hash = question_content_hash(
+            self.category, self.question, [self.choice1, self.choice2, self.choice3, self.choice4]
+        )
+
 class QuizResult(db.Model):
     __tablename__ = "quiz_results"
+    __table_args__ = (
+        # practice の exclude_answered と delete_user のユーザー単位の検索用（カバリングインデックス）
+        db.Index("ix_quiz_results_user_question_time", "user_id", "question_id", "timestamp", "is_correct"),
+        # 解答履歴のページ送り（history.py）で (timestamp, id) の順に読むためのインデックス
+        db.Index("ix_quiz_results_user_time", "user_id", "timestamp", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
     is_correct = db.Column(db.Boolean, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class Counter(db.Model):
+    __tablename__ = "counters"
+
+    # 問題バンクのバージョンなど、名前付きの単調増加カウンタ
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserQuestionStat(db.Model):
+    __tablename__ = "user_question_stats"
+    __table_args__ = (
+        # 「2回以上連続で正解した問題」をユーザー単位で引くためのインデックス
+        db.Index("ix_user_question_stats_user_streak", "user_id", "streak"),
+        # 間隔反復で期限の来た問題を due_at の順に引くためのインデックス
+        db.Index("ix_user_question_stats_user_due", "user_id", "due_at"),
+    )
+
+    # quiz_results から集計した、ユーザーごと・問題ごとの解答状況
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+    streak = db.Column(db.Integer, nullable=False, default=0) # 直近から数えた連続正解数
+    last_correct = db.Column(db.Boolean, nullable=False)
+    prev_correct = db.Column(db.Boolean, nullable=True) # 1回しか解答していなければ None
+    last_seen = db.Column(db.DateTime, nullable=False)
+    box = db.Column(db.Integer, nullable=False, default=0) # Leitner の箱（spaced_repetition.py）
+    due_at = db.Column(db.DateTime, nullable=True) # 次に出題する時刻
+
+
+class ResultSummary(db.Model):
+    __tablename__ = "result_summaries"
+
+    # 保存期間を過ぎてアーカイブに移した解答（retention.py）を、ユーザーごと・問題ごとに
+    # user_question_stats と同じ形でまとめたもの。mastery.backfill はここから続けて集計する
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+    streak = db.Column(db.Integer, nullable=False, default=0)
+    last_correct = db.Column(db.Boolean, nullable=False)
+    prev_correct = db.Column(db.Boolean, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=False)
+    box = db.Column(db.Integer, nullable=False, default=0)
+    due_at = db.Column(db.DateTime, nullable=True)
+
+
+# 管理画面の正答率などのための集計（rollups.py が解答の保存と同時に更新する）
+class QuestionStat(db.Model):
+    __tablename__ = "question_stats"
+
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+    users = db.Column(db.Integer, nullable=False, default=0) # 解答したユーザーの数
+
+
+class ChapterStat(db.Model):
+    __tablename__ = "chapter_stats"
+
+    category = db.Column(db.String(50), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+
+class QuestionDailyStat(db.Model):
+    __tablename__ = "question_daily_stats"
+
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True) # UTC の日付
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChapterDailyStat(db.Model):
+    __tablename__ = "chapter_daily_stats"
+
+    category = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,165 @@
+"""パスワードのハッシュ計算を別プロセスで行うプール。
+
+check_password_hash / generate_password_hash はわざと重く作られているため、
+リクエストのスレッドで直接実行すると、一斉ログインのときに他のページまで止まる。
+ここでは上限付きのプロセスプールで計算し、待ちが PASSWORD_POOL_MAX_PENDING 件を
+超えたときはすぐに PoolBusy を送出する（呼び出し側は「もう一度お試しください」を返す）。
+
+PASSWORD_POOL_WORKERS = 0 のときはプールを使わずその場で計算する（スクリプト用）。
+ワーカーで実行するのは werkzeug のハッシュ関数だけ。
+
+スレッドの動いているプロセスから fork すると、他のスレッドが持っていたロック（logging や
+import など）を子プロセスが持ったまま固まることがある。そのためワーカーは、リクエストの
+スレッドが動き出す前に start() で fork して作っておく（serve.py の各ワーカー、wsgi.py）。
+start() を呼ばずに使われたとき（開発用のサーバーやスクリプト）は、最初の利用時に
+forkserver（使えなければ spawn）で作る。この場合、ワーカーは __main__ を読み直すので、
+プールを使うスクリプトは if __name__ == "__main__": で実行部分を囲んでおく。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class PoolBusy(Exception):
+    """ハッシュ計算の待ちが上限を超えた。"""
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def _generate(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+class PasswordPool:
+    def __init__(self):
+        self.workers = 0
+        self.max_pending = 32
+        self.timeout = 10.0
+        self.method = DEFAULT_METHOD
+        self.salt_length = 16
+        self._executor = None
+        self._pid = None
+        self._full_method = (None, None)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get("PASSWORD_POOL_WORKERS", self.workers)
+        self.max_pending = app.config.get("PASSWORD_POOL_MAX_PENDING", self.max_pending)
+        self.timeout = app.config.get("PASSWORD_POOL_TIMEOUT", self.timeout)
+        self.method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+        self.salt_length = app.config.get("PASSWORD_SALT_LENGTH", self.salt_length)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def check(self, pwhash, password):
+        """パスワードがハッシュと一致するか。"""
+        return self._run(_check, pwhash, password)
+
+    def generate(self, password):
+        """設定されたハッシュ方式でパスワードのハッシュを作る。"""
+        return self._run(_generate, password, self.method, self.salt_length)
+
+    def generate_many(self, passwords):
+        """複数のパスワードのハッシュを並列に作る（名簿の一括登録用）。
+
+        一度にワーカー数ずつしか投入しないので、その間に来たログインの照合は
+        名簿全体の後ろに並ばずに済む。投入した分は待ちの枠も使う（空くまで待つ）ため、
+        ログインに残る枠は PASSWORD_POOL_MAX_PENDING からワーカー数を引いた数になる。
+        """
+        if not self.workers:
+            return [_generate(pw, self.method, self.salt_length) for pw in passwords]
+
+        hashes = []
+        for start in range(0, len(passwords), self.workers):
+            futures = [
+                self._submit(_generate, pw, self.method, self.salt_length, blocking=True)
+                for pw in passwords[start:start + self.workers]
+            ]
+            hashes.extend(future.result() for future in futures)
+        return hashes
+
+    def needs_rehash(self, pwhash):
+        """保存されているハッシュが現在の方式と異なるか（ログイン時に作り直す）。"""
+        return pwhash.split("$", 1)[0] != self._method_in_hash()
+
+    def _method_in_hash(self):
+        # 設定の "scrypt" や "pbkdf2:sha256" は、ハッシュには既定のパラメーターを補った形
+        # （"scrypt:32768:8:1" など）で書かれるので、werkzeug に一度作らせてその形にそろえる
+        method, full = self._full_method
+        if method != self.method:
+            method = self.method
+            full = generate_password_hash("", method=method, salt_length=1).split("$", 1)[0]
+            self._full_method = (method, full)
+        return full
+
+    def start(self):
+        """ワーカーのプロセスを fork で今すぐ作る。リクエストのスレッドが動き出す前に呼ぶ。"""
+        if not self.workers:
+            return
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("fork"))
+            self._pid = os.getpid()
+        # fork の場合、最初の submit で全ワーカーがそろって作られる
+        self._executor.submit(os.getpid).result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        future = self._submit(func, *args, blocking=False)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PoolBusy()
+
+    def _submit(self, func, *args, blocking):
+        # 枠は計算が終わった（または取り消された）ときに返す。タイムアウトで諦めても
+        # 実行中のハッシュはワーカーを使い続けるので、その間は枠を空けない
+        slots = self._slots
+        if not slots.acquire(blocking=blocking):
+            raise PoolBusy()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _get_executor(self):
+        # start() を呼んでいないプロセスでは、最初の利用時にプールを作る（fork したプロセスでも作り直す）
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                    self._pid = os.getpid()
+        return self._executor
+
+
+def _mp_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+password_pool = PasswordPool()
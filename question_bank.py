@@ -0,0 +1,157 @@
+"""問題バンクのプロセス内キャッシュ。
+
+questions テーブルはほとんど変更されないため、起動後に一度だけ読み込んだ
+読み取り専用のスナップショットを各リクエストで共有する。
+スナップショットは counters テーブルのバージョン番号と比較され、
+update_question やインポートで変更がコミットされたときだけ再構築される。
+"""
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from sqlalchemy import select, update
+
+from database import db
+from model import Counter, Question
+from sampling import sample_ids
+
+# テンプレートからは ORM オブジェクトと同じ属性名でアクセスできる
+CachedQuestion = namedtuple(
+    "CachedQuestion",
+    ["id", "question", "choice1", "choice2", "choice3", "choice4", "correct", "category", "hint", "url"],
+)
+
+VERSION_COUNTER = "question_bank"
+
+
+def content_version(question):
+    """問題の内容のバージョン（内容が変われば値が変わる）。"""
+    return zlib.crc32(repr(tuple(question)).encode("utf-8"))
+
+
+class Snapshot:
+    """ある時点の questions テーブルの不変なコピー。"""
+
+    __slots__ = (
+        "version", "questions", "by_id", "by_category", "ids", "ids_by_category",
+        "question_versions", "category_versions",
+    )
+
+    def __init__(self, version, questions):
+        self.version = version
+        self.questions = tuple(questions)
+        self.by_id = {q.id: q for q in self.questions}
+        by_category = {}
+        for q in self.questions:
+            by_category.setdefault(q.category, []).append(q)
+        self.by_category = {category: tuple(qs) for category, qs in by_category.items()}
+        # 抽選用のIDの配列
+        self.ids = tuple(q.id for q in self.questions)
+        self.ids_by_category = {
+            category: tuple(q.id for q in qs) for category, qs in self.by_category.items()
+        }
+        # ETag 用のバージョン。内容が変われば（update_question やインポートで）値が変わる
+        self.question_versions = {q.id: content_version(q) for q in self.questions}
+        self.category_versions = {
+            category: zlib.crc32(repr([(q.id, self.question_versions[q.id]) for q in qs]).encode("utf-8"))
+            for category, qs in self.by_category.items()
+        }
+
+
+class QuestionBank:
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.check_interval = app.config.get("QUESTION_BANK_CHECK_INTERVAL", self.check_interval)
+
+    def snapshot(self):
+        # check_interval 秒に一度だけDBのバージョンを確認し、変わっていれば読み直す
+        snap = self._snapshot
+        if snap is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snap
+
+        with self._lock:
+            version = self._read_version()
+            snap = self._snapshot
+            if snap is None or snap.version != version:
+                snap = self._load(version)
+                self._snapshot = snap
+            self._checked_at = time.monotonic()
+        return snap
+
+    def get(self, question_id):
+        try:
+            return self.snapshot().by_id.get(int(question_id))
+        except (ValueError, TypeError):
+            return None
+
+    def get_many(self, question_ids):
+        by_id = self.snapshot().by_id
+        found = []
+        for q_id in question_ids:
+            try:
+                question = by_id.get(int(q_id))
+            except (ValueError, TypeError):
+                continue
+            if question:
+                found.append(question)
+        return found
+
+    def by_category(self, category):
+        return self.snapshot().by_category.get(str(category), ())
+
+    def all(self):
+        return self.snapshot().questions
+
+    def sample(self, k, category=None, exclude=None):
+        """k 問をランダムに選ぶ。IDだけを抽選してから選ばれた問題を取り出す。"""
+        snap = self.snapshot()
+        if category is None:
+            ids = snap.ids
+        else:
+            ids = snap.ids_by_category.get(str(category), ())
+        return [snap.by_id[q_id] for q_id in sample_ids(ids, k, exclude)]
+
+    def mark_changed(self):
+        """現在のトランザクションで問題バンクのバージョンを上げる。
+
+        呼び出し側の commit と同時に反映され、各ワーカーは次の確認時に再読み込みする。
+        このプロセスですぐに反映するには commit の後に invalidate を呼ぶ。
+        """
+        result = db.session.execute(
+            update(Counter).where(Counter.name == VERSION_COUNTER).values(value=Counter.value + 1)
+        )
+        if result.rowcount == 0:
+            db.session.add(Counter(name=VERSION_COUNTER, value=1))
+
+    def invalidate(self):
+        """次の snapshot() でバージョンを確認させる。mark_changed を commit した後に呼ぶ。
+
+        commit の前に呼ぶと、その間に他のリクエストが古い内容を読み直して
+        check_interval 秒のあいだ使い続けることがある。
+        """
+        self._checked_at = 0.0
+
+    def _read_version(self):
+        version = db.session.execute(
+            select(Counter.value).where(Counter.name == VERSION_COUNTER)
+        ).scalar()
+        return version or 0
+
+    def _load(self, version):
+        rows = db.session.execute(
+            select(
+                Question.id, Question.question,
+                Question.choice1, Question.choice2, Question.choice3, Question.choice4,
+                Question.correct, Question.category, Question.hint, Question.url,
+            ).order_by(Question.id)
+        ).all()
+        return Snapshot(version, (CachedQuestion(*row) for row in rows))
+
+
+question_bank = QuestionBank()
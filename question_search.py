@@ -0,0 +1,202 @@
+"""問題の全文検索（管理者用の /api/questions/search）。
+
+SQLite の FTS5 の trigram トークナイザで、問題文・4つの選択肢・ヒントに索引を作る。
+trigram は文字の3-gram で索引を作るので、形態素解析なしで日本語の部分一致を検索できる。
+索引は questions を外部コンテンツとする questions_fts で、questions の INSERT / UPDATE /
+DELETE のトリガーで同期する（update_question・インポート・一括編集のどこから変更しても同じ）。
+
+検索語は空白で区切って AND で検索し、bm25 のスコア（問題文の一致を重く見る）の順に返す。
+trigram で引けない2文字以下の語は、索引で絞り込んだ結果に LIKE で条件を加える。
+すべての語が2文字以下のとき、または FTS5 が使えないデータベースでは LIKE だけで検索する。
+どちらの場合も並べ替えと件数の数え方に上限を設け、10万問でも一定の時間で返す
+（RANK_LIMIT を超える一致は ID 順、LIKE の件数は LIKE_COUNT_LIMIT まで）。
+
+索引の作り直し: python question_search.py rebuild
+"""
+from collections import namedtuple
+
+from sqlalchemy import func, or_, select, text
+
+from database import db
+from model import Question
+
+FTS_TABLE = "questions_fts"
+FTS_COLUMNS = ("question", "choice1", "choice2", "choice3", "choice4", "hint")
+# bm25 の列ごとの重み（FTS_COLUMNS の順）
+FTS_WEIGHTS = (10.0, 2.0, 2.0, 2.0, 2.0, 1.0)
+# trigram で索引を引ける最短の語の長さ
+MIN_TERM_CHARS = 3
+MAX_PER_PAGE = 100
+# 一致した問題がこれより多ければ順位をつけない（bm25 での並べ替えを省く）
+RANK_LIMIT = 20000
+# LIKE での検索は件数をここまでしか数えない
+LIKE_COUNT_LIMIT = 1000
+
+_columns = ", ".join(FTS_COLUMNS)
+_new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+_old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+
+CREATE_STATEMENTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_columns}, content='questions', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    # 章・正解・URL だけの変更では索引を更新しない
+    f"CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF {_columns} ON questions BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+)
+
+_BM25 = f"bm25({FTS_TABLE}, {', '.join(str(w) for w in FTS_WEIGHTS)})"
+
+# total は一致した問題の数。exact が False なら total 件以上ある
+SearchPage = namedtuple("SearchPage", ["total", "exact", "results"])
+
+# engine → 索引があるか
+_available = {}
+
+
+def fts_supported(conn):
+    """この接続で FTS5 の trigram トークナイザが使えるか（SQLite 3.34 以降）。"""
+    if conn.dialect.name != "sqlite":
+        return False
+    version = conn.execute(text("SELECT sqlite_version()")).scalar()
+    if tuple(int(n) for n in version.split(".")[:2]) < (3, 34):
+        return False
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def create_index(conn):
+    """索引とトリガーを作り、既存の問題から索引を作る。FTS5 が使えなければ何もしない。"""
+    _available.clear()
+    if not fts_supported(conn):
+        return False
+    for statement in CREATE_STATEMENTS:
+        conn.execute(text(statement))
+    rebuild(conn)
+    return True
+
+
+def rebuild(conn):
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def fts_available():
+    engine = db.engine
+    available = _available.get(engine)
+    if available is None:
+        available = False
+        if engine.dialect.name == "sqlite":
+            available = db.session.execute(
+                text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).scalar() > 0
+        _available[engine] = available
+    return available
+
+
+def split_terms(query):
+    """検索語を空白で区切る（全角の空白も区切りとみなす）。"""
+    return [term for term in query.replace("　", " ").split() if term]
+
+
+def _fts_phrase(term):
+    # FTS5 の文字列として引用し、演算子や記号をそのまま検索する
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _like_any_column(term):
+    pattern = _like_pattern(term)
+    return or_(*[getattr(Question, c).ilike(pattern, escape="\\") for c in FTS_COLUMNS])
+
+
+def search(query, page=1, per_page=20, category=None):
+    """検索結果の1ページ分を SearchPage で返す。"""
+    terms = split_terms(query)
+    if not terms:
+        return SearchPage(0, True, [])
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    offset = (max(page, 1) - 1) * per_page
+    long_terms = [t for t in terms if len(t) >= MIN_TERM_CHARS]
+    if long_terms and fts_available():
+        return _search_fts(long_terms, [t for t in terms if len(t) < MIN_TERM_CHARS], category, per_page, offset)
+    return _search_like(terms, category, per_page, offset)
+
+
+def _search_fts(long_terms, short_terms, category, limit, offset):
+    params = {"match": " AND ".join(_fts_phrase(t) for t in long_terms), "limit": limit, "offset": offset}
+    where = []
+    if category is not None:
+        where.append("AND q.category = :category")
+        params["category"] = str(category)
+    for n, term in enumerate(short_terms):
+        where.append("AND (" + " OR ".join(f"q.{c} LIKE :short{n} ESCAPE '\\'" for c in FTS_COLUMNS) + ")")
+        params[f"short{n}"] = _like_pattern(term)
+    # 章や短い語の条件があるときだけ questions と結合する
+    source = f"{FTS_TABLE} JOIN questions q ON q.id = {FTS_TABLE}.rowid" if where else FTS_TABLE
+    condition = f"{FTS_TABLE} MATCH :match " + " ".join(where)
+
+    total = db.session.execute(text(f"SELECT count(*) FROM {source} WHERE {condition}"), params).scalar()
+    if total == 0 or offset >= total:
+        return SearchPage(total, True, [])
+    # ほとんどの問題に一致する語では順位に意味がなく、並べ替えが重いだけなので ID 順にする
+    order = f"{_BM25}, {FTS_TABLE}.rowid" if total <= RANK_LIMIT else f"{FTS_TABLE}.rowid"
+    ids = list(db.session.execute(
+        text(f"SELECT {FTS_TABLE}.rowid FROM {source} WHERE {condition} ORDER BY {order} LIMIT :limit OFFSET :offset"),
+        params,
+    ).scalars())
+    return SearchPage(total, True, _load(ids))
+
+
+def _search_like(terms, category, limit, offset):
+    conditions = [_like_any_column(t) for t in terms]
+    if category is not None:
+        conditions.append(Question.category == str(category))
+    # 索引を使えない検索なので、件数は LIKE_COUNT_LIMIT までしか数えない
+    matches = select(Question.id).where(*conditions).limit(LIKE_COUNT_LIMIT + 1).subquery()
+    total = db.session.execute(select(func.count()).select_from(matches)).scalar()
+    exact = total <= LIKE_COUNT_LIMIT
+    total = min(total, LIKE_COUNT_LIMIT)
+    if total == 0 or offset >= total:
+        return SearchPage(total, exact, [])
+    ids = list(db.session.execute(
+        select(Question.id).where(*conditions).order_by(Question.id).limit(limit).offset(offset)
+    ).scalars())
+    return SearchPage(total, exact, _load(ids))
+
+
+def _load(ids):
+    """ID の順に問題を読み込む。"""
+    rows = {
+        q_id: {"id": q_id, "question": question, "category": category}
+        for q_id, question, category in db.session.execute(
+            select(Question.id, Question.question, Question.category).where(Question.id.in_(ids))
+        )
+    } if ids else {}
+    return [rows[q_id] for q_id in ids if q_id in rows]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("使い方: python question_search.py rebuild")
+        sys.exit(1)
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if create_index(conn):
+                count = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+                print(f"{FTS_TABLE} を作り直しました（{count} 件）")
+            else:
+                print("このデータベースでは FTS5 の trigram トークナイザを使えません")
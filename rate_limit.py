@@ -0,0 +1,343 @@
+"""リクエストの回数制限（トークンバケット）。
+
+try_login・check_answer・管理者用の API に、IP アドレスごとと
+ユーザーごと（ログインは入力されたメールアドレス、それ以外はログイン中のユーザーID）の
+制限をかける。制限を超えたリクエストには 429 と Retry-After（秒）を返す。
+
+制限は RATE_LIMIT_<グループ> に "ip=60/1m, user=10/5m" の形で書く。「/」の左が
+バケツの大きさ（続けて送れる回数）、右がバケツが空から満杯に戻るまでの時間（s / m / h）。
+空文字列のグループは制限しない。
+
+バケツはキーごとに「満杯に戻る時刻」の数値1つだけで表す（残りのトークン数は
+その時刻と現在時刻の差から分かる）。満杯に戻ったバケツは記録がないのと同じなので、
+期限切れのキーは使われたときか、まとめて掃除するときに消すだけでよい。
+
+バケツの置き場所（RATE_LIMIT_BACKEND）:
+    memory  プロセス内の dict。serve.py の複数のワーカーでは、制限がワーカーごとにかかる
+    sqlite  RATE_LIMIT_SQLITE_PATH（既定は instance/ratelimit.db）。同じマシンの全ワーカーで共有する
+    socket  python rate_limit.py serve で起動したサービスに Unix ソケットで問い合わせる
+置き場所に接続できないときは、制限せずに通してログに警告を出す。
+
+IP アドレスは request.remote_addr を使う。リバースプロキシの後ろで動かすときは
+ProxyFix などで remote_addr をクライアントのアドレスにしておく。
+
+サービスの起動: python rate_limit.py serve [--socket PATH]
+"""
+import json
+import logging
+import math
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import namedtuple
+
+from flask import jsonify, request, session
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# 制限をかけるグループ。設定は RATE_LIMIT_<グループを大文字にしたもの>
+GROUPS = ("login", "check_answer", "admin_api")
+
+# scope は "ip" か "user"。period 秒でバケツが空から満杯（capacity）に戻る
+Limit = namedtuple("Limit", ["scope", "capacity", "period"])
+
+_LIMIT = re.compile(r"^(ip|user)\s*=\s*(\d+)\s*/\s*(\d+(?:\.\d+)?)\s*([smh]?)$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_limits(spec):
+    """"ip=60/1m, user=10/5m" を Limit のリストにする。不正な値は ValueError。"""
+    limits = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = _LIMIT.match(part)
+        if not match or int(match.group(2)) < 1 or float(match.group(3)) <= 0:
+            raise ValueError(f"回数制限の指定が不正です: {part!r}（例: ip=60/1m）")
+        scope, capacity, period, unit = match.groups()
+        limits.append(Limit(scope, int(capacity), float(period) * _UNITS[unit]))
+    return limits
+
+
+def take_all(stored, now, items):
+    """items の (キー, トークン数, 大きさ, 秒) のバケツすべてから取れるときだけ取る。
+
+    stored はキー → 満杯に戻る時刻。(書き込む時刻の dict, 待つ秒数) を返し、
+    1つでも足りなければ何も取らずに、全部取れるようになるまでの秒数を返す。
+    """
+    updates = {}
+    wait = 0.0
+    for key, cost, capacity, period in items:
+        full_at = max(stored.get(key, now), now) + min(cost, capacity) * period / capacity
+        excess = full_at - now - period
+        if excess > 0:
+            wait = max(wait, excess)
+        else:
+            updates[key] = full_at
+    return ({} if wait else updates), wait
+
+
+class MemoryBackend:
+    """プロセス内の dict（キー → 満杯に戻る時刻）。"""
+
+    def __init__(self, min_sweep=1024):
+        self.min_sweep = min_sweep
+        self._buckets = {}
+        self._sweep_at = min_sweep
+        self._lock = threading.Lock()
+
+    def take(self, items):
+        now = time.monotonic()
+        with self._lock:
+            updates, wait = take_all(self._buckets, now, items)
+            self._buckets.update(updates)
+            if len(self._buckets) >= self._sweep_at:
+                self._sweep(now)
+        return wait
+
+    def _sweep(self, now):
+        # 満杯に戻ったバケツを消す。次の掃除は残った数の2倍になったとき
+        self._buckets = {key: full_at for key, full_at in self._buckets.items() if full_at > now}
+        self._sweep_at = max(self.min_sweep, 2 * len(self._buckets))
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """SQLite のファイルに置く。アプリのデータベースとは別のファイルなので、解答の保存と書き込みロックを取り合わない。"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+        "key TEXT PRIMARY KEY, full_at REAL NOT NULL) WITHOUT ROWID"
+    )
+    _SELECT = text("SELECT key, full_at FROM rate_limit_buckets WHERE key IN :keys").bindparams(
+        bindparam("keys", expanding=True)
+    )
+    _UPSERT = text(
+        "INSERT INTO rate_limit_buckets (key, full_at) VALUES (:key, :full_at) "
+        "ON CONFLICT (key) DO UPDATE SET full_at = excluded.full_at"
+    )
+    _SWEEP = text("DELETE FROM rate_limit_buckets WHERE full_at <= :now")
+
+    def __init__(self, path, timeout=1.0, sweep_every=1000):
+        self.path = path
+        self.timeout = timeout
+        self.sweep_every = sweep_every
+        self._engine = None
+        self._pid = None
+        self._calls = 0
+        self._lock = threading.Lock()
+        # 同じプロセスのスレッドは SQLite のロック待ち（スリープしながら再試行する）ではなく、ここで順番を待つ
+        self._take_lock = threading.Lock()
+
+    def _get_engine(self):
+        # fork したワーカーは親の接続を使わずに作り直す
+        if self._engine is None or self._pid != os.getpid():
+            with self._lock:
+                if self._engine is None or self._pid != os.getpid():
+                    if self._engine is not None:
+                        self._engine.dispose(close=False)
+                    self._engine = self._create_engine()
+                    self._pid = os.getpid()
+        return self._engine
+
+    def _create_engine(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        engine = create_engine("sqlite:///" + self.path, connect_args={"timeout": self.timeout})
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            # BEGIN は下の begin で出す（読んでから書くので、最初から書き込みロックを取る）
+            dbapi_connection.isolation_level = None
+            dbapi_connection.execute("PRAGMA journal_mode = WAL")
+            dbapi_connection.execute("PRAGMA synchronous = NORMAL")
+
+        @event.listens_for(engine, "begin")
+        def begin_immediate(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+        with engine.begin() as conn:
+            conn.exec_driver_sql(self.SCHEMA)
+        return engine
+
+    def take(self, items):
+        engine = self._get_engine()
+        with self._take_lock, engine.begin() as conn:
+            now = time.time()
+            self._calls += 1
+            stored = dict(conn.execute(self._SELECT, {"keys": [item[0] for item in items]}).all())
+            updates, wait = take_all(stored, now, items)
+            if updates:
+                conn.execute(self._UPSERT, [{"key": key, "full_at": full_at} for key, full_at in updates.items()])
+            if self._calls % self.sweep_every == 0:
+                conn.execute(self._SWEEP, {"now": now})
+        return wait
+
+
+class SocketBackend:
+    """rate_limit.py serve のサービスに Unix ソケットで問い合わせる（1行の JSON を送り、待つ秒数を受け取る）。"""
+
+    def __init__(self, path, timeout=0.5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, items):
+        sock, reader = self._connection()
+        try:
+            sock.sendall(json.dumps(items).encode("utf-8") + b"\n")
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("回数制限のサービスが接続を閉じました")
+            return float(line)
+        except (OSError, ValueError):
+            # 次の呼び出しでつなぎ直す
+            self._local.conn = None
+            reader.close()
+            sock.close()
+            raise
+
+
+class _ServiceHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                items = [(str(key), int(cost), int(capacity), float(period))
+                         for key, cost, capacity, period in json.loads(line)]
+            except (ValueError, TypeError):
+                return
+            self.wfile.write(f"{self.server.backend.take(items)!r}\n".encode("ascii"))
+
+
+class RateLimitService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """SocketBackend の問い合わせに MemoryBackend で答えるサービス。"""
+
+    daemon_threads = True
+
+    def __init__(self, path, backend=None):
+        if os.path.exists(path):
+            os.unlink(path) # 前回の起動で残ったソケット
+        self.backend = backend or MemoryBackend()
+        super().__init__(path, _ServiceHandler)
+        os.chmod(path, 0o660)
+
+
+def create_backend(name, sqlite_path, socket_path):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend(sqlite_path)
+    if name == "socket":
+        return SocketBackend(socket_path)
+    raise ValueError(f"RATE_LIMIT_BACKEND は memory / sqlite / socket のいずれかです: {name!r}")
+
+
+def default_paths(app):
+    """(SQLite のファイル, Unix ソケット)。設定がなければ instance/ の下。"""
+    return (
+        app.config.get("RATE_LIMIT_SQLITE_PATH") or os.path.join(app.instance_path, "ratelimit.db"),
+        app.config.get("RATE_LIMIT_SOCKET") or os.path.join(app.instance_path, "ratelimit.sock"),
+    )
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.limits = {group: [] for group in GROUPS}
+        self.backend = MemoryBackend()
+        self._warned_at = 0.0
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", self.enabled)
+        self.limits = {group: parse_limits(app.config.get(f"RATE_LIMIT_{group.upper()}", "")) for group in GROUPS}
+        self.backend = create_backend(app.config.get("RATE_LIMIT_BACKEND", "memory"), *default_paths(app))
+
+    def hit(self, group, user=None, cost=1):
+        """リクエストを1回（cost 回分）数える。制限を超えていれば再試行までの秒数、超えていなければ None。
+
+        user を省略するとログイン中のユーザーID。ユーザーが分からなければ IP アドレスの制限だけをかける。
+        """
+        limits = self.limits[group]
+        if not self.enabled or not limits:
+            return None
+        if user is None:
+            user = session.get("user_id")
+        items = []
+        for limit in limits:
+            value = request.remote_addr if limit.scope == "ip" else user
+            if value is not None:
+                items.append((f"{group}:{limit.scope}:{value}", cost, limit.capacity, limit.period))
+        if not items:
+            return None
+        try:
+            wait = self.backend.take(items)
+        except (OSError, ValueError, SQLAlchemyError) as e:
+            self._warn(e)
+            return None
+        return max(1, math.ceil(wait)) if wait > 0 else None
+
+    def limited(self, group, user=None, cost=1):
+        """制限を超えていれば 429 の JSON レスポンス、超えていなければ None。"""
+        retry_after = self.hit(group, user, cost)
+        if retry_after is None:
+            return None
+        response = jsonify({"error": f"リクエストが多すぎます。{retry_after} 秒後にもう一度お試しください"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    def _warn(self, error):
+        # 置き場所が落ちている間、リクエストごとに警告を出さないように1分に1回にする
+        now = time.monotonic()
+        if now - self._warned_at >= 60:
+            self._warned_at = now
+            logger.warning("回数制限の確認に失敗したため制限せずに通します: %s", error)
+
+
+rate_limiter = RateLimiter()
+
+
+if __name__ == "__main__":
+    import argparse
+    import signal
+
+    from settings import create_base_app
+
+    parser = argparse.ArgumentParser(description="回数制限のサービス（RATE_LIMIT_BACKEND=socket 用）")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--socket", help="Unix ソケットのパス（既定は RATE_LIMIT_SOCKET）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    path = args.socket or default_paths(create_base_app())[1]
+    # TERM でも INT と同じようにソケットを消してから終了する
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with RateLimitService(path) as service:
+        logger.info("%s で待ち受けます", path)
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
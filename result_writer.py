@@ -0,0 +1,159 @@
+"""採点結果の書き込み（write-behind 対応）。
+
+RESULT_WRITE_MODE = "sync" のときはリクエストの中でそのままコミットする。
+"async" のときは結果を上限付きのキューに入れ、バックグラウンドのスレッドが
+複数の提出をまとめて1トランザクションで書き込む。キューが一杯のときは
+RESULT_QUEUE_PUT_TIMEOUT 秒まで待ち、それでも空かなければリクエストの中で
+同期的に書き込む（バックプレッシャー）。終了時には残りを書き切る。
+まとめた書き込みが失敗したときは1件ずつ書き直し、失敗した提出だけをログに残して捨てる。
+
+削除待ち（user_deletion.py）のユーザーの結果は書き込まずに捨てる。他のワーカーの
+identity のキャッシュが切れるまでは、削除したユーザーからの提出がまだ届くため。
+"""
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+import rollups
+from database import db
+from identity import DELETED_ROLE
+from mastery import record_outcomes
+from model import QuizResult, User
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def record_results(user_id, outcomes, answered_at=None):
+    """(question_id, is_correct) のリストを quiz_results と習熟状況・集計に保存する。commit は呼び出し側で行う。"""
+    if not outcomes:
+        return
+    # ロールは書き込みと同じトランザクションで調べる（削除が先にコミットされていれば書かない）
+    role = db.session.execute(select(User.role).where(User.id == user_id)).scalar()
+    if role is None or role == DELETED_ROLE:
+        logger.info("削除されたユーザー %s の採点結果 %d 件を捨てました", user_id, len(outcomes))
+        return
+    answered_at = answered_at or datetime.utcnow()
+    # 最初の解答かどうかは user_question_stats を更新する前に調べる
+    firsts = rollups.first_attempts(user_id, outcomes)
+    db.session.execute(insert(QuizResult.__table__), [
+        {
+            "user_id": user_id,
+            "question_id": question_id,
+            "is_correct": is_correct,
+            "timestamp": answered_at,
+        }
+        for question_id, is_correct in outcomes
+    ])
+    record_outcomes(user_id, outcomes, answered_at)
+    rollups.record_outcomes(outcomes, answered_at, firsts)
+
+
+class ResultWriter:
+    def __init__(self):
+        self.app = None
+        self.mode = "sync"
+        self.batch_size = 200
+        self.put_timeout = 0.5
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get("RESULT_WRITE_MODE", "sync")
+        self.batch_size = app.config.get("RESULT_WRITE_BATCH_SIZE", self.batch_size)
+        self.put_timeout = app.config.get("RESULT_QUEUE_PUT_TIMEOUT", self.put_timeout)
+        self._queue = queue.Queue(maxsize=app.config.get("RESULT_QUEUE_SIZE", 10000))
+        atexit.register(self.shutdown)
+
+    def submit(self, user_id, outcomes):
+        """(question_id, is_correct) のリストを保存する。async ではキューに入れて戻る。"""
+        if not outcomes:
+            return
+        answered_at = datetime.utcnow()
+
+        if self.mode == "async":
+            self._ensure_thread()
+            try:
+                self._queue.put((user_id, outcomes, answered_at), timeout=self.put_timeout)
+                return
+            except queue.Full:
+                logger.warning("結果キューが一杯のため同期的に書き込みます")
+
+        record_results(user_id, outcomes, answered_at)
+        db.session.commit()
+
+    def flush(self):
+        """キューに入っている結果がすべて書き込まれるまで待つ。"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self):
+        """残りを書き切ってからスレッドを止める。"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_thread(self):
+        # fork したワーカーでも最初の書き込み時にスレッドを起動する
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = any(entry is _STOP for entry in batch)
+                entries = [entry for entry in batch if entry is not _STOP]
+                try:
+                    self._write(entries)
+                finally:
+                    db.session.remove()
+                    for _ in batch:
+                        self._queue.task_done()
+
+                if stop:
+                    return
+
+    def _write(self, entries):
+        try:
+            for user_id, outcomes, answered_at in entries:
+                record_results(user_id, outcomes, answered_at)
+            db.session.commit()
+            return
+        except Exception:
+            db.session.rollback()
+            if len(entries) == 1:
+                logger.exception("ユーザー %s の採点結果 %d 件の書き込みに失敗しました", entries[0][0], len(entries[0][1]))
+                return
+            logger.warning("採点結果 %d 件のまとめた書き込みに失敗したため1件ずつ書き直します", len(entries), exc_info=True)
+
+        # 他の提出まで巻き添えにしないように、1件ずつ別のトランザクションで書く
+        for entry in entries:
+            self._write([entry])
+
+
+result_writer = ResultWriter()
@@ -0,0 +1,204 @@
+"""解答履歴（quiz_results）のエクスポート（管理者用の /admin/export/results）。
+
+CSV か NDJSON で、ユーザーのメールアドレスと問題の章を付けて1行ずつ出力する。
+行は ID の順に batch_size 件ずつ「前のバッチの最後の ID より大きい」条件で読み
+（キーセット方式）、バッチを書き出すごとに読み取りのトランザクションを終える。
+使うメモリはバッチ1つ分なので件数が何千万件でも変わらず、長い読み取りで
+SQLite の WAL のチェックポイントを止めることもない。
+エクスポートを始めた時点の最大の ID までを出力し、途中で追加された解答は含まない。
+アーカイブに移した古い解答（retention.py）は含まない。
+
+gzip を指定すると、出力を少しずつ圧縮しながら .gz のファイルとして返す。
+日時はすべて UTC。
+"""
+import csv
+import io
+import json
+import zlib
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from database import db
+from model import Question, QuizResult, User
+
+# 形式 → (MIME タイプ, 拡張子)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+COLUMNS = ("id", "user_id", "email", "question_id", "category", "is_correct", "timestamp")
+
+# since 以上 until 未満の解答を出力する（None なら条件なし）
+ExportFilters = namedtuple("ExportFilters", ["user_id", "category", "since", "until"])
+
+
+def _parse_time(value, name, end_of_day=False):
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            return datetime.combine(day + timedelta(days=1) if end_of_day else day, datetime.min.time())
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{name} は YYYY-MM-DD か ISO 8601 の日時で指定してください: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_filters(args):
+    """クエリ文字列（user, category, since, until）から ExportFilters を作る。不正な値は ValueError。
+
+    user は ID かメールアドレス。until が日付だけならその日の終わりまでを含む。
+    """
+    user_id = None
+    user = (args.get("user") or "").strip()
+    if "@" in user:
+        user_id = db.session.execute(select(User.id).where(User.email == user)).scalar()
+        if user_id is None:
+            raise ValueError(f"ユーザーが見つかりません: {user}")
+    elif user:
+        try:
+            user_id = int(user)
+        except ValueError:
+            raise ValueError(f"user は ID かメールアドレスで指定してください: {user!r}")
+
+    since = (args.get("since") or "").strip()
+    until = (args.get("until") or "").strip()
+    filters = ExportFilters(
+        user_id=user_id,
+        category=(args.get("category") or "").strip() or None,
+        since=_parse_time(since, "since") if since else None,
+        until=_parse_time(until, "until", end_of_day=True) if until else None,
+    )
+    if filters.since and filters.until and filters.since >= filters.until:
+        raise ValueError("since は until より前の日時にしてください")
+    return filters
+
+
+def _statement(filters):
+    stmt = (
+        select(
+            QuizResult.id, QuizResult.user_id, User.email, QuizResult.question_id,
+            Question.category, QuizResult.is_correct, QuizResult.timestamp,
+        )
+        .outerjoin(User, User.id == QuizResult.user_id)
+        .outerjoin(Question, Question.id == QuizResult.question_id)
+    )
+    if filters.user_id is not None:
+        stmt = stmt.where(QuizResult.user_id == filters.user_id)
+    if filters.category is not None:
+        stmt = stmt.where(Question.category == filters.category)
+    if filters.since is not None:
+        stmt = stmt.where(QuizResult.timestamp >= filters.since)
+    if filters.until is not None:
+        stmt = stmt.where(QuizResult.timestamp < filters.until)
+    return stmt
+
+
+def iter_batches(filters, batch_size):
+    """条件に合う解答を ID の順に batch_size 件ずつのリストで返す。"""
+    last_id = db.session.execute(select(func.max(QuizResult.id))).scalar()
+    db.session.rollback()
+    if last_id is None:
+        return
+    stmt = _statement(filters).order_by(QuizResult.id).limit(batch_size)
+    after = 0
+    while after < last_id:
+        rows = db.session.execute(stmt.where(QuizResult.id > after, QuizResult.id <= last_id)).all()
+        # バッチの間は読み取りのトランザクションを持ち越さない
+        db.session.rollback()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1].id
+
+
+def _timestamp(value):
+    return value.isoformat(timespec="seconds") + "Z" if value is not None else None
+
+
+def _csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Excel で開いても文字化けしないように BOM を付ける
+    buffer.write("\ufeff")
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (r.id, r.user_id, r.email, r.question_id, r.category, int(r.is_correct), _timestamp(r.timestamp))
+            for r in rows
+        )
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _ndjson_chunks(batches):
+    for rows in batches:
+        yield "".join(
+            json.dumps({
+                "id": r.id,
+                "user_id": r.user_id,
+                "email": r.email,
+                "question_id": r.question_id,
+                "category": r.category,
+                "is_correct": bool(r.is_correct),
+                "timestamp": _timestamp(r.timestamp),
+            }, ensure_ascii=False) + "\n"
+            for r in rows
+        ).encode("utf-8")
+
+
+def gzip_chunks(chunks, level=6):
+    """バイト列のイテレータを gzip 形式で少しずつ圧縮する。"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(filters, fmt="csv", batch_size=5000, compress_level=None):
+    """エクスポートの本文をバイト列のイテレータで返す。compress_level を指定すれば gzip で圧縮する。"""
+    batches = iter_batches(filters, batch_size)
+    chunks = _csv_chunks(batches) if fmt == "csv" else _ndjson_chunks(batches)
+    if compress_level is not None:
+        chunks = gzip_chunks(chunks, compress_level)
+    return chunks
+
+
+def download_name(fmt, compressed=False, today=None):
+    name = f"quiz_results-{(today or datetime.utcnow().date()):%Y%m%d}.{FORMATS[fmt][1]}"
+    return name + ".gz" if compressed else name
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from settings import create_base_app
+
+    parser = argparse.ArgumentParser(description="解答履歴を標準出力にエクスポートします")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--user", help="ユーザーの ID かメールアドレス")
+    parser.add_argument("--category")
+    parser.add_argument("--since", help="YYYY-MM-DD または ISO 8601 の日時（UTC）")
+    parser.add_argument("--until", help="YYYY-MM-DD（その日を含む）または ISO 8601 の日時（UTC）")
+    args = parser.parse_args()
+
+    app = create_base_app()
+    with app.app_context():
+        try:
+            filters = parse_filters(vars(args))
+        except ValueError as e:
+            sys.exit(str(e))
+        level = app.config["COMPRESS_LEVEL"] if args.gzip else None
+        for chunk in export(filters, args.format, app.config["EXPORT_BATCH_SIZE"], level):
+            sys.stdout.buffer.write(chunk)
@@ -0,0 +1,329 @@
+"""解答履歴（quiz_results）の保存期間の管理（アーカイブと空き領域の回収）。
+
+RETENTION_DAYS 日より前の日の解答を、別ファイルのアーカイブ（ATTACH したデータベースの
+quiz_results。既定ではデータベースと同じディレクトリの <名前>_archive.db）に移す。
+移した解答はユーザーごと・問題ごとに result_summaries にまとめる。まとめ方は
+user_question_stats と同じ（直近2回の正誤・連続正解数・間隔反復の箱を含む）なので、
+mastery.backfill で作り直しても practice の出題や習熟状況は変わらない。
+問題ごと・章ごとの合計と過去の日ごとの集計（rollups.py）はそのまま残る。
+
+解答はユーザーごとに (user_id, timestamp, id) のインデックスを古い順に RETENTION_BATCH_SIZE 件ずつ読み、
+1バッチごとに
+  1. アーカイブにコピーしてコミット（INSERT OR IGNORE なので繰り返しても重複しない）
+  2. result_summaries への集計と quiz_results からの削除を1つのトランザクションでコミット
+の順に処理する。途中で止まっても、もう一度実行すれば続きから処理する。
+アーカイブ中に削除待ち（user_deletion.py）になったユーザーは、各バッチの前と両方の
+トランザクションの中で調べて飛ばす（user_deletion がアーカイブを消した後に書き込まないため）。
+書き込みロックは1バッチ分しか持たず、バッチの間は RETENTION_PAUSE 秒待つ。
+
+削除で空いたページは PRAGMA incremental_vacuum で VACUUM_STEP_PAGES ページずつ返す
+（auto_vacuum=INCREMENTAL のデータベースのみ。既存のデータベースは
+enable-incremental-vacuum で1回だけ VACUUM して切り替える。その間はデータベースがロックされる）。
+
+定期実行（cron の例）: 30 3 * * * cd /srv/myquest && python retention.py run
+使い方:
+    python retention.py status
+    python retention.py run [--days N] [--dry-run]
+    python retention.py vacuum
+    python retention.py enable-incremental-vacuum
+"""
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, func, select, text, tuple_
+
+import mastery
+from database import db, upsert_insert
+from identity import DELETED_ROLE
+from model import Counter, QuizResult, ResultSummary, User
+
+ARCHIVE_SCHEMA = "archive"
+# この日付（の0時 UTC）より前の解答はアーカイブ済み。値は date.toordinal()
+ARCHIVED_BEFORE_COUNTER = "results_archived_before"
+
+ARCHIVE_STATEMENTS = (
+    f"CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.quiz_results ("
+    "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, question_id INTEGER NOT NULL, "
+    "is_correct BOOLEAN NOT NULL, timestamp DATETIME NOT NULL)",
+    f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.ix_quiz_results_user_time "
+    f"ON quiz_results (user_id, timestamp, id)",
+)
+
+_COPY = text(
+    f"INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.quiz_results (id, user_id, question_id, is_correct, timestamp) "
+    "SELECT id, user_id, question_id, is_correct, timestamp FROM main.quiz_results WHERE id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+_DELETE = text("DELETE FROM main.quiz_results WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+
+
+def archive_path(app):
+    """アーカイブのファイル。RETENTION_ARCHIVE_PATH がなければデータベースの隣の <名前>_archive.db。"""
+    path = app.config.get("RETENTION_ARCHIVE_PATH")
+    if path:
+        return path
+    database = db.engine.url.database
+    if not database or database == ":memory:":
+        return None
+    stem, ext = os.path.splitext(database)
+    return f"{stem}_archive{ext or '.db'}"
+
+
+def cutoff(days, today=None):
+    """この日付より前の日の解答をアーカイブする。"""
+    return (today or datetime.utcnow().date()) - timedelta(days=days)
+
+
+def archived_before(conn):
+    """アーカイブ済みの境界の日付。まだアーカイブしていなければ None。"""
+    value = conn.execute(select(Counter.value).where(Counter.name == ARCHIVED_BEFORE_COUNTER)).scalar()
+    return date.fromordinal(value) if value else None
+
+
+def _set_archived_before(conn, day):
+    updated = conn.execute(
+        Counter.__table__.update()
+        .where(Counter.name == ARCHIVED_BEFORE_COUNTER, Counter.value < day.toordinal())
+        .values(value=day.toordinal())
+    )
+    if updated.rowcount == 0 and archived_before(conn) is None:
+        conn.execute(Counter.__table__.insert().values(name=ARCHIVED_BEFORE_COUNTER, value=day.toordinal()))
+
+
+def _attach(conn, path):
+    conn.exec_driver_sql(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (path,))
+    for statement in ARCHIVE_STATEMENTS:
+        conn.exec_driver_sql(statement)
+    conn.commit()
+
+
+def _detach(conn):
+    conn.rollback()
+    conn.exec_driver_sql(f"DETACH DATABASE {ARCHIVE_SCHEMA}")
+    conn.commit()
+
+
+def count_expired(conn, before):
+    """アーカイブの対象になる解答の件数（削除中のユーザーの解答は除く）。"""
+    limit = datetime.combine(before, datetime.min.time())
+    return conn.execute(
+        select(func.count()).select_from(QuizResult)
+        .join(User, User.id == QuizResult.user_id)
+        .where(QuizResult.timestamp < limit, User.role != DELETED_ROLE)
+    ).scalar()
+
+
+def _user_deleted(conn, user_id):
+    role = conn.execute(select(User.role).where(User.id == user_id)).scalar()
+    return role is None or role == DELETED_ROLE
+
+
+def _summarize(conn, user_id, rows):
+    """古い順の (id, question_id, is_correct, timestamp) を result_summaries に加える。"""
+    summaries = ResultSummary.__table__
+    question_ids = {row.question_id for row in rows}
+    states = {
+        row["question_id"]: dict(row)
+        for row in conn.execute(
+            select(*[summaries.c[c] for c in mastery.STAT_COLUMNS])
+            .where(summaries.c.user_id == user_id, summaries.c.question_id.in_(question_ids))
+        ).mappings()
+    }
+    for row in rows:
+        state = states.get(row.question_id)
+        if state is None:
+            state = states[row.question_id] = mastery.new_state(user_id, row.question_id, row.timestamp)
+        mastery.apply_outcome(state, row.is_correct, row.timestamp)
+
+    stmt = upsert_insert(summaries, bind=conn)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[summaries.c.user_id, summaries.c.question_id],
+        set_={c: stmt.excluded[c] for c in mastery.STAT_COLUMNS[2:]},
+    )
+    conn.execute(stmt, list(states.values()))
+
+
+def archive(engine, path, before, batch_size=2000, pause=0.05, echo=None):
+    """before より前の日の解答をアーカイブに移す。移した件数を返す。"""
+    limit = datetime.combine(before, datetime.min.time())
+    with engine.connect() as conn:
+        # 境界を先に記録する（途中で止まっても、それより前の日ごとの集計は作り直さない）
+        with conn.begin():
+            _set_archived_before(conn, before)
+        total = count_expired(conn, before)
+        user_ids = list(conn.execute(select(User.id).where(User.role != DELETED_ROLE).order_by(User.id)).scalars())
+        conn.rollback()
+        if echo:
+            echo(f"{before.isoformat()} より前の解答 {total:,} 件をアーカイブします（{path}）")
+        if not total:
+            return 0
+
+        _attach(conn, path)
+        moved = 0
+        started = reported = time.perf_counter()
+        try:
+            for user_id in user_ids:
+                after = None
+                while True:
+                    if _user_deleted(conn, user_id):
+                        conn.rollback()
+                        break
+                    stmt = (
+                        select(QuizResult.id, QuizResult.question_id, QuizResult.is_correct, QuizResult.timestamp)
+                        .where(QuizResult.user_id == user_id, QuizResult.timestamp < limit)
+                        .order_by(QuizResult.timestamp, QuizResult.id)
+                        .limit(batch_size)
+                    )
+                    if after is not None:
+                        stmt = stmt.where(tuple_(QuizResult.timestamp, QuizResult.id) > after)
+                    rows = conn.execute(stmt).all()
+                    conn.rollback()
+                    if not rows:
+                        break
+                    ids = [row.id for row in rows]
+
+                    # どちらも先に書き込んでロックを取ってから、削除待ちになっていないかを調べる
+                    with conn.begin() as tx:
+                        conn.execute(_COPY, {"ids": ids})
+                        if _user_deleted(conn, user_id):
+                            tx.rollback()
+                            break
+                    with conn.begin() as tx:
+                        conn.execute(_DELETE, {"ids": ids})
+                        if _user_deleted(conn, user_id):
+                            tx.rollback()
+                            break
+                        _summarize(conn, user_id, rows)
+
+                    moved += len(rows)
+                    after = (rows[-1].timestamp, rows[-1].id)
+                    now = time.perf_counter()
+                    if echo and (now - reported >= 1 or moved >= total):
+                        reported = now
+                        echo(f"  {moved:,} / {total:,} 件（{moved * 100 // total}%、{moved / (now - started):,.0f} 件/秒）")
+                    if len(rows) < batch_size:
+                        break
+                    time.sleep(pause)
+        finally:
+            _detach(conn)
+    return moved
+
+
+def forget_user(engine, path, user_id, batch_size=2000, pause=0.05):
+    """削除するユーザーのアーカイブの解答と result_summaries を消す。"""
+    with engine.begin() as conn:
+        conn.execute(ResultSummary.__table__.delete().where(ResultSummary.user_id == user_id))
+    if not path or not os.path.exists(path):
+        return 0
+    deleted = 0
+    with engine.connect() as conn:
+        _attach(conn, path)
+        try:
+            while True:
+                with conn.begin():
+                    count = conn.execute(text(
+                        f"DELETE FROM {ARCHIVE_SCHEMA}.quiz_results WHERE id IN (SELECT id FROM "
+                        f"{ARCHIVE_SCHEMA}.quiz_results WHERE user_id = :user_id LIMIT :limit)"
+                    ), {"user_id": user_id, "limit": batch_size}).rowcount
+                deleted += count
+                if count < batch_size:
+                    break
+                time.sleep(pause)
+        finally:
+            _detach(conn)
+    return deleted
+
+
+def space_status(conn):
+    """(auto_vacuum のモード, 全ページ数, 空きページ数, ページの大きさ)。"""
+    return tuple(conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                 for name in ("auto_vacuum", "page_count", "freelist_count", "page_size"))
+
+
+def incremental_vacuum(engine, step_pages=1000, pause=0.05, echo=None):
+    """空きページを step_pages ずつファイルから返す。返したページ数を返す。"""
+    released = 0
+    with engine.connect() as conn:
+        mode, _, free, page_size = space_status(conn)
+        conn.rollback()
+        if mode != 2:
+            if echo and free:
+                echo(f"auto_vacuum が INCREMENTAL ではないため、空き {free:,} ページを返せません"
+                     "（enable-incremental-vacuum を実行してください）")
+            return 0
+        while free:
+            # sqlite3 の execute は1ページ分しか進めないので、最後まで実行する executescript を使う
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            conn.rollback()
+            released += free - remaining
+            if echo:
+                echo(f"  {released:,} ページ（{released * page_size / 1024 / 1024:,.1f} MB）を返しました。"
+                     f"残り {remaining:,} ページ")
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(pause)
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").all()
+    return released
+
+
+def enable_incremental_vacuum(engine):
+    """auto_vacuum を INCREMENTAL にして VACUUM する（データベース全体を書き直す。終わるまでロックされる）。"""
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from settings import create_base_app
+
+    parser = argparse.ArgumentParser(description="解答履歴の保存期間の管理")
+    parser.add_argument("command", choices=["status", "run", "vacuum", "enable-incremental-vacuum"])
+    parser.add_argument("--days", type=int, help="保存する日数（既定は RETENTION_DAYS）")
+    parser.add_argument("--dry-run", action="store_true", help="件数を表示するだけで移さない")
+    args = parser.parse_args()
+
+    app = create_base_app()
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != "sqlite":
+            sys.exit("アーカイブは SQLite のデータベースでのみ使えます")
+        config = app.config
+        days = args.days if args.days is not None else config["RETENTION_DAYS"]
+        if days < 1:
+            sys.exit("--days は1以上にしてください")
+        before = cutoff(days)
+        path = archive_path(app)
+
+        if args.command == "status":
+            with engine.connect() as conn:
+                mode, pages, free, page_size = space_status(conn)
+                done = archived_before(conn)
+                expired = count_expired(conn, before)
+                live = conn.execute(select(func.count()).select_from(QuizResult)).scalar()
+                summaries = conn.execute(select(func.count()).select_from(ResultSummary)).scalar()
+            print(f"quiz_results: {live:,} 件（うち {before.isoformat()} より前 {expired:,} 件）")
+            print(f"アーカイブ済み: {done.isoformat() + ' より前' if done else 'なし'}（{path}）")
+            print(f"result_summaries: {summaries:,} 件")
+            print(f"データベース: {pages * page_size / 1024 / 1024:,.1f} MB、空き {free * page_size / 1024 / 1024:,.1f} MB、"
+                  f"auto_vacuum={('NONE', 'FULL', 'INCREMENTAL')[mode]}")
+        elif args.command == "run":
+            if args.dry_run:
+                with engine.connect() as conn:
+                    print(f"{before.isoformat()} より前の解答 {count_expired(conn, before):,} 件がアーカイブの対象です")
+                sys.exit(0)
+            moved = archive(engine, path, before, config["RETENTION_BATCH_SIZE"], config["RETENTION_PAUSE"], echo=print)
+            print(f"{moved:,} 件をアーカイブしました")
+            incremental_vacuum(engine, config["VACUUM_STEP_PAGES"], config["RETENTION_PAUSE"], echo=print)
+        elif args.command == "vacuum":
+            incremental_vacuum(engine, config["VACUUM_STEP_PAGES"], config["RETENTION_PAUSE"], echo=print)
+        else:
+            print("VACUUM しています（終わるまでデータベースへの書き込みは待たされます）...")
+            mode = enable_incremental_vacuum(engine)
+            print(f"auto_vacuum={('NONE', 'FULL', 'INCREMENTAL')[mode]}")
@@ -0,0 +1,338 @@
+"""問題ごと・章ごとの解答集計（管理画面の難易度表示用）。
+
+解答を保存するのと同じトランザクションで、問題ごと・章ごとの解答数・正解数・
+解答したユーザー数と、日ごとの解答数・正解数を加算する。管理画面の API は
+これらの表を読むだけなので、quiz_results がどれだけ大きくなっても集計し直さない。
+
+解答したユーザー数は、その問題（章）への最初の解答かどうかを
+user_question_stats で判定して数える。問題の章を変更したり問題を削除したときは、
+関係する章だけを rebuild_chapters で作り直す。章の集計は問題ごとの集計と
+user_question_stats から作るので、quiz_results は読まない。
+
+quiz_results の古い解答はアーカイブに移る（retention.py）。問題ごとの合計は
+user_question_stats から作り直せるが、アーカイブ済みの日の日ごとの集計は作り直せないので、
+rebuild でもそのまま残す。
+
+作り直し: python rollups.py rebuild
+"""
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import bindparam, case, delete, distinct, func, insert, select
+
+import retention
+from database import db, upsert_insert
+from model import (
+    ChapterDailyStat, ChapterStat, Question, QuestionDailyStat, QuestionStat, QuizResult, ResultSummary,
+    UserQuestionStat,
+)
+from question_bank import question_bank
+
+_CORRECT = func.sum(case((QuizResult.is_correct, 1), else_=0))
+
+# 今回の解答のうち、そのユーザーにとって最初の解答になる問題と章
+FirstAttempts = namedtuple("FirstAttempts", ["categories", "questions", "chapters"])
+
+
+def first_attempts(user_id, outcomes):
+    """user_question_stats を更新する前（mastery.record_outcomes より前）に呼ぶ。"""
+    question_ids = {q_id for q_id, _ in outcomes}
+    categories = question_categories(question_ids)
+    seen_questions = set(db.session.execute(
+        select(UserQuestionStat.question_id).where(
+            UserQuestionStat.user_id == user_id,
+            UserQuestionStat.question_id.in_(question_ids),
+        )
+    ).scalars())
+    chapters = set(categories.values())
+    seen_chapters = set(db.session.execute(
+        select(Question.category).distinct()
+        .join(UserQuestionStat, UserQuestionStat.question_id == Question.id)
+        .where(UserQuestionStat.user_id == user_id, Question.category.in_(chapters))
+    ).scalars())
+    return FirstAttempts(categories, question_ids - seen_questions, chapters - seen_chapters)
+
+
+def question_categories(question_ids):
+    """問題ID → 章。問題バンクになければ（インポート直後など）DB から引く。"""
+    snapshot = question_bank.snapshot()
+    categories = {}
+    missing = []
+    for q_id in question_ids:
+        question = snapshot.by_id.get(q_id)
+        if question is not None:
+            categories[q_id] = question.category
+        else:
+            missing.append(q_id)
+    if missing:
+        categories.update(db.session.execute(
+            select(Question.id, Question.category).where(Question.id.in_(missing))
+        ).all())
+    return categories
+
+
+def _add(table, keys, rows):
+    """keys を主キーとして attempts / corrects（と users）を加算する。"""
+    if not rows:
+        return
+    stmt = upsert_insert(table)
+    set_ = {
+        "attempts": table.c.attempts + stmt.excluded.attempts,
+        "corrects": table.c.corrects + stmt.excluded.corrects,
+    }
+    if "users" in table.c:
+        set_["users"] = table.c.users + stmt.excluded.users
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c[k] for k in keys], set_=set_)
+    db.session.execute(stmt, rows)
+
+
+def _totals(pairs, new_keys=None):
+    """(キー, is_correct) を集計して {キー: [attempts, corrects, users]} にする。"""
+    totals = {}
+    for key, is_correct in pairs:
+        entry = totals.setdefault(key, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += 1 if is_correct else 0
+    for key in new_keys or ():
+        if key in totals:
+            totals[key][2] = 1
+    return totals
+
+
+def record_outcomes(outcomes, answered_at, firsts):
+    """(question_id, is_correct) のリストを集計に加える。firsts は first_attempts の結果。
+
+    commit は呼び出し側で行う。
+    """
+    if not outcomes:
+        return
+    day = answered_at.date()
+    categories = firsts.categories
+
+    by_question = _totals(outcomes, firsts.questions)
+    by_chapter = _totals(
+        [(categories[q_id], is_correct) for q_id, is_correct in outcomes if q_id in categories],
+        firsts.chapters,
+    )
+
+    _add(QuestionStat.__table__, ["question_id"], [
+        {"question_id": q_id, "attempts": a, "corrects": c, "users": u} for q_id, (a, c, u) in by_question.items()
+    ])
+    _add(ChapterStat.__table__, ["category"], [
+        {"category": cat, "attempts": a, "corrects": c, "users": u} for cat, (a, c, u) in by_chapter.items()
+    ])
+    _add(QuestionDailyStat.__table__, ["question_id", "day"], [
+        {"question_id": q_id, "day": day, "attempts": a, "corrects": c} for q_id, (a, c, _) in by_question.items()
+    ])
+    _add(ChapterDailyStat.__table__, ["category", "day"], [
+        {"category": cat, "day": day, "attempts": a, "corrects": c} for cat, (a, c, _) in by_chapter.items()
+    ])
+
+
+def forget_user(user_id):
+    """ユーザーを削除する前に、そのユーザーの解答を集計から引く。commit は呼び出し側で行う。
+
+    合計は user_question_stats（アーカイブした解答も含む）から引く。日ごとの集計は
+    quiz_results に残っている解答の分だけを引き、アーカイブ済みの日はそのまま残す。
+    """
+    day = func.date(QuizResult.timestamp)
+    by_question = db.session.execute(
+        select(UserQuestionStat.question_id, UserQuestionStat.attempts, UserQuestionStat.corrects)
+        .where(UserQuestionStat.user_id == user_id)
+    ).all()
+    if not by_question:
+        return
+    by_chapter = db.session.execute(
+        select(Question.category, func.sum(UserQuestionStat.attempts), func.sum(UserQuestionStat.corrects))
+        .join(Question, Question.id == UserQuestionStat.question_id)
+        .where(UserQuestionStat.user_id == user_id).group_by(Question.category)
+    ).all()
+    by_question_day = db.session.execute(
+        select(QuizResult.question_id, day, func.count(), _CORRECT)
+        .where(QuizResult.user_id == user_id).group_by(QuizResult.question_id, day)
+    ).all()
+    by_chapter_day = db.session.execute(
+        select(Question.category, day, func.count(), _CORRECT)
+        .join(Question, Question.id == QuizResult.question_id)
+        .where(QuizResult.user_id == user_id).group_by(Question.category, day)
+    ).all()
+
+    def subtract(table, keys, rows, users=True):
+        values = {
+            "attempts": table.c.attempts - bindparam("d_attempts"),
+            "corrects": table.c.corrects - bindparam("d_corrects"),
+        }
+        if users:
+            values["users"] = table.c.users - 1
+        stmt = table.update().where(*[table.c[k] == bindparam(f"k_{k}") for k in keys]).values(values)
+        db.session.execute(stmt, [
+            dict({f"k_{k}": v for k, v in zip(keys, row[:len(keys)])},
+                 d_attempts=row[len(keys)], d_corrects=row[len(keys) + 1])
+            for row in rows
+        ])
+
+    subtract(QuestionStat.__table__, ["question_id"], by_question)
+    subtract(ChapterStat.__table__, ["category"], by_chapter)
+    subtract(QuestionDailyStat.__table__, ["question_id", "day"], _as_dates(by_question_day), users=False)
+    subtract(ChapterDailyStat.__table__, ["category", "day"], _as_dates(by_chapter_day), users=False)
+
+
+def _as_dates(rows):
+    # SQLite の date() は文字列を返す
+    return [
+        (key, date.fromisoformat(day) if isinstance(day, str) else day, attempts, corrects)
+        for key, day, attempts, corrects in rows
+    ]
+
+
+def rebuild(conn, echo=None):
+    """user_question_stats と quiz_results から集計を作り直す。
+
+    問題ごとの合計は user_question_stats から、日ごとの集計は quiz_results から作る。
+    アーカイブ済みの日（retention.archived_before より前）の日ごとの集計は消さずに残す。
+    """
+    archived_before = retention.archived_before(conn)
+    day = func.date(QuizResult.timestamp)
+    clear_daily = delete(QuestionDailyStat.__table__)
+    daily = select(QuizResult.question_id, day, func.count(), _CORRECT).group_by(QuizResult.question_id, day)
+    if archived_before is not None:
+        clear_daily = clear_daily.where(QuestionDailyStat.day >= archived_before)
+        daily = daily.where(QuizResult.timestamp >= datetime.combine(archived_before, time()))
+    conn.execute(delete(QuestionStat.__table__))
+    conn.execute(clear_daily)
+
+    conn.execute(insert(QuestionStat.__table__).from_select(
+        ["question_id", "attempts", "corrects", "users"],
+        select(
+            UserQuestionStat.question_id, func.sum(UserQuestionStat.attempts),
+            func.sum(UserQuestionStat.corrects), func.count(),
+        ).group_by(UserQuestionStat.question_id),
+    ))
+    conn.execute(insert(QuestionDailyStat.__table__).from_select(["question_id", "day", "attempts", "corrects"], daily))
+    if echo:
+        echo("  問題ごとの集計を作成しました")
+    for model in (ChapterStat, ChapterDailyStat):
+        conn.execute(delete(model.__table__))
+    _insert_chapters(conn)
+    if echo:
+        echo("  章ごとの集計を作成しました")
+    return conn.execute(select(func.count()).select_from(QuestionStat.__table__)).scalar()
+
+
+def rebuild_chapters(categories):
+    """指定した章の集計だけを作り直す（問題の章の変更・削除のあと）。commit は呼び出し側で行う。"""
+    categories = {str(c) for c in categories if c is not None}
+    if not categories:
+        return
+    for model in (ChapterStat, ChapterDailyStat):
+        db.session.execute(delete(model.__table__).where(model.category.in_(categories)))
+    _insert_chapters(db.session, Question.category.in_(categories))
+
+
+def forget_questions(question_ids):
+    """削除する問題の解答履歴と集計を消す。章の集計は呼び出し側で rebuild_chapters する。"""
+    question_ids = list(question_ids)
+    for model in (QuestionDailyStat, QuestionStat, UserQuestionStat, ResultSummary, QuizResult):
+        db.session.execute(delete(model.__table__).where(model.question_id.in_(question_ids)))
+
+
+def _insert_chapters(conn, where=None):
+    """問題ごとの集計を章でまとめる。解答したユーザー数は user_question_stats から数える。"""
+    users = (
+        select(Question.category.label("category"), func.count(distinct(UserQuestionStat.user_id)).label("users"))
+        .join(Question, Question.id == UserQuestionStat.question_id)
+        .group_by(Question.category)
+    )
+    if where is not None:
+        users = users.where(where)
+    users = users.subquery()
+    totals = (
+        select(
+            Question.category, func.sum(QuestionStat.attempts), func.sum(QuestionStat.corrects),
+            func.coalesce(users.c.users, 0),
+        )
+        .join(Question, Question.id == QuestionStat.question_id)
+        .outerjoin(users, users.c.category == Question.category)
+        .group_by(Question.category, users.c.users)
+    )
+    daily = (
+        select(
+            Question.category, QuestionDailyStat.day,
+            func.sum(QuestionDailyStat.attempts), func.sum(QuestionDailyStat.corrects),
+        )
+        .join(Question, Question.id == QuestionDailyStat.question_id)
+        .group_by(Question.category, QuestionDailyStat.day)
+    )
+    if where is not None:
+        totals = totals.where(where)
+        daily = daily.where(where)
+    conn.execute(insert(ChapterStat.__table__).from_select(["category", "attempts", "corrects", "users"], totals))
+    conn.execute(insert(ChapterDailyStat.__table__).from_select(["category", "day", "attempts", "corrects"], daily))
+
+
+# まだ解答のない問題・章の集計
+EMPTY_STATS = {"attempts": 0, "corrects": 0, "users": 0, "correct_rate": None}
+
+
+def _rate(attempts, corrects):
+    return round(corrects / attempts, 4) if attempts else None
+
+
+def _stat_dict(attempts, corrects, users):
+    return {"attempts": attempts, "corrects": corrects, "users": users, "correct_rate": _rate(attempts, corrects)}
+
+
+def chapter_stats():
+    """章ごとの集計 {章: {...}}。"""
+    rows = db.session.execute(
+        select(ChapterStat.category, ChapterStat.attempts, ChapterStat.corrects, ChapterStat.users)
+    ).all()
+    return {category: _stat_dict(a, c, u) for category, a, c, u in rows}
+
+
+def question_stats(question_ids):
+    """問題ID → 集計。まだ解答のない問題は含まない。"""
+    rows = db.session.execute(
+        select(QuestionStat.question_id, QuestionStat.attempts, QuestionStat.corrects, QuestionStat.users)
+        .where(QuestionStat.question_id.in_(list(question_ids)))
+    ).all()
+    return {q_id: _stat_dict(a, c, u) for q_id, a, c, u in rows}
+
+
+def daily(model, key_column, key, days):
+    """直近 days 日の日ごとの集計（古い順）。"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = db.session.execute(
+        select(model.day, model.attempts, model.corrects)
+        .where(key_column == key, model.day >= since)
+        .order_by(model.day)
+    ).all()
+    return [
+        {"day": day.isoformat(), "attempts": a, "corrects": c, "correct_rate": _rate(a, c)}
+        for day, a, c in rows
+    ]
+
+
+def question_daily(question_id, days=30):
+    return daily(QuestionDailyStat, QuestionDailyStat.question_id, question_id, days)
+
+
+def chapter_daily(category, days=30):
+    return daily(ChapterDailyStat, ChapterDailyStat.category, str(category), days)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("使い方: python rollups.py rebuild")
+        sys.exit(1)
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            count = rebuild(conn, echo=print)
+        print(f"question_stats を {count} 件作成しました")
@@ -0,0 +1,134 @@
+"""CSV の名簿からのユーザーの一括登録。
+
+1行目は見出しで、email と password は必須、nickname と role（student / admin）は任意。
+Excel で保存した UTF-8（BOM 付き）の CSV もそのまま読める。全行を検証してから
+パスワードのハッシュをプロセスプールで並列に作り、1回の INSERT でまとめて登録する。
+エラーのある行があれば何も登録しない。
+
+使い方: python roster.py students.csv [--check]
+"""
+import argparse
+import csv
+import io
+import time
+
+from sqlalchemy import insert, select
+
+import migrations
+from database import db
+from identity import ADMIN_ROLE, STUDENT_ROLE
+from model import User
+from password_pool import password_pool
+
+REQUIRED_COLUMNS = ("email", "password")
+ROLES = (STUDENT_ROLE, ADMIN_ROLE)
+
+
+class RosterReport:
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.errors = [] # (行番号, メッセージ)
+        self.seconds = 0.0
+
+
+def read_roster(stream):
+    """バイナリのストリームから CSV を読み、(行番号, 行の辞書) のリストと見出しのエラーを返す。"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    columns = [c.strip().lower() for c in reader.fieldnames or []]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        return [], f"CSV の1行目に {', '.join(missing)} の列が必要です"
+    reader.fieldnames = columns
+    # 行番号は見出しを1行目として数える
+    return [(reader.line_num, row) for row in reader], None
+
+
+def validate_rows(rows, report):
+    """行を検証し、users に登録する値のリストを返す。エラーは report に追加する。"""
+    valid = []
+    seen = set()
+    for line, row in rows:
+        email = (row.get("email") or "").strip()
+        password = row.get("password") or ""
+        nickname = (row.get("nickname") or "").strip() or None
+        role = (row.get("role") or "").strip() or STUDENT_ROLE
+
+        if not email or "@" not in email or len(email) > 120:
+            report.errors.append((line, f"メールアドレスが不正です: {email!r}"))
+        elif email.lower() in seen:
+            report.errors.append((line, f"メールアドレスが重複しています: {email}"))
+        elif not password:
+            report.errors.append((line, "パスワードが空です"))
+        elif nickname is not None and len(nickname) > 50:
+            report.errors.append((line, "ニックネームが長すぎます（50文字まで）"))
+        elif role not in ROLES:
+            report.errors.append((line, f"role は {' / '.join(ROLES)} のいずれかです: {role!r}"))
+        else:
+            valid.append((line, {"email": email, "nickname": nickname, "role": role}, password))
+        seen.add(email.lower())
+
+    # 既に登録されているメールアドレスは1回の検索で調べる
+    emails = [values["email"] for _, values, _ in valid]
+    existing = set(db.session.execute(select(User.email).where(User.email.in_(emails))).scalars()) if emails else set()
+    for line, values, _ in valid:
+        if values["email"] in existing:
+            report.errors.append((line, f"このメールアドレスは既に使用されています: {values['email']}"))
+    return [(line, values, password) for line, values, password in valid if values["email"] not in existing]
+
+
+def provision(stream, check_only=False, max_rows=None):
+    """CSV の名簿からユーザーを登録する。"""
+    started = time.perf_counter()
+    report = RosterReport()
+    rows, error = read_roster(stream)
+    if error:
+        report.errors.append((1, error))
+        return report
+    report.total = len(rows)
+    if max_rows is not None and len(rows) > max_rows:
+        report.errors.append((1, f"一度に登録できるのは {max_rows} 人までです"))
+        return report
+
+    valid = validate_rows(rows, report)
+    if report.errors or check_only or not valid:
+        report.errors.sort()
+        report.seconds = time.perf_counter() - started
+        return report
+
+    hashes = password_pool.generate_many([password for _, _, password in valid])
+    db.session.execute(insert(User.__table__), [
+        dict(values, password_hash=pwhash) for (_, values, _), pwhash in zip(valid, hashes)
+    ])
+    db.session.commit()
+    report.created = len(valid)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+if __name__ == "__main__":
+    from settings import create_base_app
+
+    app = create_base_app()
+    password_pool.init_app(app)
+
+    parser = argparse.ArgumentParser(description="CSV の名簿からユーザーを一括登録します")
+    parser.add_argument("csv_file")
+    parser.add_argument("--check", action="store_true", help="登録せずに検証だけを行う")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.check:
+            migrations.upgrade(echo=print)
+        with open(args.csv_file, "rb") as f:
+            result = provision(f, check_only=args.check)
+
+    for line, message in result.errors:
+        print(f"  {line} 行目: {message}")
+    if args.check:
+        print(f"検証完了：{result.total} 行、エラー {len(result.errors)} 件")
+    else:
+        print(f"登録完了：{result.created} 人（{result.seconds:.1f} 秒）、エラー {len(result.errors)} 件")
+    if result.errors:
+        raise SystemExit(1)
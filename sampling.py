@@ -0,0 +1,38 @@
+"""問題IDの配列から k 件をランダムに選ぶ。
+
+問題の行そのものではなくIDの配列だけを対象にするので、
+バンクの大きさではなく選ぶ件数 k に比例した手間で済む。
+"""
+import random
+
+
+def sample_ids(ids, k, exclude=None, rng=random):
+    """ids から重複なしで最大 k 件を選ぶ。exclude に含まれるIDは選ばない。"""
+    n = len(ids)
+    if k <= 0 or n == 0:
+        return []
+
+    if not exclude:
+        return rng.sample(ids, min(k, n))
+
+    # 除外が半分以下なら棄却サンプリング（期待試行回数は 2k 以下）
+    if len(exclude) * 2 <= n:
+        chosen = []
+        seen = set()
+        attempts = 0
+        max_attempts = 4 * k + 32
+        while len(chosen) < k and attempts < max_attempts:
+            attempts += 1
+            idx = rng.randrange(n)
+            if idx in seen:
+                continue
+            seen.add(idx)
+            q_id = ids[idx]
+            if q_id not in exclude:
+                chosen.append(q_id)
+        if len(chosen) == k:
+            return chosen
+
+    # 除外が多い場合や候補が k 件に満たない場合は、絞り込んでから選ぶ
+    pool = [q_id for q_id in ids if q_id not in exclude]
+    return rng.sample(pool, min(k, len(pool)))
@@ -0,0 +1,263 @@
+"""本番用の起動スクリプト（prefork）。
+
+マスタープロセスで create_app() を作り、マイグレーションと問題バンクの読み込みを
+済ませてから待ち受けのソケットを開き、--workers 個のワーカーを fork する。
+ワーカーは読み込み済みのアプリと問題バンクをコピーオンライトで共有し
+（fork の前に gc.freeze で GC がそれらのページに書き込まないようにする）、
+それぞれ --threads 個のスレッドでリクエストを処理する。スレッドがすべて使用中の
+ワーカーは新しい接続を受け付けないので、接続は空いているワーカーに回る。
+
+マスターへのシグナル:
+    TERM / INT  処理中のリクエストを終えてから全ワーカーを止めて終了する
+    HUP         問題バンクを読み直して新しいワーカーを起動し、古いワーカーを順に止める
+                （コードの変更を反映するにはマスターを起動し直す）
+異常終了したワーカーは起動し直す。
+
+/admin/metrics の値や各種キャッシュはワーカーごとに持つ。回数制限（rate_limit.py）は
+MYQUEST_RATE_LIMIT_BACKEND を指定しなければ、全ワーカーで共有する sqlite にする。
+外部の WSGI サーバーを使う場合は wsgi:app を指定する。
+
+使い方: MYQUEST_SECRET_KEY=... python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import migrations
+from app import create_app
+from database import db
+from password_pool import password_pool
+from question_bank import question_bank
+from result_writer import result_writer
+from user_deletion import user_deleter
+
+logger = logging.getLogger("serve")
+
+
+class RequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # keep-alive の接続がスレッドを占有し続けないように、次のリクエストを待つ時間を区切る
+    timeout = 5
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """決まった数のスレッドでリクエストを処理する WSGI サーバー（ワーカー1つ分）。"""
+
+    multithread = True
+
+    def __init__(self, sock, app, threads):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        self.timeout = 0.5
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="request")
+        self._slots = threading.BoundedSemaphore(threads)
+        self._slot_taken = False
+
+    def serve_until(self, stopping):
+        while not stopping.is_set():
+            # 空いているスレッドがあるときだけ接続を受け付ける
+            if not self._slots.acquire(timeout=self.timeout):
+                continue
+            self._slot_taken = False
+            self.handle_request()
+            if not self._slot_taken:
+                self._slots.release()
+        self._executor.shutdown(wait=True)
+
+    def process_request(self, request, client_address):
+        self._slot_taken = True
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+
+def _dispose_engines(app):
+    # マスターは fork の前に接続を閉じ、ワーカーが親の SQLite の接続を共有しないようにする
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def run_worker(app, sock, threads):
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # リクエストのスレッドが動き出す前に、パスワードのハッシュ計算のプロセスを fork しておく
+    password_pool.start()
+    server = PooledWSGIServer(sock, app, threads)
+    logger.info("ワーカーを起動しました（%d スレッド）", threads)
+    server.serve_until(stopping)
+    # 書き込み待ちの解答や削除をこのプロセスで片付けてから終了する
+    result_writer.shutdown()
+    user_deleter.shutdown()
+    password_pool.shutdown()
+    _dispose_engines(app)
+
+
+class Master:
+    def __init__(self, app, sock, workers, threads, graceful_timeout):
+        self.app = app
+        self.sock = sock
+        self.num_workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.workers = {} # pid → 世代（HUP ごとに1つ増える）
+        self.generation = 0
+        self._stop = False
+        self._reload = False
+
+    def preload(self):
+        with self.app.app_context():
+            migrations.ensure_upgraded(echo=logger.info)
+            snapshot = question_bank.snapshot()
+        _dispose_engines(self.app)
+        logger.info("問題バンクを読み込みました（%d 問）", len(snapshot.questions))
+
+    def spawn(self):
+        gc.collect()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.threads)
+            except BaseException:
+                logger.exception("ワーカーが異常終了しました")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = self.generation
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        try:
+            while not self._stop:
+                self._reap()
+                if self._reload:
+                    self._reload = False
+                    self._rolling_restart()
+                current = [pid for pid, gen in self.workers.items() if gen == self.generation]
+                for _ in range(self.num_workers - len(current)):
+                    self.spawn()
+                time.sleep(0.5)
+        finally:
+            self._stop_workers(list(self.workers))
+
+    def _on_stop(self, signum, frame):
+        self._stop = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and not self._stop:
+                logger.warning("ワーカー %d が終了しました（status %d）。起動し直します", pid, status)
+
+    def _rolling_restart(self):
+        logger.info("新しいワーカーに入れ替えます")
+        self.preload()
+        old = list(self.workers)
+        self.generation += 1
+        for _ in range(self.num_workers):
+            self.spawn()
+        self._stop_workers(old)
+
+    def _stop_workers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self.workers.pop(pid, None)
+            time.sleep(0.1)
+        for pid in remaining:
+            logger.warning("ワーカー %d が %s 秒以内に終了しないので強制終了します", pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid, None)
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MyQuest を複数のワーカープロセスで起動します")
+    parser.add_argument("--bind", default=os.environ.get("MYQUEST_BIND", "127.0.0.1:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MYQUEST_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("MYQUEST_THREADS", 4)),
+                        help="ワーカーごとのスレッド数")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="停止時に処理中のリクエストを待つ秒数")
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+    if args.no_access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if not os.environ.get("MYQUEST_SECRET_KEY"):
+        sys.exit("MYQUEST_SECRET_KEY を設定してください（セッションの署名に使います）")
+
+    overrides = {}
+    if "MYQUEST_PASSWORD_POOL_WORKERS" not in os.environ:
+        # ワーカーが CPU の数だけあるので、パスワードのハッシュ計算はワーカーごとに1プロセスで足りる
+        overrides["PASSWORD_POOL_WORKERS"] = 1
+    if "MYQUEST_RATE_LIMIT_BACKEND" not in os.environ and args.workers > 1:
+        # ワーカーごとのバケツでは、制限がワーカーの数だけ緩くなる
+        overrides["RATE_LIMIT_BACKEND"] = "sqlite"
+    app = create_app(overrides)
+
+    host, port = parse_bind(args.bind)
+    sock = socket.create_server((host, port), family=socket.AF_INET6 if ":" in host else socket.AF_INET,
+                                backlog=2048)
+    # すべてのワーカーが同じソケットを select するので、accept を取り逃がしても待たないようにする
+    os.set_blocking(sock.fileno(), False)
+
+    master = Master(app, sock, args.workers, args.threads, args.graceful_timeout)
+    master.preload()
+    logger.info("http://%s:%d で待ち受けます（ワーカー %d、スレッド %d）", host, port, args.workers, args.threads)
+    master.run()
+    logger.info("終了しました")
+
+
+if __name__ == "__main__":
+    main()
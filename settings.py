@@ -0,0 +1,119 @@
+"""アプリケーションの設定。
+
+DEFAULTS が既定値で、同じ名前に MYQUEST_ を付けた環境変数で上書きできる
+（例: MYQUEST_RESULT_WRITE_MODE=async、MYQUEST_SECRET_KEY=...）。値は既定値と同じ型に変換する。
+load や create_app / create_base_app に辞書を渡せば、さらにそれで上書きする（ベンチマークなど）。
+接続先の MYQUEST_DATABASE_URL と接続プールの設定は db_profile.py が読む。
+
+create_base_app はデータベースだけを使う Flask アプリを返す。import_questions.py などの
+スクリプトはこれを使うので、ルートやテンプレート、Web 用のフックは読み込まない。
+"""
+import logging
+import os
+
+from flask import Flask
+
+import db_profile
+from database import db
+
+logger = logging.getLogger(__name__)
+
+ENV_PREFIX = "MYQUEST_"
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+# MYQUEST_SECRET_KEY を設定しないときのセッションの鍵（開発用）
+DEV_SECRET_KEY = "test123"
+
+DEFAULTS = {
+    "SECRET_KEY": None,
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    # 問題バンクのバージョンを確認する間隔（秒）
+    "QUESTION_BANK_CHECK_INTERVAL": 2.0,
+    # 採点結果の書き込み方式: "sync"（リクエスト内でコミット）/ "async"（バックグラウンドでまとめて書き込む）
+    "RESULT_WRITE_MODE": "sync",
+    "RESULT_QUEUE_SIZE": 10000,
+    "RESULT_QUEUE_PUT_TIMEOUT": 0.5,
+    "RESULT_WRITE_BATCH_SIZE": 200,
+    # check_answer_batch で1回に採点できる問題数
+    "CHECK_ANSWER_BATCH_MAX": 200,
+    # /api/questions/bulk で1回に送れる操作の数
+    "BULK_QUESTIONS_MAX": 5000,
+    # CSV の名簿で一度に登録できる人数
+    "ROSTER_MAX_ROWS": 2000,
+    # 解答履歴のエクスポートで1回に読む行数
+    "EXPORT_BATCH_SIZE": 5000,
+    # ユーザー削除時に1トランザクションで消す解答の件数と、その間の待ち時間（秒）
+    "USER_DELETE_CHUNK_SIZE": 2000,
+    "USER_DELETE_PAUSE": 0.05,
+    # 削除を引き受けたワーカーが止まったとみなすまでの秒数（その後は他のワーカーが続きを行う）
+    "USER_DELETE_CLAIM_TIMEOUT": 300.0,
+    # 解答履歴の保存期間（retention.py）。これより前の日の解答はアーカイブに移す
+    "RETENTION_DAYS": 400,
+    "RETENTION_ARCHIVE_PATH": None, # 未設定ならデータベースの隣の <名前>_archive.db
+    "RETENTION_BATCH_SIZE": 2000,
+    "RETENTION_PAUSE": 0.05,
+    "VACUUM_STEP_PAGES": 1000,
+    # リクエストの回数制限（rate_limit.py）。"ip=60/1m, user=10/5m" は IP アドレスごとに
+    # 続けて60回・1分で満杯に戻るバケツと、ユーザーごとに10回・5分のバケツ。空文字列なら制限しない
+    "RATE_LIMIT_ENABLED": True,
+    "RATE_LIMIT_BACKEND": "memory", # memory（ワーカーごと）/ sqlite / socket（ワーカーで共有）
+    "RATE_LIMIT_SQLITE_PATH": None, # 未設定なら instance/ratelimit.db
+    "RATE_LIMIT_SOCKET": None,      # 未設定なら instance/ratelimit.sock
+    "RATE_LIMIT_LOGIN": "ip=60/1m, user=10/5m",
+    "RATE_LIMIT_CHECK_ANSWER": "ip=1200/1m, user=300/1m", # 採点した問題の数で数える
+    "RATE_LIMIT_ADMIN_API": "user=600/1m",
+    # JSON / HTML レスポンスの圧縮
+    "COMPRESS_LEVEL": 6,
+    "COMPRESS_MIN_SIZE": 500,
+    # ログイン中のユーザー情報をキャッシュする秒数
+    "IDENTITY_CACHE_TTL": 30.0,
+    # パスワードのハッシュ計算（別プロセスのプールで行う。0 ならリクエストの中で計算）
+    "PASSWORD_HASH_METHOD": "scrypt:32768:8:1",
+    "PASSWORD_SALT_LENGTH": 16,
+    "PASSWORD_POOL_WORKERS": max(1, (os.cpu_count() or 2) // 2),
+    "PASSWORD_POOL_MAX_PENDING": 32,
+    "PASSWORD_POOL_TIMEOUT": 10.0,
+    # 計測（SQL 文ごとの記録は一部のリクエストだけ。遅い SQL はすべてログに出す）
+    "METRICS_SAMPLE_RATE": 0.1,
+    "METRICS_SLOW_QUERY_MS": 200,
+    # 設定すると Authorization: Bearer <トークン> でも /admin/metrics を取得できる（Prometheus 用）
+    "METRICS_TOKEN": None,
+}
+
+
+def _convert(value, default):
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def load(overrides=None, environ=None):
+    """既定値・環境変数・overrides の順に重ねた設定の辞書を返す。"""
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULTS)
+    for name, default in DEFAULTS.items():
+        value = environ.get(ENV_PREFIX + name)
+        if value is None:
+            continue
+        try:
+            config[name] = _convert(value, default)
+        except ValueError:
+            raise ValueError(f"環境変数 {ENV_PREFIX}{name} の値が不正です: {value!r}")
+    config.update(overrides or {})
+    return config
+
+
+def create_base_app(config=None):
+    """設定とデータベースだけを持つ Flask アプリ。"""
+    app = Flask(__name__)
+    app.config.from_mapping(load(config))
+    if not app.config["SECRET_KEY"]:
+        app.config["SECRET_KEY"] = DEV_SECRET_KEY
+        logger.debug("MYQUEST_SECRET_KEY が未設定のため開発用の鍵を使います")
+    db_profile.configure(app, BASEDIR)
+    db.init_app(app)
+    db_profile.init_app(app)
+    return app
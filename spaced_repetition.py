@@ -0,0 +1,162 @@
+"""間隔反復（Leitner 方式）による出題。
+
+user_question_stats の各行は「箱」（box）と次に出題する時刻（due_at）を持つ。
+正解すると次の箱に進んで出題の間隔が延び、不正解なら最初の箱に戻る。
+mastery.record_outcomes が解答の保存と同じ upsert でこの2列も更新するので、
+出題する問題は (user_id, due_at) のインデックスを due_at の順に読むだけで決まり、
+解答履歴がどれだけ増えても手間は変わらない。
+
+期限の来た問題が足りなければ、まだ解答したことのない問題で補う。解答済みの問題は
+抽選した候補についてだけ調べるので、こちらも解答履歴の量には左右されない。
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, case, func, select
+
+from database import db
+from model import Question, UserQuestionStat
+from question_bank import question_bank
+from sampling import sample_ids
+
+# 箱ごとの出題間隔（0 番目は不正解の直後）
+LEITNER_INTERVALS = (
+    timedelta(minutes=10),
+    timedelta(days=1),
+    timedelta(days=3),
+    timedelta(days=7),
+    timedelta(days=14),
+    timedelta(days=30),
+)
+MAX_BOX = len(LEITNER_INTERVALS) - 1
+
+
+def next_box(box, is_correct):
+    return min(box + 1, MAX_BOX) if is_correct else 0
+
+
+def due_time(box, answered_at):
+    return answered_at + LEITNER_INTERVALS[box]
+
+
+def recompute(conn):
+    """user_question_stats の box と due_at を streak と last_seen から計算し直す（解答履歴は読まない）。
+
+    箱は正解で1つ進み不正解で 0 に戻るので、連続正解数（MAX_BOX まで）と同じになる。
+    """
+    stats = UserQuestionStat.__table__
+    box = case((stats.c.streak >= MAX_BOX, MAX_BOX), else_=stats.c.streak)
+    if conn.dialect.name == "sqlite":
+        # 日時は "YYYY-MM-DD HH:MM:SS.ffffff" の文字列なので、秒までを進めて小数部を付け直す
+        # （strftime に小数部ごと渡すとミリ秒に丸められて秒が繰り上がることがある）
+        due_at = case(*[
+            (box == b, func.strftime("%Y-%m-%d %H:%M:%S", func.substr(stats.c.last_seen, 1, 19),
+                                     f"+{int(interval.total_seconds())} seconds")
+             .concat(func.substr(stats.c.last_seen, 20)))
+            for b, interval in enumerate(LEITNER_INTERVALS)
+        ])
+        conn.execute(stats.update().values(box=box, due_at=due_at))
+        return
+
+    rows = conn.execute(select(stats.c.user_id, stats.c.question_id, stats.c.streak, stats.c.last_seen)).all()
+    if rows:
+        conn.execute(
+            stats.update()
+            .where(stats.c.user_id == bindparam("b_user_id"), stats.c.question_id == bindparam("b_question_id"))
+            .values(box=bindparam("b_box"), due_at=bindparam("b_due_at")),
+            [
+                {"b_user_id": user_id, "b_question_id": question_id, "b_box": min(streak, MAX_BOX),
+                 "b_due_at": due_time(min(streak, MAX_BOX), last_seen)}
+                for user_id, question_id, streak, last_seen in rows
+            ],
+        )
+
+
+def upsert_values(stats, excluded, answered_at):
+    """mastery.record_outcomes の ON CONFLICT DO UPDATE で使う box と due_at の式。
+
+    SET の式はすべて更新前の行を参照するので、新しい箱は stats.c.box から求める。
+    """
+    box = case(
+        (excluded.last_correct, case((stats.c.box >= MAX_BOX, MAX_BOX), else_=stats.c.box + 1)),
+        else_=0,
+    )
+    due_at = case(
+        (~excluded.last_correct, due_time(0, answered_at)),
+        *[(stats.c.box == b - 1, due_time(b, answered_at)) for b in range(1, MAX_BOX)],
+        else_=due_time(MAX_BOX, answered_at),
+    )
+    return {"box": box, "due_at": due_at}
+
+
+def due_question_ids(user_id, k, now=None):
+    """期限の来た問題のID（期限の古い順に最大 k 件）。"""
+    now = now or datetime.utcnow()
+    return list(db.session.execute(
+        select(UserQuestionStat.question_id)
+        .where(UserQuestionStat.user_id == user_id, UserQuestionStat.due_at <= now)
+        .order_by(UserQuestionStat.due_at)
+        .limit(k)
+    ).scalars())
+
+
+def next_due_at(user_id):
+    """次に期限の来る時刻。解答したことがなければ None。"""
+    return db.session.execute(
+        select(func.min(UserQuestionStat.due_at)).where(UserQuestionStat.user_id == user_id)
+    ).scalar()
+
+
+def pick_questions(user_id, k, now=None):
+    """期限の来た問題を優先し、足りなければ未解答の問題から選んで k 問を返す。"""
+    due_ids = due_question_ids(user_id, k, now)
+    questions = question_bank.get_many(due_ids)
+    if len(questions) < k:
+        questions += question_bank.get_many(unanswered_question_ids(user_id, k - len(questions), set(due_ids)))
+    return questions
+
+
+def unanswered_question_ids(user_id, k, exclude, rounds=3):
+    """解答したことのない問題のIDをランダムに最大 k 件。
+
+    解答済みの問題をすべて読み出すのではなく、問題バンクから候補を抽選して
+    そのうち解答済みのものだけを調べる（手間は解答履歴の量ではなく k に比例する）。
+    ほとんどの問題に解答済みで候補が当たらないときは、SQL の NOT EXISTS で残りを選ぶ。
+    """
+    ids = question_bank.snapshot().ids
+    exclude = set(exclude)
+    chosen = []
+    for _ in range(rounds):
+        candidates = sample_ids(ids, 2 * (k - len(chosen)) + 8, exclude)
+        if not candidates:
+            return chosen
+        exclude.update(candidates)
+        answered = set(db.session.execute(
+            select(UserQuestionStat.question_id)
+            .where(UserQuestionStat.user_id == user_id, UserQuestionStat.question_id.in_(candidates))
+        ).scalars())
+        chosen += [q_id for q_id in candidates if q_id not in answered][:k - len(chosen)]
+        if len(chosen) == k:
+            return chosen
+
+    answered = (
+        select(UserQuestionStat.question_id)
+        .where(UserQuestionStat.user_id == user_id, UserQuestionStat.question_id == Question.id)
+        .exists()
+    )
+    chosen += db.session.execute(
+        select(Question.id)
+        .where(~answered, Question.id.not_in(chosen))
+        .order_by(func.random())
+        .limit(k - len(chosen))
+    ).scalars()
+    return chosen
+
+
+def describe_wait(until, now=None):
+    """「あと3時間」のような次の出題までの待ち時間。"""
+    seconds = max((until - (now or datetime.utcnow())).total_seconds(), 0)
+    if seconds < 3600:
+        return f"{max(round(seconds / 60), 1)}分"
+    if seconds < 86400:
+        return f"{round(seconds / 3600)}時間"
+    return f"{round(seconds / 86400)}日"
@@ -0,0 +1,157 @@
+"""result_writer の書き込みのテスト（sync / async、キューが一杯のときの同期書き込み）。
+
+実行: python -m pytest -q tests
+"""
+import threading
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select, text
+
+import migrations
+import result_writer
+from database import db
+from model import QuizResult, UserQuestionStat
+from result_writer import ResultWriter
+
+USERS = 8
+QUESTIONS = 30
+SUBMISSIONS = 10
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + str(tmp_path / "test.db")
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        with db.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO users (id, email, password_hash) VALUES (:id, :email, 'x')"),
+                [{"id": i, "email": f"user{i}@example.com"} for i in range(1, USERS + 1)],
+            )
+            conn.execute(
+                text("INSERT INTO questions (id, question, correct, category) VALUES (:id, :q, 1, :c)"),
+                [{"id": i, "q": f"question {i}", "c": str(i % 3 + 1)} for i in range(1, QUESTIONS + 1)],
+            )
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def make_writer(app, mode, **config):
+    app.config.update(RESULT_WRITE_MODE=mode, **config)
+    writer = ResultWriter()
+    writer.init_app(app)
+    return writer
+
+
+def outcomes_for(user_id, n):
+    # ユーザーごとに問題を3問ずつずらし、同じ (ユーザー, 問題) を2回書かない
+    start = n * 3
+    return [(start + k + 1, (user_id + k) % 2 == 0) for k in range(3)]
+
+
+def submit_from_threads(app, writer):
+    errors = []
+
+    def client(user_id):
+        try:
+            for n in range(SUBMISSIONS):
+                with app.app_context():
+                    try:
+                        writer.submit(user_id, outcomes_for(user_id, n))
+                    finally:
+                        db.session.remove()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(user_id,)) for user_id in range(1, USERS + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def assert_written_once(app, users=range(1, USERS + 1), submissions=SUBMISSIONS):
+    expected = {
+        (user_id, question_id): is_correct
+        for user_id in users
+        for n in range(submissions)
+        for question_id, is_correct in outcomes_for(user_id, n)
+    }
+    with app.app_context():
+        rows = db.session.execute(
+            select(QuizResult.user_id, QuizResult.question_id, QuizResult.is_correct, func.count())
+            .group_by(QuizResult.user_id, QuizResult.question_id, QuizResult.is_correct)
+        ).all()
+        assert {(u, q): bool(c) for u, q, c, _ in rows} == expected
+        assert all(count == 1 for *_, count in rows)
+
+        stats = db.session.execute(
+            select(UserQuestionStat.user_id, UserQuestionStat.question_id, UserQuestionStat.attempts,
+                   UserQuestionStat.corrects)
+        ).all()
+        assert {(u, q): (a, c) for u, q, a, c in stats} == {
+            key: (1, int(is_correct)) for key, is_correct in expected.items()
+        }
+        db.session.remove()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_every_result_written_once(app, mode):
+    writer = make_writer(app, mode, RESULT_WRITE_BATCH_SIZE=16)
+    submit_from_threads(app, writer)
+    writer.flush()
+    assert writer.pending() == 0
+    assert_written_once(app)
+    writer.shutdown()
+
+
+def test_full_queue_falls_back_to_sync(app, monkeypatch):
+    writer = make_writer(app, "async", RESULT_QUEUE_SIZE=1, RESULT_QUEUE_PUT_TIMEOUT=0.01)
+    # 書き込みのスレッドを止めておき、キューを一杯にする
+    monkeypatch.setattr(writer, "_ensure_thread", lambda: None)
+    with app.app_context():
+        writer.submit(1, outcomes_for(1, 0))
+        assert writer.pending() == 1
+
+        writer.submit(2, outcomes_for(2, 0))
+        assert writer.pending() == 1
+        # キューに入らなかった分はその場で書かれている
+        written = db.session.execute(select(QuizResult.user_id).distinct()).scalars().all()
+        assert written == [2]
+        db.session.remove()
+
+    monkeypatch.undo()
+    writer._ensure_thread()
+    writer.flush()
+    assert_written_once(app, users=[1, 2], submissions=1)
+    writer.shutdown()
+
+
+def test_failing_entry_does_not_drop_batch(app, monkeypatch):
+    writer = make_writer(app, "async", RESULT_WRITE_BATCH_SIZE=USERS)
+    record_results = result_writer.record_results
+
+    def record_or_fail(user_id, outcomes, answered_at=None):
+        if user_id == 3:
+            raise ValueError("壊れた提出")
+        record_results(user_id, outcomes, answered_at)
+
+    monkeypatch.setattr(result_writer, "record_results", record_or_fail)
+    # すべての提出が1つのまとまりになるように、キューに入れてからスレッドを起動する
+    monkeypatch.setattr(writer, "_ensure_thread", lambda: None)
+    with app.app_context():
+        for user_id in range(1, USERS + 1):
+            writer.submit(user_id, outcomes_for(user_id, 0))
+    monkeypatch.undo()
+    monkeypatch.setattr(result_writer, "record_results", record_or_fail)
+
+    writer._ensure_thread()
+    writer.flush()
+    assert writer.pending() == 0
+    assert_written_once(app, users=[u for u in range(1, USERS + 1) if u != 3], submissions=1)
+    writer.shutdown()
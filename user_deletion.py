@@ -0,0 +1,216 @@
+"""ユーザーの削除（バックグラウンドで少しずつ行う）。
+
+delete_user はユーザーのロールを "deleted" にしてすぐに戻る（この時点でログインできなくなる）。
+バックグラウンドのスレッドが集計からそのユーザーの解答を引いたあと、
+quiz_results を USER_DELETE_CHUNK_SIZE 件ずつ別々のトランザクションで削除し、
+アーカイブ（retention.py）の解答と result_summaries を消し、最後に users の行を消す。
+削除待ちにする前に始まっていた解答の保存がその間にコミットされていることがあるので、
+users の行を消す直前に集計から引く・消す手順をもう一度行う（result_writer は削除待ちの
+ユーザーの結果を書かないので、2回目に残っているのはその分だけ）。
+1回の書き込みロックが短いので、履歴の多いユーザーを削除している間も他のユーザーの解答の保存は待たされない。
+
+スレッドは各プロセスの最初のリクエストで起動し（fork したワーカーでもそれぞれ）、
+ロールが "deleted" のまま残っているユーザー（途中で止まった削除）も処理する。
+その後も USER_DELETE_CLAIM_TIMEOUT 秒ごとに残っているユーザーを探す。
+複数のワーカーが同じユーザーを削除しないように、削除の前に users.deletion_claimed_at を
+条件付きの UPDATE で書き込んで引き受け、進めるたびに更新する。引き受けたワーカーが
+USER_DELETE_CLAIM_TIMEOUT 秒更新しなければ止まったとみなし、他のワーカーが続きを行う。
+手動での実行: python user_deletion.py
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, or_, select, text, update
+
+import retention
+import rollups
+from database import db
+from identity import DELETED_ROLE
+from model import User, UserQuestionStat
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+_DELETE_CHUNK = text(
+    "DELETE FROM quiz_results WHERE id IN "
+    "(SELECT id FROM quiz_results WHERE user_id = :user_id LIMIT :limit)"
+)
+
+
+def mark_deleted(user_id):
+    """ユーザーを削除待ちにする。commit は呼び出し側で行う。"""
+    db.session.execute(update(User).where(User.id == user_id).values(role=DELETED_ROLE))
+
+
+def claim(user_id, timeout):
+    """削除待ちのユーザーの削除を引き受ける。他のワーカーが進めている最中なら False。"""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(User.__table__)
+        .where(User.id == user_id, User.role == DELETED_ROLE,
+               or_(User.deletion_claimed_at.is_(None), User.deletion_claimed_at < now - timedelta(seconds=timeout)))
+        .values(deletion_claimed_at=now)
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def _renew_claim(user_id):
+    db.session.execute(update(User.__table__).where(User.id == user_id).values(deletion_claimed_at=datetime.utcnow()))
+
+
+def delete_user_data(user_id, chunk_size=2000, pause=0.05, claim_timeout=300.0):
+    """削除待ちのユーザーの解答履歴を少しずつ消し、最後にユーザーを消す。消した解答の件数を返す。
+
+    削除待ちでないか、他のワーカーが削除を進めているときは何もせずに None を返す。
+    """
+    if not claim(user_id, claim_timeout):
+        return None
+
+    deleted = _delete_results(user_id, chunk_size, pause)
+
+    # アーカイブに移した解答とその集計も消す
+    retention.forget_user(db.engine, retention.archive_path(current_app), user_id, chunk_size, pause)
+    _renew_claim(user_id)
+    db.session.commit()
+
+    # 削除待ちにする前に始まり、その後にコミットされた解答の保存の分
+    deleted += _delete_results(user_id, chunk_size, pause)
+
+    db.session.execute(delete(User.__table__).where(User.id == user_id))
+    db.session.commit()
+    return deleted
+
+
+def _delete_results(user_id, chunk_size, pause):
+    # 集計から引くのは、その解答の履歴が残っているうちに
+    rollups.forget_user(user_id)
+    db.session.execute(delete(UserQuestionStat.__table__).where(UserQuestionStat.user_id == user_id))
+    db.session.commit()
+
+    deleted = 0
+    while True:
+        count = db.session.execute(_DELETE_CHUNK, {"user_id": user_id, "limit": chunk_size}).rowcount
+        _renew_claim(user_id)
+        db.session.commit()
+        deleted += count
+        if count < chunk_size:
+            break
+        # 他のリクエストが書き込みロックを取れるように少し待つ
+        time.sleep(pause)
+    return deleted
+
+
+def pending_user_ids():
+    return list(db.session.execute(select(User.id).where(User.role == DELETED_ROLE)).scalars())
+
+
+class UserDeleter:
+    def __init__(self):
+        self.app = None
+        self.chunk_size = 2000
+        self.pause = 0.05
+        self.claim_timeout = 300.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.chunk_size = app.config.get("USER_DELETE_CHUNK_SIZE", self.chunk_size)
+        self.pause = app.config.get("USER_DELETE_PAUSE", self.pause)
+        self.claim_timeout = app.config.get("USER_DELETE_CLAIM_TIMEOUT", self.claim_timeout)
+        # fork の前（serve.py のマスター）ではスレッドを作らず、各プロセスの最初のリクエストで起動する。
+        # マイグレーション（migrations.init_app）の後に登録されるので、列が揃ってから探し始める
+        app.before_request(self._ensure_thread)
+        atexit.register(self.shutdown)
+
+    def submit(self, user_id):
+        """mark_deleted をコミットしたあとに呼ぶ。"""
+        self._ensure_thread()
+        self._queue.put(user_id)
+
+    def flush(self):
+        """キューに入っている削除がすべて終わるまで待つ。"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self):
+        # 途中の削除は次の起動時に続きから行うので、今のユーザーが終わったら止める
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_thread(self):
+        # fork したワーカーでも最初の削除時にスレッドを起動する
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="user-deleter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            # 前回の起動で終わらなかった削除を先に片付ける
+            self._sweep()
+
+            while True:
+                try:
+                    user_id = self._queue.get(timeout=self.claim_timeout)
+                except queue.Empty:
+                    # 引き受けたワーカーが止まった削除を引き継ぐ
+                    self._sweep()
+                    continue
+                try:
+                    if user_id is _STOP:
+                        return
+                    self._delete(user_id)
+                finally:
+                    db.session.remove()
+                    self._queue.task_done()
+
+    def _sweep(self):
+        try:
+            for user_id in pending_user_ids():
+                self._delete(user_id)
+        finally:
+            db.session.remove()
+
+    def _delete(self, user_id):
+        try:
+            started = time.perf_counter()
+            count = delete_user_data(user_id, self.chunk_size, self.pause, self.claim_timeout)
+            if count is None:
+                return
+            logger.info("ユーザー %s を削除しました（解答 %d 件、%.1f 秒）", user_id, count, time.perf_counter() - started)
+        except Exception:
+            db.session.rollback()
+            logger.exception("ユーザー %s の削除に失敗しました（次の起動時に再試行します）", user_id)
+
+
+user_deleter = UserDeleter()
+
+
+if __name__ == "__main__":
+    from settings import create_base_app
+
+    app = create_base_app()
+
+    with app.app_context():
+        for user_id in pending_user_ids():
+            count = delete_user_data(user_id, app.config["USER_DELETE_CHUNK_SIZE"], 0,
+                                     app.config["USER_DELETE_CLAIM_TIMEOUT"])
+            if count is None:
+                print(f"ユーザー {user_id} は他のプロセスが削除中です")
+            else:
+                print(f"ユーザー {user_id} を削除しました（解答 {count} 件）")
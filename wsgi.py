@@ -0,0 +1,7 @@
+"""外部の WSGI サーバー用のエントリーポイント（例: waitress-serve wsgi:app）。"""
+from app import create_app
+from password_pool import password_pool
+
+app = create_app()
+# サーバーがリクエストのスレッドを起動する前に、パスワードのハッシュ計算のプロセスを作る
+password_pool.start()